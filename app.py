@@ -1,23 +1,25 @@
 import streamlit as st
 import os
-import traceback
-import threading
 import time
 import json
 from dotenv import load_dotenv
-import openai
-from pydub import AudioSegment
-import math
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
+import resources
+import checkpoints
+import segments
+import job_status
+import history
+import job_queue
+import metrics
+import corrections
+import post_processing
+import scheduler
+import search_index
+import uploads
 from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
-# Constants
-BUCKET_NAME = "taglish-transcriber-v1.firebasestorage.app" 
-
 # Configure Page
 st.set_page_config(
     page_title="Taglish Meeting Transcriber",
@@ -38,6 +40,8 @@ def check_password():
     if st.session_state.get("authenticated", False):
         return True
 
+    # Connect to Firebase in the background while the password is typed
+    resources.warm_up()
     st.title("🔒 Login Required")
     password_input = st.text_input("Enter App Password", type="password")
     
@@ -59,34 +63,28 @@ def initialize_firebase():
     """
     Initializes Firebase Admin SDK if not already initialized.
     """
-    if not firebase_admin._apps:
-        try:
-            # Dual Auth Strategy: Local Key vs Cloud Identity
-            if os.path.exists("serviceAccountKey.json"):
-                cred = credentials.Certificate("serviceAccountKey.json")
-            else:
-                # Production: Use Google Cloud Identity (ADC)
-                print("🔑 Using Application Default Credentials (Cloud Run)")
-                cred = credentials.ApplicationDefault()
-                
-            firebase_admin.initialize_app(cred, {
-                'storageBucket': BUCKET_NAME 
-            })
-        except Exception as e:
-            st.error(f"Failed to initialize Firebase: {e}")
-            return None
-    return firestore.client()
+    try:
+        return resources.initialize_firebase()
+    except Exception as e:
+        st.error(f"Failed to initialize Firebase: {e}")
+        return None
 
 # Initialize Firebase on app load (Global Scope)
 db = initialize_firebase()
 
+# Jobs normally run in the separate worker service (python -m worker).
+# For local development, INLINE_WORKER=1 runs a worker loop inside this process.
+if db and os.getenv("INLINE_WORKER", "0") == "1":
+    import worker
+    worker.start_inline_worker(db)
+
 def upload_to_firebase(local_path, destination_path):
     """
     Uploads a file to Firebase Storage.
     """
     try:
         # Explicitly call the bucket by name to avoid default config issues
-        bucket = storage.bucket(name=BUCKET_NAME)
+        bucket = resources.get_bucket()
         blob = bucket.blob(destination_path)
         blob.upload_from_filename(local_path)
         # Make public for easy access (optional, usually keeps private)
@@ -97,186 +95,138 @@ def upload_to_firebase(local_path, destination_path):
         return None
 
 
-def generate_signed_upload_url(filename, content_type="audio/mpeg"):
-    """Generates a Signed URL for Direct-to-GCS upload."""
+def generate_upload_urls(filename, content_type="audio/mpeg"):
+    """Generates the Signed URLs for a Direct-to-GCS upload in parallel parts (see uploads.py)."""
     try:
-        bucket = storage.bucket(name=BUCKET_NAME)
-        blob = bucket.blob(f"uploads/{filename}")
-        
-        url = blob.generate_signed_url(
-            version="v4",
-            expiration=timedelta(minutes=15),
-            method="PUT",
-            content_type=content_type
-        )
-        return url, blob.name
+        return uploads.create_upload(resources.get_bucket(), filename, content_type)
     except Exception as e:
         st.error(f"Signed URL Error: {e}")
-        return None, None
-
-def format_timestamp(seconds):
-    """Converts seconds to [H:MM:SS] format for audio player compatibility."""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    sec = int(seconds % 60)
-    return f"[{hours}:{minutes:02d}:{sec:02d}]"
+        return None
 
-def transcribe_segment_with_timestamps(client, file_path, system_prompt, offset_seconds, temperature):
-    """Transcribes a chunk and returns text with global timestamps."""
+@st.fragment(run_every=uploads.POLL_SECONDS)
+def sign_more_upload_parts():
+    """Signs the rest of a long upload's part URLs once the browser's manifest is in (see uploads.py)."""
+    upload = st.session_state.get('upload')
+    part_urls = st.session_state.get('upload_part_urls')
+    if upload is None or part_urls is None or len(part_urls) >= upload['max_parts']:
+        return
     try:
-        with open(file_path, "rb") as audio_file:
-            response = client.audio.transcriptions.create(
-                model="whisper-1", 
-                file=audio_file, 
-                prompt=system_prompt,
-                temperature=temperature,
-                response_format="verbose_json" # Critical for timestamps
-            )
-            
-            segment_text = ""
-            for segment in response.segments:
-                start_time = segment.start + offset_seconds
-                text = segment.text.strip()
-                if text:
-                    ts = format_timestamp(start_time)
-                    segment_text += f"**{ts}** {text}\n\n"
-            
-            return segment_text
+        uploads.sign_more_parts(resources.get_bucket(), st.session_state['target_filename'], upload, part_urls)
     except Exception as e:
-        print(f"Error in segment: {e}")
-        return f"\n⚠️ [SYSTEM ERROR at {format_timestamp(offset_seconds)}]: {str(e)}\n"
+        print(f"Could not sign more upload part URLs: {e}")
 
-def background_worker(job_id, filename, context, temperature_setting, db):
+# A processing job without a heartbeat for this long has lost its worker
+STALE_JOB_SECONDS = 5 * 60
+
+def is_resumable(data):
+    """True for failed jobs and for processing jobs whose worker stopped sending heartbeats."""
+    status = data.get('status')
+    if status == 'error':
+        return True
+    heartbeat = data.get('last_heartbeat')
+    if status == 'processing' and heartbeat:
+        age = datetime.now(heartbeat.tzinfo) - heartbeat
+        return age.total_seconds() > STALE_JOB_SECONDS
+    return False
+
+# Seconds between status refreshes while a job runs (served from memory, no Firestore read)
+STATUS_REFRESH_SECONDS = 2
+
+@st.cache_resource
+def get_status_watcher():
+    """One status cache and listener set per process, shared by every session."""
+    return job_status.JobStatusWatcher(db)
+
+@st.cache_resource
+def get_chunk_feed():
+    """Finished chunks of running jobs, one listener per job shared by every session."""
+    return job_status.ChunkFeed(db)
+
+def resume_job(job_id, db):
+    """Puts a job back in the queue; finished chunks are skipped via their checkpoints."""
+    job_queue.get_queue(db).requeue(job_id)
+    get_status_watcher().forget(job_id)
+    history.bump_version(db)
+
+def load_job_transcript(doc_ref, data):
     """
-    The function that runs in a separate thread (The 'Plug-Out' Logic).
-    Now with streaming chunks and keepalive heartbeat for Cloud Run.
+    Returns the job's transcript as a SegmentList, or the legacy markdown
+    string for jobs saved before segment pages existed.
     """
-    try:
-        print(f"Starting Background Job {job_id} for {filename}")
-        doc_ref = db.collection("transcripts").document(job_id)
-        doc_ref.update({
-            "status": "processing", 
-            "progress": 0, 
-            "message": "Starting engine...",
-            "last_heartbeat": datetime.now()
-        })
-
-        # 1. Download from Storage (Direct Upload Location)
-        bucket = storage.bucket(name=BUCKET_NAME)
-        blob = bucket.blob(f"uploads/{filename}")
-        local_filename = f"temp_bg_{filename}"
-        
-        # Detect original file format
-        original_format = "mp3"  # default
-        if filename.lower().endswith(".m4a"):
-            original_format = "m4a"
-        elif filename.lower().endswith(".wav"):
-            original_format = "wav"
-        
-        doc_ref.update({"message": "Downloading from cloud storage..."})
-        blob.download_to_filename(local_filename)
-        
-        doc_ref.update({"message": "Analyzing audio file..."})
-        
-        # 2. Get audio metadata WITHOUT loading entire file into memory
-        # Use pydub's lightweight probe first
-        try:
-            from pydub.utils import mediainfo
-            info = mediainfo(local_filename)
-            duration_ms = float(info.get('duration', 0)) * 1000  # Convert to milliseconds
-        except Exception as e:
-            # Fallback: Load just to get duration then release memory
-            print(f"Mediainfo failed, using fallback: {e}")
-            audio_temp = AudioSegment.from_file(local_filename)
-            duration_ms = len(audio_temp)
-            del audio_temp  # Release memory immediately
-        
-        chunk_length_ms = 10 * 60 * 1000  # 10 mins
-        chunks = math.ceil(duration_ms / chunk_length_ms)
-        
-        doc_ref.update({
-            "message": f"File duration: {int(duration_ms/1000/60)} minutes. Processing {chunks} chunks...",
-            "total_chunks": chunks
-        })
-        
-        # 3. Setup OpenAI
-        api_key = os.getenv("OPENAI_API_KEY", "").strip()
-        client = openai.OpenAI(api_key=api_key)
-        system_prompt = (
-            "You are an expert transcriber for Taglish (Tagalog-English) church meetings. "
-            "Transcribe exactly what is said. "
-            "Context: " + context
-        )
+    if data.get('segment_pages'):
+        return segments.load_transcript(doc_ref) or segments.SegmentList()
+    if 'transcript' in data:
+        return data['transcript']
+    # Legacy jobs: the transcript is the only big field, so read it on its own
+    snapshot = doc_ref.get(field_paths=['transcript'])
+    return (snapshot.to_dict() or {}).get('transcript', '') if snapshot.exists else ''
 
-        full_transcript = ""
-        
-        # 4. Process Loop - Load and process ONE chunk at a time
-        for i in range(chunks):
-            # Update heartbeat to keep Cloud Run alive
-            doc_ref.update({
-                "progress": int((i / chunks) * 100),
-                "message": f"Transcribing chunk {i+1} of {chunks}...",
-                "last_heartbeat": datetime.now()
-            })
-            
-            start_ms = i * chunk_length_ms
-            end_ms = min((i + 1) * chunk_length_ms, duration_ms)
-            
-            # Load ONLY this chunk into memory
-            audio_chunk = AudioSegment.from_file(local_filename)[start_ms:end_ms]
-            
-            # Preserve original format - no conversion needed
-            chunk_name = f"chunk_{job_id}_{i}.{original_format}"
-            audio_chunk.export(chunk_name, format=original_format)
-            
-            # Release chunk from memory immediately
-            del audio_chunk
-            
-            # Offset logic for global timestamps
-            offset_seconds = (start_ms / 1000)
-            chunk_text = transcribe_segment_with_timestamps(
-                client, chunk_name, system_prompt, offset_seconds, temperature_setting
-            )
-            full_transcript += chunk_text
-            
-            # Clean up chunk file
-            if os.path.exists(chunk_name):
-                os.remove(chunk_name)
-            
-            # Periodic save to Firestore (every 5 chunks) for crash recovery
-            if (i + 1) % 5 == 0:
-                doc_ref.update({"transcript": full_transcript})
-        
-        # 5. Finish
-        doc_ref.update({
-            "status": "completed",
-            "progress": 100,
-            "message": "Done!",
-            "transcript": full_transcript,
-            "last_heartbeat": datetime.now()
-        })
-        
-        # Clean up downloaded file
-        if os.path.exists(local_filename):
-            os.remove(local_filename)
-            
-        print(f"Job {job_id} Completed Success.")
+def transcript_download_button(transcript, base_name, key, fmt="md"):
+    """Download button for a transcript, rendered from the segment model in the chosen format."""
+    if isinstance(transcript, str):
+        st.download_button("Download", transcript, file_name=f"{base_name}.txt", key=key)
+        return
+    label, _, extension, mime = segments.EXPORT_FORMATS[fmt]
+    st.download_button(
+        f"Download {label}", transcript.render(fmt),
+        file_name=f"{base_name}.{extension}", mime=mime, key=key
+    )
 
-    except Exception as e:
-        error_msg = f"Background Job Failed: {e}"
-        print(error_msg)
-        traceback.print_exc()
-        # Try to update DB with error
-        try:
-            doc_ref.update({
-                "status": "error", 
-                "message": str(e),
-                "last_heartbeat": datetime.now()
-            })
-        except:
-            pass
+# The change token is re-read at most every few seconds; the history list itself
+# is cached (across sessions) until the token changes, or briefly for progress bars
+HISTORY_TOKEN_TTL_SECONDS = 5
+HISTORY_TTL_SECONDS = 30
 
-# --- UI Layout ---
+@st.cache_data(ttl=HISTORY_TOKEN_TTL_SECONDS, show_spinner=False)
+def history_change_token():
+    return history.read_version(db)
+
+@st.cache_data(ttl=HISTORY_TTL_SECONDS, show_spinner=False)
+def load_history(change_token):
+    """Sidebar list: projection of the last 10 jobs, keyed by the change token."""
+    return history.fetch_history(db, limit=10)
+
+SEARCH_RESULTS = 30
+
+@st.cache_resource
+def get_search_index():
+    """One search index per server process; shards are synced from Storage as they appear."""
+    return search_index.get_index()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_segment_page(job_id, number):
+    """A stored transcript page, for the text of search hits."""
+    return segments.load_page(db.collection("transcripts").document(job_id), number)
+
+def render_search_results(query):
+    index = get_search_index()
+    if index is None:
+        st.caption("Search is turned off (SEARCH_INDEX=off).")
+        return
+    hits = index.search(query, limit=SEARCH_RESULTS)
+    if not hits:
+        st.caption("No matches.")
+        return
+    by_job = {}
+    for hit in hits:
+        by_job.setdefault(hit.job_id, []).append(hit)
+    for job_id, job_hits in by_job.items():
+        with st.expander(f"{job_hits[0].filename} ({len(job_hits)})"):
+            for hit in job_hits:
+                page = load_segment_page(job_id, hit.segment // segments.PAGE_SIZE) or {}
+                texts = page.get("text", [])
+                position = hit.segment - page.get("first_index", 0)
+                text = texts[position] if 0 <= position < len(texts) else ""
+                # Opens the job with the player at the hit's timestamp
+                if st.button(f"▶️ {segments.format_timestamp(hit.start)} {text[:80]}", key=f"hit_{job_id}_{hit.segment}"):
+                    st.session_state['job_id'] = job_id
+                    st.session_state['seek'] = {"job_id": job_id, "start": hit.start}
+                    st.rerun()
+
+def signed_audio_url(filename, upload_id=None):
+    """Short-lived GET URL so the browser can play the original upload."""
+    blob = resources.get_bucket().blob(uploads.object_name(filename, upload_id))
+    return blob.generate_signed_url(version="v4", expiration=timedelta(hours=1), method="GET")
 
 # --- UI Layout ---
 
@@ -293,14 +243,22 @@ with st.sidebar:
     }
     selected_temp = temp_map[model_selection]
     
+    st.divider()
+    st.subheader("Search")
+    search_query = st.text_input(
+        "Search what was said", placeholder='tithe, "magandang umaga", budg*', key="search_query"
+    )
+    if search_query and db:
+        render_search_results(search_query)
+
     st.divider()
     st.subheader("History")
 
     # History Logic
     if db:
-        history_docs = db.collection("transcripts").order_by("upload_date", direction=firestore.Query.DESCENDING).limit(10).stream()
-        for doc in history_docs:
-            data = doc.to_dict()
+        for data in load_history(history_change_token()):
+            doc_id = data['id']
+            doc_ref = db.collection("transcripts").document(doc_id)
             fname = data.get('filename', 'Unknown File')
             status = data.get('status', 'unknown')
             upload_date = data.get('upload_date')
@@ -313,18 +271,46 @@ with st.sidebar:
                 
                 with col_h1:
                     if status == 'completed':
-                        st.download_button("Download", data.get('transcript', ''), file_name=f"{fname}.txt", key=f"dl_{doc.id}")
+                        # The transcript is only fetched once a download is requested
+                        loaded_key = f"history_transcript_{doc_id}"
+                        if loaded_key in st.session_state:
+                            transcript_download_button(
+                                st.session_state[loaded_key], fname, key=f"dl_{doc_id}", fmt="txt"
+                            )
+                        elif st.button("📄 Download", key=f"prep_{doc_id}"):
+                            full_data = doc_ref.get(field_paths=['segment_pages']).to_dict() or {}
+                            st.session_state[loaded_key] = load_job_transcript(doc_ref, full_data)
+                            st.rerun()
                     elif status == 'processing':
                          st.progress(data.get('progress', 0))
-                         if st.button("Track", key=f"track_{doc.id}"):
-                            st.session_state['job_id'] = doc.id
+                         if st.button("Track", key=f"track_{doc_id}"):
+                            st.session_state['job_id'] = doc_id
+                            st.rerun()
+                    
+                    # Jobs whose worker died (stale heartbeat) or failed can pick up
+                    # from their last finished chunk
+                    if is_resumable(data):
+                        if st.button("▶️ Resume", key=f"resume_{doc_id}"):
+                            resume_job(doc_id, db)
+                            st.session_state['job_id'] = doc_id
                             st.rerun()
                 
                 with col_h2:
-                    if st.button("🗑️ Delete", key=f"del_{doc.id}"):
-                        db.collection("transcripts").document(doc.id).delete()
+                    if st.button("🗑️ Delete", key=f"del_{doc_id}"):
+                        checkpoints.delete_checkpoints(doc_ref)
+                        segments.delete_pages(doc_ref)
+                        metrics.delete_metrics(doc_ref)
+                        corrections.delete_log(doc_ref)
+                        post_processing.delete_documents(doc_ref)
+                        if get_search_index() is not None:
+                            try:
+                                get_search_index().remove(doc_id)
+                            except Exception as e:
+                                print(f"Search index update failed: {e}")
+                        doc_ref.delete()
+                        history.bump_version(db)
                         # If we just deleted the active job, reset state
-                        if st.session_state.get('job_id') == doc.id:
+                        if st.session_state.get('job_id') == doc_id:
                             del st.session_state['job_id']
                         st.rerun()
 
@@ -333,6 +319,10 @@ with st.sidebar:
 def render_upload_ui():
     st.markdown("### 1. Direct-to-Cloud Upload")
     context_input = st.text_area("Meeting Context", placeholder="Budget, Tithe, Pastor John...")
+    speaker_count = st.number_input(
+        "How many people (approx)?", min_value=0, max_value=8, value=0,
+        help="Used for Speaker A/B labels when speaker detection is enabled. 0 = detect automatically.",
+    )
     
     # Step 1: Define Filename
     col1, col2 = st.columns([3, 1])
@@ -364,130 +354,454 @@ def render_upload_ui():
         elif final_filename.lower().endswith(".wav"):
            mime_type = "audio/wav"
 
-        signed_url, blob_name = generate_signed_upload_url(final_filename, content_type=mime_type)
+        upload = generate_upload_urls(final_filename, content_type=mime_type)
         
-        if signed_url:
+        if upload:
             st.success(f"Ready to upload: {final_filename}")
-            st.session_state['signed_url'] = signed_url
+            st.session_state['upload'] = upload
+            # Kept apart from 'upload', which must not change while the uploader runs
+            st.session_state['upload_part_urls'] = list(upload['part_urls'])
             st.session_state['target_filename'] = final_filename
-            st.session_state['blob_name'] = blob_name
-            st.session_state['mime_type'] = mime_type
 
     # Step 2: HTML Upload
-    if 'signed_url' in st.session_state:
+    if 'upload' in st.session_state:
         st.markdown(f"**Target:** `{st.session_state['target_filename']}`")
         
-        # JS Uploader
+        # JS Uploader: sends the file in parts, several at a time, and
+        # retries a failed part on its own. Clicking again resumes.
+        sign_more_upload_parts()
         html_code = f"""
         <html>
         <body>
             <input type="file" id="fileInput" />
             <button onclick="uploadFile()">⬆️ Upload Now</button>
             <div id="status"></div>
+            <div id="hint"></div>
             <progress id="progressBar" value="0" max="100" style="width:100%; display:none;"></progress>
             
             <script>
-            function uploadFile() {{
+            var upload = {json.dumps(st.session_state['upload'])};
+            var done = {{}}, loaded = {{}}, doneFor = null, morePartUrls = null;
+
+            function setStatus(id, html) {{
+                document.getElementById(id).innerHTML = html;
+            }}
+            function showProgress(file) {{
+                var sent = 0;
+                for (var n in loaded) sent += loaded[n];
+                var percentComplete = (sent / file.size) * 100;
+                document.getElementById('progressBar').value = percentComplete;
+                document.getElementById('progressBar').style.display = 'block';
+                setStatus('status', 'Uploading: ' + Math.round(percentComplete) + '%');
+            }}
+            function put(url, body, contentType, onprogress) {{
+                return new Promise(function(resolve, reject) {{
+                    var xhr = new XMLHttpRequest();
+                    if (onprogress) xhr.upload.onprogress = onprogress;
+                    xhr.onload = function() {{
+                        if (xhr.status == 200 || xhr.status == 201) resolve();
+                        else reject(xhr.status + ' (' + xhr.statusText + ')');
+                    }};
+                    xhr.onerror = function() {{ reject('network error'); }};
+                    xhr.open("PUT", url, true);
+                    xhr.setRequestHeader("Content-Type", contentType);
+                    xhr.send(body);
+                }});
+            }}
+            function sleep(ms) {{
+                return new Promise(function(resolve) {{ setTimeout(resolve, ms); }});
+            }}
+            async function fetchPartUrls(parts) {{
+                // The app signs the rest once it has seen the manifest
+                for (var attempt = 0; attempt < 60; attempt++) {{
+                    try {{
+                        var response = await fetch(upload.part_urls_url, {{cache: 'no-store'}});
+                        if (response.ok) {{
+                            var more = (await response.json()).part_urls;
+                            if (more.length >= parts) {{
+                                upload.part_urls = more;
+                                return;
+                            }}
+                        }}
+                    }} catch (err) {{}}
+                    await sleep(2000);
+                }}
+                throw 'getting the upload links';
+            }}
+            async function sendPart(file, n) {{
+                if (!upload.part_urls[n]) await morePartUrls;
+                var part = file.slice(n * upload.part_size, Math.min(file.size, (n + 1) * upload.part_size));
+                for (var attempt = 0; ; attempt++) {{
+                    try {{
+                        await put(upload.part_urls[n], part, upload.content_type, function(e) {{
+                            loaded[n] = e.loaded;
+                            showProgress(file);
+                        }});
+                        done[n] = true;
+                        loaded[n] = part.size;
+                        showProgress(file);
+                        return;
+                    }} catch (err) {{
+                        loaded[n] = 0;
+                        if (attempt >= 5) throw 'part ' + (n + 1) + ': ' + err;
+                        await sleep(1000 * Math.pow(2, attempt));
+                    }}
+                }}
+            }}
+            async function uploadFile() {{
                 var fileInput = document.getElementById('fileInput');
                 if (fileInput.files.length === 0) {{
-                    document.getElementById('status').innerText = '⚠️ Please select a file first!';
+                    setStatus('status', '⚠️ Please select a file first!');
                     return;
                 }}
                 var file = fileInput.files[0];
-                var url = "{st.session_state['signed_url']}";
-                var serverMime = "{st.session_state['mime_type']}"; 
-                
-                var xhr = new XMLHttpRequest();
-                xhr.upload.onprogress = function(e) {{
-                    if (e.lengthComputable) {{
-                        var percentComplete = (e.loaded / e.total) * 100;
-                        document.getElementById('progressBar').value = percentComplete;
-                        document.getElementById('progressBar').style.display = 'block';
-                        document.getElementById('status').innerText = 'Uploading: ' + Math.round(percentComplete) + '%';
+                var parts = Math.max(1, Math.ceil(file.size / upload.part_size));
+                if (parts > upload.max_parts) {{
+                    setStatus('status', '❌ File is too large (max ' + Math.round(upload.max_parts * upload.part_size / 1048576) + ' MB).');
+                    return;
+                }}
+                if (doneFor !== file.name + ':' + file.size) {{
+                    done = {{}}; loaded = {{}}; doneFor = file.name + ':' + file.size;
+                }}
+                var manifest = JSON.stringify({{
+                    size: file.size, part_size: upload.part_size, parts: parts,
+                    content_type: upload.content_type, upload_id: upload.upload_id
+                }});
+                try {{
+                    await put(upload.manifest_url, manifest, "application/json", null);
+                    // The first parts go up while the rest of the links are signed
+                    if (parts > upload.part_urls.length) {{
+                        morePartUrls = fetchPartUrls(parts);
+                        morePartUrls.catch(function() {{}});
                     }}
-                }};
-                xhr.onload = function() {{
-                    if (xhr.status == 200 || xhr.status == 201) {{
-                        document.getElementById('status').innerHTML = '✅ <b>Upload Complete!</b><br>👇 Now click <b>Start Transcription</b> below.';
-                    }} else {{
-                        document.getElementById('status').innerText = '❌ Error: ' + xhr.status + ' (' + xhr.statusText + ')';
+                    // Lowest parts first, so transcription can start early
+                    var next = 0;
+                    async function sender() {{
+                        while (next < parts) {{
+                            var n = next++;
+                            if (!done[n]) await sendPart(file, n);
+                            if (n === 0) setStatus('hint', '▶️ You can already click <b>Start Transcription</b>; keep this tab open until the upload finishes.');
+                        }}
                     }}
-                }};
-                xhr.open("PUT", url, true);
-                xhr.setRequestHeader("Content-Type", serverMime); 
-                xhr.send(file);
+                    var senders = [];
+                    for (var i = 0; i < Math.min(upload.parallel, parts); i++) senders.push(sender());
+                    await Promise.all(senders);
+                    setStatus('status', '✅ <b>Upload Complete!</b>');
+                    setStatus('hint', '👇 Now click <b>Start Transcription</b> below (if you have not already).');
+                }} catch (err) {{
+                    setStatus('status', '❌ Upload failed at ' + err + '. Click Upload Now again to resume.');
+                }}
             }}
             </script>
         </body>
         </html>
         """
-        st.components.v1.html(html_code, height=150)
+        st.components.v1.html(html_code, height=170)
         
         st.markdown("### 2. Start Intelligence Engine")
         if st.button("🚀 Start Transcription"):
-            bucket = storage.bucket(name=BUCKET_NAME)
-            blob = bucket.blob(st.session_state['blob_name'])
-            
-            if blob.exists():
+            # Transcription may start while the later parts are still uploading
+            bucket = resources.get_bucket()
+            target_filename = st.session_state['target_filename']
+            upload_id = st.session_state['upload']['upload_id']
+            if uploads.can_start(bucket, target_filename, upload_id):
                 job_id = f"job_{int(time.time())}"
                 st.session_state['job_id'] = job_id
                 
-                # Create Init Doc
-                db.collection("transcripts").document(job_id).set({
-                    "filename": st.session_state['target_filename'],
+                # Create Init Doc and hand the job to the worker service
+                job_queue.submit_job(db, job_queue.get_queue(db), job_id, {
+                    "filename": target_filename,
+                    "upload_id": upload_id,
                     "upload_date": datetime.now(),
                     "status": "queued",
                     "progress": 0,
                     "message": "Queued context...",
-                    "context_provided": context_input
+                    "context_provided": context_input,
+                    "speaker_count": int(speaker_count),
+                    "temperature": selected_temp,
+                    # For the scheduler: quotas per organization, shortest jobs first
+                    "org_id": corrections.ORG_ID,
+                    "estimated_seconds": scheduler.estimate_audio_seconds(
+                        uploads.upload_size(bucket, target_filename, upload_id) or 0, target_filename
+                    ),
                 })
-                
-                # Spawn Thread
-                thread = threading.Thread(
-                    target=background_worker, 
-                    args=(job_id, st.session_state['target_filename'], context_input, selected_temp, db)
-                )
-                thread.start()
                 st.rerun()
             else:
-                st.error("File not found in cloud. Did you finish uploading?")
+                st.error("File not found in cloud. Did the upload start?")
 
 def render_monitor_ui(job_id):
     st.info(f"Monitoring Job: {job_id}")
     
     if st.button("Start New Upload"):
         del st.session_state['job_id']
-        if 'signed_url' in st.session_state: del st.session_state['signed_url']
+        if 'upload' in st.session_state: del st.session_state['upload']
         st.rerun()
     
-    # Poll Firestore
-    doc_ref = db.collection("transcripts").document(job_id)
-    doc = doc_ref.get()
-    
-    if doc.exists:
-        data = doc.to_dict()
-        status = data.get('status', 'unknown')
-        progress = data.get('progress', 0)
-        msg = data.get('message', '')
-        
-        st.subheader(f"Status: {status.upper()}")
-        st.progress(progress)
-        st.text(f"Log: {msg}")
-        
-        if status == 'completed':
-            st.success("Analysis Finished!")
-            st.text_area("Transcript", data.get('transcript', ''), height=400)
-            st.download_button("Download Text", data.get('transcript', ''), file_name="final.txt")
-        elif status == 'error':
-            st.error(f"Failed: {msg}")
+    data = get_status_watcher().get(job_id)
+    if data and data.get('status') in job_status.TERMINAL_STATUSES:
+        render_job_result(job_id, data)
     else:
+        render_live_status(job_id)
+
+@st.fragment(run_every=STATUS_REFRESH_SECONDS)
+def render_live_status(job_id):
+    """Re-runs on its own (not the whole script) and only reads the in-memory status cache."""
+    data = get_status_watcher().get(job_id)
+    
+    if data is None:
         st.warning("Job not found in database. It might have been deleted.")
         if st.button("Back to Home"):
             del st.session_state['job_id']
             st.rerun()
+        return
+    
+    status = data.get('status') or 'unknown'
+    if status in job_status.TERMINAL_STATUSES:
+        # Switch to the result view (full rerun, once)
+        get_chunk_feed().forget(job_id)
+        st.session_state.pop(f"live_{job_id}", None)
+        st.rerun()
     
-    time.sleep(2)
-    st.rerun()
+    st.subheader(f"Status: {status.upper()}")
+    st.progress(data.get('progress') or 0)
+    st.text(f"Log: {data.get('message', '')}")
+    if status == 'queued' and data.get('queue_position'):
+        estimated_start = data.get('estimated_start')
+        wait = ""
+        if estimated_start:
+            minutes = max(0, int((estimated_start - datetime.now(estimated_start.tzinfo)).total_seconds() // 60))
+            wait = f" · estimated start in about {minutes} min" if minutes else " · starting soon"
+        st.caption(f"Position {data['queue_position']} in the queue{wait}")
+    render_partial_transcript(job_id, data.get('total_chunks'))
+
+def render_partial_transcript(job_id, total_chunks):
+    """
+    Shows every chunk finished so far, in order, while the job is still running.
+    Only chunks that arrived since the last refresh are converted to markdown.
+    """
+    version, chunks = get_chunk_feed().get(job_id)
+    if not chunks:
+        st.caption("The transcript will appear here as soon as the first chunk is done.")
+        return
+
+    live = st.session_state.setdefault(f"live_{job_id}", {"version": None, "rendered": {}})
+    if live["version"] != version:
+        rendered = live["rendered"]
+        for index in chunks.keys() - rendered.keys():
+            rendered[index] = "".join(segments.SegmentList.from_dicts(chunks[index]).iter_markdown())
+        for index in rendered.keys() - chunks.keys():
+            del rendered[index]
+        live["version"] = version
+    rendered = live["rendered"]
+
+    # Chunks finish out of order; the first gap marks how far the text is continuous
+    first_gap = 0
+    while first_gap in rendered:
+        first_gap += 1
+    st.caption(
+        f"Partial transcript: {len(rendered)} of {total_chunks or '?'} chunks done"
+        + (f", continuous up to chunk {first_gap}" if first_gap < len(rendered) else "")
+    )
+    with st.container(height=400):
+        last = -1
+        for index in sorted(rendered):
+            if index != last + 1:
+                st.caption(f"⏳ Chunks {last + 2}-{index} still transcribing...")
+            st.markdown(rendered[index])
+            last = index
+    if first_gap:
+        st.download_button(
+            "📥 Download so far (.md)",
+            data="".join(rendered[index] for index in range(first_gap)),
+            file_name=f"partial_{job_id}.md",
+            mime="text/markdown",
+            key=f"dl_partial_{job_id}",
+        )
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_glossary():
+    return corrections.load_glossary(db)
+
+def render_search_replace(job_id, data, transcript):
+    """Global Search & Replace with the organization glossary; every replacement can be undone."""
+    doc_ref = db.collection("transcripts").document(job_id)
+    log_key = f"corrections_{job_id}"
+    if log_key not in st.session_state:
+        st.session_state[log_key] = corrections.load_log(doc_ref)
+    log = st.session_state[log_key]
+
+    def apply(matcher):
+        count = log.apply(transcript, matcher)
+        if count:
+            corrections.save_corrections(doc_ref, transcript, log, data.get('filename'), data.get('upload_date'))
+        st.toast(f"{count} replacements")
+
+    col_find, col_replace = st.columns(2)
+    find = col_find.text_input("Find", placeholder="Pasta John", key="sr_find")
+    replace = col_replace.text_input("Replace with", placeholder="Pastor John", key="sr_replace")
+    whole_word = st.checkbox("Whole words only", value=True, key="sr_whole_word")
+    if find:
+        entry = corrections.GlossaryEntry(find, replace, whole_word)
+        matcher = corrections.compile_glossary((entry,))
+        # Counted once per query and transcript state, not on every rerun
+        count_key = (job_id, entry, len(log.edits), sum(edit.undone for edit in log.edits))
+        if st.session_state.get('sr_count', (None,))[0] != count_key:
+            st.session_state['sr_count'] = (count_key, log.count(transcript, matcher))
+        st.caption(f"{st.session_state['sr_count'][1]} matches")
+        col_once, col_glossary = st.columns(2)
+        if col_once.button("Replace everywhere"):
+            apply(matcher)
+            st.rerun()
+        if col_glossary.button("Replace and add to glossary"):
+            corrections.save_glossary(db, [e for e in load_glossary() if e.find != find] + [entry])
+            load_glossary.clear()
+            apply(matcher)
+            st.rerun()
+
+    glossary = load_glossary()
+    if glossary:
+        if st.button(f"Apply glossary ({len(glossary)} entries)"):
+            apply(corrections.compile_glossary(glossary))
+            st.rerun()
+        with st.popover("Edit glossary"):
+            edited = st.data_editor(
+                [entry._asdict() for entry in glossary], num_rows="dynamic", key="glossary_editor"
+            )
+            if st.button("Save glossary"):
+                corrections.save_glossary(db, [
+                    corrections.GlossaryEntry(
+                        row["find"], row.get("replace") or "",
+                        bool(row.get("whole_word", True)), bool(row.get("case_sensitive", False)),
+                    )
+                    for row in edited if row.get("find")
+                ])
+                load_glossary.clear()
+                st.rerun()
+
+    active = [(number, edit) for number, edit in enumerate(log.edits) if not edit.undone]
+    if active:
+        st.caption(f"{len(active)} replacements (newest first)")
+        for number, edit in reversed(active[-50:]):
+            col_edit, col_undo = st.columns([6, 1])
+            col_edit.markdown(
+                f"{segments.format_timestamp(transcript.starts[edit.segment])} ~~{edit.before}~~ → **{edit.after}**"
+            )
+            if col_undo.button("Undo", key=f"undo_{job_id}_{number}"):
+                try:
+                    log.undo(transcript, number)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    corrections.save_corrections(doc_ref, transcript, log, data.get('filename'), data.get('upload_date'))
+                    st.rerun()
+
+def render_documents(job_id, transcript):
+    """Summary, action items, minutes or sermon guide from the (corrected) transcript."""
+    kind = st.selectbox(
+        "Document", list(post_processing.DOCUMENT_TYPES),
+        format_func=lambda k: post_processing.DOCUMENT_TYPES[k].label, key="document_kind"
+    )
+    doc_ref = db.collection("transcripts").document(job_id)
+    if st.button("✨ Generate", key="generate_document"):
+        bar = st.progress(0, text="Reading the transcript section by section...")
+        try:
+            document = post_processing.generate_for_job(
+                db, job_id, kind, transcript=transcript,
+                on_progress=lambda done, total: bar.progress(done / total, text=f"Section {done} of {total}"),
+            )
+        except Exception as e:
+            st.error(f"Could not generate the document: {e}")
+            return
+        bar.empty()
+        st.toast(f"{document['llm_calls']} sections sent to the model, {document['reused_calls']} reused")
+    else:
+        document = post_processing.load_document(doc_ref, kind)
+    if not document:
+        st.caption("Not generated yet.")
+        return
+    st.markdown(document["text"])
+    st.download_button(
+        "Download (.md)", document["text"], file_name=f"{kind}_{job_id}.md",
+        mime="text/markdown", key=f"dl_{kind}"
+    )
+
+
+def render_skipped_audio(job_id):
+    """Lists what the voice-activity filter left out of the transcript (see vad.py)."""
+    # Read once per job; the spans do not change after planning
+    if st.session_state.get('skipped_job_id') != job_id:
+        snapshot = db.collection("transcripts").document(job_id).get(field_paths=["skipped_spans"])
+        st.session_state['skipped_spans'] = (snapshot.to_dict() or {}).get("skipped_spans") or []
+        st.session_state['skipped_job_id'] = job_id
+    spans = st.session_state['skipped_spans']
+    if not spans:
+        return
+    minutes = sum(span["end"] - span["start"] for span in spans) / 60
+    with st.expander(f"⏭️ Not transcribed ({minutes:.1f} min of silence or music)"):
+        st.caption("These parts of the recording were skipped by the voice-activity filter (VAD_MODE).")
+        st.text("\n".join(
+            f"{segments.format_timestamp(span['start'])} - {segments.format_timestamp(span['end'])}  {span['kind']}"
+            for span in spans
+        ))
+
+
+def render_job_result(job_id, data):
+    status = data.get('status')
+    msg = data.get('message', '')
+    
+    st.subheader(f"Status: {status.upper()}")
+    st.progress(data.get('progress') or 0)
+    st.text(f"Log: {msg}")
+    
+    if status == 'completed':
+        st.success("Analysis Finished!")
+        # Fetch the transcript once per job, when it has completed
+        if st.session_state.get('transcript_job_id') != job_id:
+            doc_ref = db.collection("transcripts").document(job_id)
+            st.session_state['transcript'] = load_job_transcript(doc_ref, data)
+            st.session_state['transcript_job_id'] = job_id
+        transcript = st.session_state['transcript']
+
+        # Opened from a search hit: play the recording from that moment
+        seek = st.session_state.get('seek')
+        if seek and seek["job_id"] == job_id and data.get('filename'):
+            st.caption(f"Search hit at {segments.format_timestamp(seek['start'])}")
+            try:
+                st.audio(signed_audio_url(data['filename'], data.get('upload_id')), start_time=int(seek["start"]))
+            except Exception as e:
+                st.caption(f"Audio unavailable: {e}")
+        
+        if isinstance(transcript, str):
+            st.text_area("Transcript", transcript, height=400)
+            transcript_download_button(transcript, "final", key="dl_final")
+        else:
+            with st.expander("🔁 Global Search & Replace"):
+                render_search_replace(job_id, data, transcript)
+            with st.expander("🧾 Secretary Documents"):
+                render_documents(job_id, transcript)
+            st.text_area("Transcript", transcript.render("md"), height=400)
+            fmt = st.selectbox(
+                "Format", list(segments.EXPORT_FORMATS),
+                format_func=lambda f: segments.EXPORT_FORMATS[f][0], key="export_format"
+            )
+            transcript_download_button(transcript, "final", key="dl_final", fmt=fmt)
+        render_skipped_audio(job_id)
+    elif status == 'error':
+        st.error(f"Failed: {msg}")
+
+    if status in job_status.TERMINAL_STATUSES:
+        with st.expander("⏱️ Where the time went"):
+            # Read once per job; the record does not change after the job ends
+            if st.session_state.get('metrics_job_id') != job_id:
+                st.session_state['job_metrics'] = metrics.load_metrics(db.collection("transcripts").document(job_id))
+                st.session_state['metrics_job_id'] = job_id
+            record = st.session_state['job_metrics']
+            if record:
+                st.text(metrics.format_summary(record))
+                if record.get("chunks"):
+                    st.dataframe(record["chunks"], use_container_width=True)
+            else:
+                st.caption("No metrics were recorded for this job.")
 
 # --- Main Canvas ---
 st.title("🇵🇭 Taglish Transcriber (Async)")
@@ -0,0 +1,13 @@
+"""
+Offline benchmarks for the transcription pipeline.
+
+Runs background_worker end to end against synthetic recordings, a local fake
+of the OpenAI transcription endpoint and in-memory Firestore/Storage
+stand-ins, so pipeline changes can be measured without API spend or network:
+
+    python -m benchmarks.run --minutes 30 --format mp3 --latency 1.5 --rate-429 0.05
+    python -m benchmarks.report
+
+Each run records wall time, per-stage time, peak RSS and API call counts,
+tagged with the current git commit, in benchmarks/results.jsonl.
+"""
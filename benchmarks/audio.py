@@ -0,0 +1,48 @@
+"""
+Synthetic meeting recordings for benchmarks.
+
+Pink noise shaped like speech (syllable-rate tremolo, a few seconds of
+"talking" followed by a short pause) so the silence planner finds realistic
+cut points. An optional stretch of silence at the start stands in for the
+wait before a service, for the voice-activity filter. Files are generated
+once per set of parameters and reused.
+"""
+import os
+import subprocess
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+
+ENCODERS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "64k"],
+    "m4a": ["-c:a", "aac", "-b:a", "64k"],
+    "wav": ["-c:a", "pcm_s16le"],
+}
+
+
+def synthetic_recording(duration_seconds, fmt="mp3", sample_rate=44100, channels=2,
+                        talk_seconds=8, pause_seconds=1.5, lead_silence_seconds=0, directory=CACHE_DIR):
+    """Returns the path of a synthetic recording, generating it with ffmpeg if needed."""
+    os.makedirs(directory, exist_ok=True)
+    name = f"synthetic_{int(duration_seconds)}s_{sample_rate}hz_{channels}ch_{talk_seconds}-{pause_seconds}"
+    name += f"_lead{int(lead_silence_seconds)}s.{fmt}" if lead_silence_seconds else f".{fmt}"
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        return path
+
+    period = talk_seconds + pause_seconds
+    # Speech-like envelope: loud while "talking", near-silent during pauses
+    filters = (
+        "tremolo=f=4:d=0.7,"
+        f"volume='if(lt(t,{lead_silence_seconds}),0.001,if(lt(mod(t,{period}),{talk_seconds}),1,0.003))':eval=frame"
+    )
+    tmp_path = f"{path}.tmp.{fmt}"
+    command = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"anoisesrc=d={duration_seconds}:c=pink:r={sample_rate}:a=0.3",
+        "-af", filters,
+        "-ac", str(channels), "-ar", str(sample_rate),
+    ] + ENCODERS[fmt] + [tmp_path]
+    print(f"🎛️ Generating {name}...")
+    subprocess.run(command, check=True)
+    os.replace(tmp_path, path)
+    return path
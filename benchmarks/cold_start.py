@@ -0,0 +1,148 @@
+"""
+Cold start benchmark: how long a fresh instance takes to show the login page.
+
+    python -m benchmarks.cold_start
+    python -m benchmarks.cold_start --check    # exit 1 on a regression
+
+Every measurement runs in a fresh interpreter:
+
+- imports: each module app.py imports at the top, timed one by one, and
+           which heavy SDKs (firebase_admin, openai, pydub, ...) they pulled
+           in. The list should stay empty; SDKs load on first use (see
+           resources.py).
+- login:   app.py run to its login page with Streamlit's AppTest
+           (APP_PASSWORD set, no credentials needed).
+
+Results are appended to cold_start.jsonl with the current git commit and
+compared with the previous record.
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.run import REPO_ROOT, git_revision
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "cold_start.jsonl")
+HEAVY_MODULES = ["firebase_admin", "google.cloud.firestore", "google.cloud.storage", "openai", "httpx", "pydub", "numpy"]
+# A metric more than this much slower than the previous record is a regression
+REGRESSION_TOLERANCE = 0.25
+
+IMPORTS_CHILD = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+timings = {{}}
+started = time.perf_counter()
+for name in {names!r}:
+    t = time.perf_counter()
+    __import__(name)
+    timings[name] = round((time.perf_counter() - t) * 1000, 1)
+total = round((time.perf_counter() - started) * 1000, 1)
+print(json.dumps({{"import_ms": timings, "import_total_ms": total,
+                  "heavy_modules": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+LOGIN_CHILD = """
+import json, os, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(os.path.join({root!r}, "app.py"), default_timeout=120)
+app.run()
+print(json.dumps({{"login_ms": round((time.perf_counter() - started) * 1000, 1),
+                  "login_title": app.title[0].value if len(app.title) else None}}))
+"""
+
+
+def app_imports(path=os.path.join(REPO_ROOT, "app.py")):
+    """Modules imported at the top level of app.py, in order."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return list(dict.fromkeys(names))
+
+
+def run_child(code, env=None):
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output")
+    return json.loads(lines[-1])
+
+
+def measure():
+    record = run_child(IMPORTS_CHILD.format(root=REPO_ROOT, names=app_imports(), heavy=HEAVY_MODULES))
+    env = dict(os.environ, APP_PASSWORD="benchmark")
+    try:
+        record.update(run_child(LOGIN_CHILD.format(root=REPO_ROOT), env=env))
+    except RuntimeError as e:
+        print(f"Login page not measured: {e}")
+    return record
+
+
+def regressions(record, previous):
+    """Metrics that got slower than the previous record by more than the tolerance."""
+    found = []
+    for metric in ("import_total_ms", "login_ms"):
+        old, new = (previous or {}).get(metric), record.get(metric)
+        if old and new and new > old * (1 + REGRESSION_TOLERANCE):
+            found.append(f"{metric}: {old:.0f} -> {new:.0f} ms")
+    new_heavy = set(record.get("heavy_modules", [])) - set((previous or {}).get("heavy_modules", []))
+    if new_heavy:
+        found.append(f"heavy SDKs now imported at startup: {', '.join(sorted(new_heavy))}")
+    return found
+
+
+def load_previous(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        return json.loads(lines[-1]) if lines else None
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--results", default=RESULTS_PATH, help="where to append the result")
+    parser.add_argument("--no-record", action="store_true", help="print the result without saving it")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    commit, dirty = git_revision()
+    record = dict(
+        commit=commit,
+        dirty=dirty,
+        timestamp=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **measure(),
+    )
+    slowest = sorted(record["import_ms"].items(), key=lambda item: -item[1])[:5]
+    print(f"Top-level imports: {record['import_total_ms']:.0f} ms "
+          f"(slowest: {', '.join(f'{name} {ms:.0f}' for name, ms in slowest)})")
+    print(f"Heavy SDKs imported at startup: {', '.join(record['heavy_modules']) or 'none'}")
+    if "login_ms" in record:
+        print(f"Login page rendered in {record['login_ms']:.0f} ms")
+
+    found = regressions(record, load_previous(args.results))
+    for regression in found:
+        print(f"⚠️ Regression: {regression}")
+    if not args.no_record:
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"📈 Recorded in {args.results}")
+    if args.check and found:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+In-memory stand-ins for the Firestore client and the Storage bucket.
+
+They cover the subset of the firebase_admin API the pipeline uses: document
+get/set/update/delete (with DELETE_FIELD, SERVER_TIMESTAMP and Increment),
+subcollections, simple queries (where / order_by / limit / select) and
+document listeners. Reads and writes are counted so benchmarks can report
+Firestore traffic. Transactions are not supported; benchmarks call the
+pipeline directly rather than going through the job queue.
+"""
+import base64
+import copy
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+}
+
+
+def _apply(existing, data):
+    """Applies set/update data (with Firestore sentinels) on top of `existing`."""
+    result = dict(existing)
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            result.pop(key, None)
+        elif value is firestore.SERVER_TIMESTAMP:
+            result[key] = datetime.now(timezone.utc)
+        elif isinstance(value, firestore.Increment):
+            result[key] = (result.get(key) or 0) + value.value
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeWatch:
+    def __init__(self, db, path, callback):
+        self._db, self._path, self._callback = db, path, callback
+
+    def unsubscribe(self):
+        self._db._remove_listener(self._path, self)
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self._path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, self._path + (name,))
+
+    def get(self, field_paths=None, transaction=None):
+        data = self._db._read(self._path)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._db._write(self._path, data, merge=merge)
+
+    def update(self, data):
+        if self._db._read(self._path, count=False) is None:
+            raise KeyError(f"No document to update: {'/'.join(self._path)}")
+        self._db._write(self._path, data, merge=True)
+
+    def delete(self):
+        self._db._delete(self._path)
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self._db, self._path, callback)
+        self._db._add_listener(self._path, watch)
+        callback([self.get()], [], datetime.now(timezone.utc))
+        return watch
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit=None, fields=None):
+        self._db = db
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._fields = fields
+
+    def _copy(self, **changes):
+        settings = dict(filters=self._filters, orders=self._orders, limit=self._limit, fields=self._fields)
+        settings.update(changes)
+        return FakeQuery(self._db, self._path, **settings)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(field, _OPERATORS[op], value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field, direction == "DESCENDING")])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def stream(self):
+        documents = [
+            (path, data) for path, data in self._db._children(self._path)
+            if all(test(data.get(field), value) for field, test, value in self._filters)
+        ]
+        for field, descending in reversed(self._orders):
+            documents = [item for item in documents if item[1].get(field) is not None]
+            documents.sort(key=lambda item: item[1][field], reverse=descending)
+        if self._limit is not None:
+            documents = documents[:self._limit]
+        for path, data in documents:
+            self._db._count("reads")
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield FakeSnapshot(FakeDocumentReference(self._db, path), data)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._db, self._path + (document_id or uuid.uuid4().hex,))
+
+
+class FakeFirestore:
+    """Thread-safe in-memory document store with read/write counters."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = {}
+        self._listeners = {}
+        self.stats = {"reads": 0, "writes": 0, "deletes": 0}
+
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _read(self, path, count=True):
+        with self._lock:
+            if count:
+                self.stats["reads"] += 1
+            data = self._documents.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _write(self, path, data, merge=False):
+        with self._lock:
+            self.stats["writes"] += 1
+            existing = self._documents.get(path, {}) if merge else {}
+            self._documents[path] = _apply(existing, data)
+            listeners = list(self._listeners.get(path, ()))
+        self._notify(path, listeners)
+
+    def _delete(self, path):
+        with self._lock:
+            self.stats["deletes"] += 1
+            self._documents.pop(path, None)
+            listeners = list(self._listeners.get(path, ()))
+        self._notify(path, listeners)
+
+    def _children(self, collection_path):
+        """(path, data) for the documents directly inside a collection."""
+        with self._lock:
+            return [
+                (path, copy.deepcopy(data)) for path, data in self._documents.items()
+                if len(path) == len(collection_path) + 1 and path[:-1] == collection_path
+            ]
+
+    def _add_listener(self, path, watch):
+        with self._lock:
+            self._listeners.setdefault(path, []).append(watch)
+
+    def _remove_listener(self, path, watch):
+        with self._lock:
+            if watch in self._listeners.get(path, ()):
+                self._listeners[path].remove(watch)
+
+    def _notify(self, path, listeners):
+        if not listeners:
+            return
+        snapshot = FakeDocumentReference(self, path).get()
+        for watch in listeners:
+            watch._callback([snapshot], [], datetime.now(timezone.utc))
+
+
+class FakeBlob:
+    """A Storage object backed by a local file."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+
+    @property
+    def _path(self):
+        return os.path.join(self.bucket.root, self.name)
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def reload(self):
+        if not self.exists():
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        digest = hashlib.md5()
+        with open(self._path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self.size = os.path.getsize(self._path)
+        self.md5_hash = base64.b64encode(digest.digest()).decode()
+
+    def upload_from_filename(self, filename, content_type=None):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        shutil.copyfile(filename, self._path)
+        self.bucket.stats["uploads"] += 1
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self._path, filename)
+        self.bucket.stats["downloads"] += 1
+
+    def generate_signed_url(self, **kwargs):
+        # ffmpeg reads a local path the same way it reads the signed URL
+        self.bucket.stats["signed_urls"] += 1
+        return os.path.abspath(self._path)
+
+    def delete(self):
+        os.remove(self._path)
+
+
+class FakeBucket:
+    """A Storage bucket whose objects live under a local directory."""
+
+    def __init__(self, root, name="benchmark-bucket"):
+        self.root = root
+        self.name = name
+        self.stats = {"uploads": 0, "downloads": 0, "signed_urls": 0}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
@@ -0,0 +1,245 @@
+"""
+Local stand-in for the OpenAI transcription endpoint.
+
+Serves POST /v1/audio/transcriptions with a verbose_json response (one
+segment every few seconds of the uploaded audio) after a configurable
+latency, and POST /v1/chat/completions (for post_processing.py) with a
+short deterministic answer derived from the prompt. It enforces a requests-per-minute ceiling, injects random 429s,
+rejects uploads over Whisper's 25MB limit with a 413 and sends the same
+x-ratelimit-* headers as the real API. GET /stats returns call counts and
+POST /reset clears them.
+
+    python -m benchmarks.fake_openai --port 8765 --latency 1.0 --rate-429 0.05
+
+Point the pipeline at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+SEGMENT_SECONDS = 5
+
+
+def audio_duration(data):
+    """Duration in seconds of an uploaded audio file (via ffprobe)."""
+    with tempfile.NamedTemporaryFile(suffix=".audio", delete=False) as f:
+        f.write(data)
+        path = f.name
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        return float(result.stdout.strip() or 0)
+    except (OSError, ValueError):
+        return 0.0
+    finally:
+        os.remove(path)
+
+
+def multipart_file(body, content_type):
+    """Extracts the `file` part from a multipart/form-data body."""
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        head, _, content = part.partition(b"\r\n\r\n")
+        if b'name="file"' in head:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return b""
+
+
+def verbose_json(duration):
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(duration, start + SEGMENT_SECONDS)
+        segments.append({
+            "id": len(segments), "seek": 0, "start": start, "end": end,
+            "text": f" Synthetic segment {len(segments)}.", "tokens": [], "temperature": 0.0,
+            "avg_logprob": -0.25, "compression_ratio": 1.2, "no_speech_prob": 0.01,
+        })
+        start = end
+    return {
+        "task": "transcribe", "language": "tagalog", "duration": duration,
+        "text": "".join(segment["text"] for segment in segments), "segments": segments,
+    }
+
+
+def chat_completion(payload):
+    """A chat.completion that lists the first words of each timestamped line it was given."""
+    messages = payload.get("messages") or [{}]
+    user = messages[-1].get("content") or ""
+    lines = [line.strip() for line in user.splitlines() if line.strip()]
+    content = "\n".join(f"- {' '.join(line.split()[:8])}" for line in lines[:20]) or "None"
+    return {
+        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+        "model": payload.get("model", "fake"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": len(user) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(user) + len(content)) // 4},
+    }
+
+
+class FakeWhisper:
+    """Server state: settings, a sliding request window and counters."""
+
+    def __init__(self, latency=1.0, latency_per_minute=0.0, rate_429=0.0, requests_per_minute=500):
+        self.latency = latency
+        self.latency_per_minute = latency_per_minute
+        self.rate_429 = rate_429
+        self.requests_per_minute = requests_per_minute
+        self._lock = threading.Lock()
+        self._window = deque()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0, "ok": 0, "rate_limited": 0, "too_large": 0,
+                "audio_seconds": 0.0, "bytes": 0, "max_in_flight": 0, "chat_ok": 0,
+            }
+            self._in_flight = 0
+
+    def admit(self):
+        """Returns (status, remaining requests) for a new request."""
+        now = time.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            if len(self._window) >= self.requests_per_minute or random.random() < self.rate_429:
+                self.stats["rate_limited"] += 1
+                return 429, max(0, self.requests_per_minute - len(self._window))
+            self._window.append(now)
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            return 200, self.requests_per_minute - len(self._window)
+
+    def finish(self, status, size=0, duration=0.0, chat=False):
+        with self._lock:
+            self._in_flight -= 1
+            if status == 200 and chat:
+                self.stats["chat_ok"] += 1
+            elif status == 200:
+                self.stats["ok"] += 1
+                self.stats["audio_seconds"] += duration
+                self.stats["bytes"] += size
+            elif status == 413:
+                self.stats["too_large"] += 1
+
+    def reset_seconds(self):
+        with self._lock:
+            return max(0.0, 60 - (time.monotonic() - self._window[0])) if self._window else 0.0
+
+
+def make_handler(whisper):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _rate_headers(self, remaining):
+            return {
+                "x-ratelimit-limit-requests": str(whisper.requests_per_minute),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": f"{whisper.reset_seconds():.3f}s",
+            }
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with whisper._lock:
+                    self._send_json(200, dict(whisper.stats))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.rstrip("/") == "/reset":
+                whisper.reset()
+                self._send_json(200, {})
+                return
+            chat = self.path.rstrip("/").endswith("/chat/completions")
+            if not chat and not self.path.rstrip("/").endswith("/audio/transcriptions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            status, remaining = whisper.admit()
+            if status == 429:
+                headers = dict(self._rate_headers(remaining), **{"retry-after": "1"})
+                self._send_json(429, {"error": {
+                    "message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded",
+                }}, headers)
+                return
+
+            if chat:
+                time.sleep(whisper.latency)
+                whisper.finish(200, chat=True)
+                self._send_json(200, chat_completion(json.loads(body or b"{}")), self._rate_headers(remaining))
+                return
+
+            data = multipart_file(body, self.headers.get("Content-Type", ""))
+            if len(data) > MAX_UPLOAD_BYTES:
+                whisper.finish(413)
+                self._send_json(413, {"error": {
+                    "message": f"Maximum content size limit ({MAX_UPLOAD_BYTES}) exceeded", "type": "invalid_request_error",
+                }})
+                return
+
+            duration = audio_duration(data)
+            time.sleep(whisper.latency + whisper.latency_per_minute * duration / 60)
+            whisper.finish(200, len(data), duration)
+            self._send_json(200, verbose_json(duration), self._rate_headers(remaining))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, **settings):
+    """Starts the fake server in a background thread and returns (server, whisper)."""
+    whisper = FakeWhisper(**settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(whisper))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-whisper", daemon=True).start()
+    return server, whisper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI transcription server")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per request")
+    parser.add_argument("--latency-per-minute", type=float, default=0.0, help="extra seconds per minute of audio")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=500, help="requests-per-minute ceiling")
+    args = parser.parse_args()
+
+    server, _ = serve(
+        args.port, latency=args.latency, latency_per_minute=args.latency_per_minute,
+        rate_429=args.rate_429, requests_per_minute=args.rpm,
+    )
+    # The benchmark runner reads the port from this line
+    print(f"PORT {server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compares recorded benchmark runs across commits.
+
+    python -m benchmarks.report
+    python -m benchmarks.report --format wav --last 5
+
+Runs are grouped by their parameters (recording length, format, fake API
+settings), one table per group, oldest first.
+"""
+import argparse
+import json
+import os
+
+from benchmarks.run import RESULTS_PATH
+
+STAGES = ["open", "probe", "plan", "cut", "api", "checkpoint", "save"]
+
+
+def load_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def describe(params):
+    return (
+        f"{params['minutes']:g} min {params['format']} ({params['sample_rate']} Hz, {params['channels']} ch), "
+        f"latency {params['latency']:g}s + {params['latency_per_minute']:g}s/min, "
+        f"429 rate {params['rate_429']:g}, {params['rpm']} rpm"
+        + (", warm cache" if params.get("warm_cache") else "")
+        + (f", {params['engine']} engine" if params.get("engine", "openai") != "openai" else "")
+        + (f", {params['lead_silence']:g}s lead silence" if params.get("lead_silence") else "")
+        + (f", VAD {params['vad']}" if params.get("vad", "off") != "off" else "")
+        + (f", post-processing {params['post_process']}" if params.get("post_process") else "")
+    )
+
+
+def format_row(record):
+    api = record.get("api", {})
+    stages = record.get("stages", {})
+    commit = (record.get("commit") or "?") + ("*" if record.get("dirty") else "")
+    cells = [
+        f"{commit:<9}",
+        f"{record.get('status', '?'):<9}",
+        f"{record['wall_seconds']:>8.1f}",
+        f"{record.get('time_to_first_text_seconds') or 0:>6.1f}",
+        f"{record.get('rtf_per_core') or 0:>7.3f}",
+        f"{record['peak_rss_mb']:>7.0f}",
+        f"{record.get('peak_ffmpeg_rss_mb', 0):>7.0f}",
+        f"{api.get('requests', 0):>5}",
+        f"{api.get('rate_limited', 0):>5}",
+    ]
+    cells += [f"{stages.get(stage, {}).get('seconds', 0):>7.1f}" for stage in STAGES]
+    return "  ".join(cells) + (f"  {record['label']}" if record.get("label") else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results across commits")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--format", help="only show runs for this audio format")
+    parser.add_argument("--last", type=int, default=10, help="runs to show per group")
+    args = parser.parse_args()
+
+    groups = {}
+    for record in load_results(args.results):
+        if args.format and record["params"]["format"] != args.format:
+            continue
+        groups.setdefault(json.dumps(record["params"], sort_keys=True), []).append(record)
+
+    if not groups:
+        print("No benchmark results yet. Run: python -m benchmarks.run")
+        return
+
+    header = "  ".join(
+        [f"{'commit':<9}", f"{'status':<9}", f"{'wall s':>8}", f"{'1st s':>6}", f"{'RTF/cr':>7}", f"{'RSS MB':>7}", f"{'ffm MB':>7}",
+         f"{'calls':>5}", f"{'429s':>5}"] + [f"{stage:>7}" for stage in STAGES]
+    )
+    for key, records in groups.items():
+        print(f"\n📊 {describe(json.loads(key))}")
+        print(header)
+        for record in records[-args.last:]:
+            print(format_row(record))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Benchmark runner: one transcription job, end to end, fully offline.
+
+    python -m benchmarks.run --minutes 30 --format mp3
+    python -m benchmarks.run --minutes 120 --format wav --latency 2 --rate-429 0.1 --rpm 50
+    python -m benchmarks.run --minutes 30 --warm-cache --label "cache hit"
+    python -m benchmarks.run --minutes 10 --engine local --label "faster-whisper small int8"
+    python -m benchmarks.run --minutes 60 --lead-silence 600 --vad speech
+    python -m benchmarks.run --minutes 180 --post-process minutes
+
+The runner generates (or reuses) a synthetic recording, starts the fake
+Whisper server and runs the job in a fresh child process so peak RSS belongs
+to that job alone. Results are printed and appended to results.jsonl with
+the current git commit; see benchmarks.report to compare commits.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.request import Request, urlopen
+
+from benchmarks.audio import synthetic_recording
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results.jsonl")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StageTimer:
+    """Accumulates time and call counts per pipeline stage (threads add up, so stages overlap)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def wrap(self, module, name, stage):
+        """Replaces module.name with a version that is timed under `stage`."""
+        original = getattr(module, name)
+        timer = self
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timer.add(stage, time.perf_counter() - started)
+
+        setattr(module, name, timed)
+
+    def wrap_generator(self, module, name, stage):
+        """Like wrap(), for generator functions: times the first item to exhaustion."""
+        original = getattr(module, name)
+        timer = self
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                yield from original(*args, **kwargs)
+            finally:
+                timer.add(stage, time.perf_counter() - started)
+
+        setattr(module, name, timed)
+
+
+def git_revision():
+    """(short commit hash, True if the working tree has uncommitted changes)."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, False
+
+
+def run_job(settings):
+    """Child process: runs one job against the fakes and returns its measurements."""
+    sys.path.insert(0, REPO_ROOT)
+    # Imported here so the environment set by the parent applies to module constants
+    import checkpoints
+    import chunk_planner
+    import chunker
+    import engines
+    import ingest
+    import metrics
+    import pipeline
+    import rate_limit
+    import resources
+    import segments
+    from benchmarks.fake_firebase import FakeBucket, FakeFirestore
+
+    workdir = settings["workdir"]
+    os.chdir(workdir)
+    db = FakeFirestore()
+    bucket = FakeBucket(os.path.join(workdir, "bucket"))
+    resources.get_bucket = lambda: bucket
+
+    filename = os.path.basename(settings["audio_path"])
+    bucket.blob(f"uploads/{filename}").upload_from_filename(settings["audio_path"])
+
+    timer = StageTimer()
+    timer.wrap(ingest, "open_source", "open")
+    timer.wrap(chunker, "probe", "probe")
+    timer.wrap_generator(chunk_planner, "iter_envelope", "plan")
+    timer.wrap(chunker, "_run_ffmpeg_slice", "cut")
+    timer.wrap(pipeline, "request_segments", "api")
+    engine = engines.select_engine(settings["audio_seconds"])
+    timer.wrap(checkpoints, "save_checkpoint", "checkpoint")
+    timer.wrap(segments, "save_pages", "save")
+
+    job_id = "benchmark-job"
+    db.collection("transcripts").document(job_id).set({
+        "filename": filename,
+        "status": "queued",
+        "upload_date": datetime.now(timezone.utc),
+    })
+
+    started = time.perf_counter()
+    pipeline.background_worker(job_id, filename, settings.get("context", ""), 0.0, db)
+    wall = time.perf_counter() - started
+
+    job_ref = db.collection("transcripts").document(job_id)
+    post = run_post_processing(db, job_id, settings["post_process"]) if settings.get("post_process") else None
+    job = job_ref.get().to_dict()
+    job_metrics = metrics.load_metrics(job_ref) or {}
+    cores = engine.cpu_threads if engine.name == "local" else (os.cpu_count() or 1)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "status": job.get("status"),
+        "message": job.get("message"),
+        "chunks": job.get("total_chunks"),
+        "segments": job.get("segment_count"),
+        "wall_seconds": round(wall, 3),
+        "stages": {
+            stage: {"seconds": round(entry["seconds"], 3), "calls": entry["calls"]}
+            for stage, entry in sorted(timer.stages.items())
+        },
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(own.ru_maxrss / 1024, 1),
+        "peak_ffmpeg_rss_mb": round(children.ru_maxrss / 1024, 1),
+        "cpu_seconds": round(own.ru_utime + own.ru_stime, 2),
+        "ffmpeg_cpu_seconds": round(children.ru_utime + children.ru_stime, 2),
+        "engine": engine.model_id,
+        "realtime_factor": job_metrics.get("realtime_factor"),
+        # Wall time x cores used per second of audio, and CPU seconds per second of audio
+        "rtf_per_core": round(wall * cores / settings["audio_seconds"], 4),
+        "cpu_rtf": round((own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime) / settings["audio_seconds"], 4),
+        "cores": cores,
+        "time_to_first_text_seconds": job_metrics.get("time_to_first_text_seconds"),
+        "vad": job_metrics.get("vad"),
+        "chunk_realtime_factors": [chunk.get("realtime_factor") for chunk in job_metrics.get("chunks", [])],
+        "firestore": dict(db.stats),
+        "storage": dict(bucket.stats),
+        "limiter": rate_limit.get_limiter().stats(),
+        "post_processing": post,
+    }
+
+
+def run_post_processing(db, job_id, kind):
+    """Generates a document three times: fresh, unchanged, and after editing one segment."""
+    import post_processing
+    import segments
+
+    job_ref = db.collection("transcripts").document(job_id)
+    runs = {}
+    for run in ("fresh", "unchanged", "after_edit"):
+        if run == "after_edit":
+            transcript = segments.load_transcript(job_ref)
+            middle = len(transcript) // 2
+            transcript.texts[middle] += " (edited)"
+            segments.save_pages(job_ref, transcript)
+        started = time.perf_counter()
+        document = post_processing.generate_for_job(db, job_id, kind)
+        runs[run] = {
+            "seconds": round(time.perf_counter() - started, 3),
+            "llm_calls": document["llm_calls"],
+            "reused_calls": document["reused_calls"],
+        }
+    return dict(runs, kind=kind, sections=len(document["section_keys"]))
+
+
+def start_fake_server(args):
+    """Starts the fake Whisper server in its own process and returns (process, base_url)."""
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_openai", "--port", "0",
+            "--latency", str(args.latency), "--latency-per-minute", str(args.latency_per_minute),
+            "--rate-429", str(args.rate_429), "--rpm", str(args.rpm),
+        ],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    line = process.stdout.readline()
+    if not line.startswith("PORT "):
+        process.kill()
+        raise RuntimeError("Fake Whisper server did not start")
+    return process, f"http://127.0.0.1:{line.split()[1]}"
+
+
+def server_call(base_url, path, method="GET"):
+    with urlopen(Request(base_url + path, method=method, data=b"" if method == "POST" else None)) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline transcription pipeline benchmark")
+    parser.add_argument("--minutes", type=float, default=30, help="length of the synthetic recording")
+    parser.add_argument("--format", choices=["mp3", "m4a", "wav"], default="mp3")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake API seconds per request")
+    parser.add_argument("--latency-per-minute", type=float, default=0.5, help="fake API seconds per minute of audio")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=500, help="fake API requests-per-minute ceiling")
+    parser.add_argument("--engine", choices=["openai", "local", "auto"], default="openai",
+                        help="transcription engine (openai uses the fake server)")
+    parser.add_argument("--lead-silence", type=float, default=0, help="seconds of silence at the start of the recording")
+    parser.add_argument("--vad", choices=["off", "silence", "speech"], default="off",
+                        help="voice-activity filter mode (VAD_MODE)")
+    parser.add_argument("--post-process", choices=["summary", "action_items", "minutes", "sermon_guide"],
+                        help="also generate this document from the transcript (fake chat endpoint)")
+    parser.add_argument("--warm-cache", action="store_true", help="run the job twice and measure the second run")
+    parser.add_argument("--label", default="", help="free-form note stored with the result")
+    parser.add_argument("--results", default=RESULTS_PATH, help="where to append the result")
+    parser.add_argument("--no-record", action="store_true", help="print the result without saving it")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print("BENCHMARK_RESULT " + json.dumps(run_job(json.loads(args.child))), flush=True)
+        return
+
+    audio_path = synthetic_recording(
+        int(args.minutes * 60), args.format, sample_rate=args.sample_rate, channels=args.channels,
+        lead_silence_seconds=args.lead_silence,
+    )
+    server, base_url = start_fake_server(args)
+    workdir = tempfile.mkdtemp(prefix="transcriber_bench_")
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"{base_url}/v1",
+        OPENAI_API_KEY="benchmark",
+        TRANSCRIPT_CACHE_DIR=os.path.join(workdir, "cache"),
+        TRANSCRIPT_CACHE_FIRESTORE="0",
+        TRANSCRIBE_ENGINE=args.engine,
+        VAD_MODE=args.vad,
+        SEARCH_INDEX="local",
+        SEARCH_INDEX_DIR=os.path.join(workdir, "search_index"),
+    )
+    settings = json.dumps({
+        "workdir": workdir, "audio_path": os.path.abspath(audio_path), "audio_seconds": int(args.minutes * 60),
+        "post_process": args.post_process,
+    })
+
+    try:
+        for attempt in range(2 if args.warm_cache else 1):
+            server_call(base_url, "/reset", method="POST")
+            child = subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", "--child", settings],
+                cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, text=True,
+            )
+            lines = [line for line in child.stdout.splitlines() if line.startswith("BENCHMARK_RESULT ")]
+            if child.returncode != 0 or not lines:
+                print(child.stdout)
+                raise SystemExit(f"Benchmark job failed (exit code {child.returncode})")
+        measurements = json.loads(lines[-1][len("BENCHMARK_RESULT "):])
+        measurements["api"] = server_call(base_url, "/stats")
+    finally:
+        server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit, dirty = git_revision()
+    record = dict(
+        commit=commit,
+        dirty=dirty,
+        timestamp=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        label=args.label,
+        params={
+            "minutes": args.minutes, "format": args.format, "sample_rate": args.sample_rate,
+            "channels": args.channels, "latency": args.latency, "latency_per_minute": args.latency_per_minute,
+            "rate_429": args.rate_429, "rpm": args.rpm, "warm_cache": args.warm_cache, "engine": args.engine,
+            "lead_silence": args.lead_silence, "vad": args.vad, "post_process": args.post_process,
+        },
+        **measurements,
+    )
+    print(json.dumps(record, indent=2))
+    if not args.no_record:
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"📈 Recorded in {args.results}")
+
+
+if __name__ == "__main__":
+    main()
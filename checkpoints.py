@@ -0,0 +1,84 @@
+"""
+Per-chunk checkpoints for resumable transcription jobs.
+
+Each finished chunk is written as its own small document under
+transcripts/{job_id}/chunks/{index}, so a job interrupted by a container
+restart (or picked up by another instance) only redoes the missing chunks.
+The chunk plan is stored on the job document so a resumed job cuts exactly
+the same chunks as the original run.
+"""
+from datetime import datetime
+
+CHUNKS_COLLECTION = "chunks"
+# Fields of a Whisper segment worth keeping (times are global, in seconds)
+SEGMENT_FIELDS = ("start", "end", "text", "avg_logprob")
+
+
+def chunk_doc_id(index):
+    """Zero-padded so documents list in chunk order."""
+    return f"{index:05d}"
+
+
+def save_plan(doc_ref, plan):
+    """Stores the chunk plan as a flat list of boundaries [0, cut1, cut2, ..., end]."""
+    boundaries = [plan[0].start_ms] + [spec.end_ms for spec in plan] if plan else []
+    doc_ref.update({"chunk_plan_ms": boundaries})
+
+
+def load_plan(snapshot, spec_type):
+    """Rebuilds the stored chunk plan from a job snapshot, or None if there is none."""
+    data = snapshot.to_dict() or {}
+    boundaries = data.get("chunk_plan_ms")
+    if not boundaries or len(boundaries) < 2:
+        return None
+    return [
+        spec_type(i, boundaries[i], boundaries[i + 1])
+        for i in range(len(boundaries) - 1)
+    ]
+
+
+def global_segments(segments, offset_seconds):
+    """Shifts chunk-relative Whisper segments to global times, keeping only stored fields."""
+    shifted = []
+    for segment in segments:
+        item = {field: segment.get(field) for field in SEGMENT_FIELDS}
+        item["start"] = segment["start"] + offset_seconds
+        item["end"] = segment.get("end", segment["start"]) + offset_seconds
+        shifted.append(item)
+    return shifted
+
+
+def save_checkpoint(doc_ref, index, start_ms, end_ms, segments):
+    """Records a finished chunk. `segments` must already use global times."""
+    doc_ref.collection(CHUNKS_COLLECTION).document(chunk_doc_id(index)).set({
+        "index": index,
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "segments": segments,
+        "completed_at": datetime.now(),
+    })
+
+
+def load_checkpoints(doc_ref):
+    """Returns {index: checkpoint dict} for every chunk finished so far, by any instance."""
+    checkpoints = {}
+    for doc in doc_ref.collection(CHUNKS_COLLECTION).stream():
+        data = doc.to_dict()
+        checkpoints[data["index"]] = data
+    return checkpoints
+
+
+def is_done(checkpoints, spec):
+    """True if the checkpoint for this chunk covers exactly the planned range."""
+    checkpoint = checkpoints.get(spec.index)
+    return (
+        checkpoint is not None
+        and checkpoint.get("start_ms") == spec.start_ms
+        and checkpoint.get("end_ms") == spec.end_ms
+    )
+
+
+def delete_checkpoints(doc_ref):
+    """Removes every chunk checkpoint (Firestore does not cascade document deletes)."""
+    for doc in doc_ref.collection(CHUNKS_COLLECTION).stream():
+        doc.reference.delete()
@@ -0,0 +1,162 @@
+"""
+Silence-aware, size-bounded chunk planner.
+
+Implements the "Anti-Crash" chunking logic from PROJECT_DEFINITION.md §3B:
+every chunk stays under Whisper's 25MB upload limit, and each cut is moved to
+the quietest stretch of audio near the cut point so words are not split.
+
+Silence detection runs on a cheap RMS envelope (mono, 8 kHz, one value per
+50ms window) streamed out of ffmpeg, never on full-rate AudioSegment objects,
+so planning a 3-hour file takes seconds and a few MB of RAM.
+"""
+import math
+import os
+from array import array
+from collections import namedtuple
+
+try:
+    import audioop
+except ImportError:  # Python 3.13+ ships it as audioop-lts
+    from pydub import pyaudioop as audioop
+
+from pydub import AudioSegment
+
+from chunker import decoder_error, ffmpeg_input, start_decoder
+
+# Whisper rejects uploads over 25MB; keep a safety margin for container overhead
+BYTE_BUDGET = int(os.getenv("CHUNK_BYTE_BUDGET", str(24 * 1024 * 1024)))
+# Upper bound on chunk length even when the byte budget would allow more
+MAX_CHUNK_MS = int(os.getenv("CHUNK_MAX_SECONDS", "600")) * 1000
+# How far before the hard cut point we look for a pause
+SEARCH_WINDOW_MS = 60 * 1000
+# Length of the pause we look for ("pauses > 1000ms")
+MIN_SILENCE_MS = 1000
+# Anything quieter than this is reported as silence in the job log
+SILENCE_DBFS = -40
+
+ENVELOPE_SAMPLE_RATE = 8000
+ENVELOPE_WINDOW_MS = 50
+
+ChunkSpec = namedtuple("ChunkSpec", ["index", "start_ms", "end_ms"])
+
+
+def max_chunk_ms_for_budget(bit_rate, byte_budget=BYTE_BUDGET, max_chunk_ms=MAX_CHUNK_MS):
+    """Longest chunk (in ms) whose encoded size at `bit_rate` fits the byte budget."""
+    if not bit_rate:
+        return max_chunk_ms
+    budget_ms = int(byte_budget * 8 / bit_rate * 1000)
+    return max(MIN_SILENCE_MS * 2, min(max_chunk_ms, budget_ms))
+
+
+def iter_envelope(source_path, sample_rate=ENVELOPE_SAMPLE_RATE, window_ms=ENVELOPE_WINDOW_MS):
+    """
+    Yields the RMS of each `window_ms` window of the source, decoded as mono
+    8 kHz PCM. Raises RuntimeError (with ffmpeg's messages) if the decode fails.
+    """
+    window_bytes = int(sample_rate * window_ms / 1000) * 2
+    command = [
+        AudioSegment.converter, "-v", "error",
+    ] + ffmpeg_input(source_path) + [
+        "-vn",
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate), "-ac", "1",
+        "pipe:1",
+    ]
+    process, stderr = start_decoder(command)
+    try:
+        while True:
+            window = process.stdout.read(window_bytes)
+            if len(window) < 2:
+                break
+            if len(window) % 2:
+                window = window[:-1]
+            yield audioop.rms(window, 2)
+        # A decode that stopped on an error must not pass for the end of the file
+        error = decoder_error(process, stderr)
+        if error:
+            raise RuntimeError(error)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        stderr.close()
+
+
+def rms_to_dbfs(rms):
+    """Converts a 16-bit RMS value to dBFS."""
+    if rms <= 0:
+        return -float("inf")
+    return 20 * math.log10(rms / 32768)
+
+
+def find_cut(envelope, lo_ms, hi_ms, window_ms=ENVELOPE_WINDOW_MS, min_silence_ms=MIN_SILENCE_MS):
+    """
+    Returns (cut_ms, rms) for the quietest `min_silence_ms` stretch between lo_ms and hi_ms.
+
+    The cut lands in the middle of that stretch. Ties prefer the later
+    position so chunks stay as long as the budget allows.
+    """
+    span = max(1, min_silence_ms // window_ms)
+    lo = max(0, lo_ms // window_ms)
+    hi = min(len(envelope), hi_ms // window_ms)
+    if hi - lo < span:
+        return hi_ms, None
+
+    running = sum(envelope[lo:lo + span])
+    best_sum, best_start = running, lo
+    for start in range(lo + 1, hi - span + 1):
+        running += envelope[start + span - 1] - envelope[start - 1]
+        if running <= best_sum:
+            best_sum, best_start = running, start
+
+    cut_ms = (best_start + span // 2) * window_ms
+    return cut_ms, best_sum / span
+
+
+def plan_chunks(source_path, bit_rate, byte_budget=BYTE_BUDGET, max_chunk_ms=MAX_CHUNK_MS, on_cut=None):
+    """
+    Yields ChunkSpec entries covering the whole file, cut at pauses near each size limit.
+
+    The plan is produced while the envelope streams in, so the first chunk is
+    known long before the end of the file has been read. `on_cut(cut_ms, dbfs)`
+    is called for every cut, for progress logging.
+    """
+    chunk_ms = max_chunk_ms_for_budget(bit_rate, byte_budget, max_chunk_ms)
+    search_ms = min(SEARCH_WINDOW_MS, chunk_ms // 2)
+    window_ms = ENVELOPE_WINDOW_MS
+
+    envelope = array("d")
+    index = 0
+    start_ms = 0
+    for rms in iter_envelope(source_path, window_ms=window_ms):
+        envelope.append(rms)
+        # Only cut once the envelope covers the whole search window
+        while len(envelope) * window_ms - start_ms > chunk_ms:
+            hard_cut_ms = start_ms + chunk_ms
+            cut_ms, cut_rms = find_cut(envelope, hard_cut_ms - search_ms, hard_cut_ms, window_ms)
+            if on_cut:
+                on_cut(cut_ms, rms_to_dbfs(cut_rms) if cut_rms is not None else None)
+            yield ChunkSpec(index, start_ms, cut_ms)
+            index += 1
+            start_ms = cut_ms
+
+    end_ms = len(envelope) * window_ms
+    if end_ms > start_ms:
+        yield ChunkSpec(index, start_ms, end_ms)
+
+
+def fixed_plan(duration_ms, chunk_length_ms, start_ms=0, first_index=0):
+    """
+    Plain fixed-length plan, used when the envelope cannot be computed.
+    `start_ms`/`first_index` continue a plan whose silence scan stopped part way.
+    """
+    chunks = math.ceil(max(0, duration_ms - start_ms) / chunk_length_ms)
+    return [
+        ChunkSpec(
+            first_index + i,
+            start_ms + i * chunk_length_ms,
+            min(start_ms + (i + 1) * chunk_length_ms, int(duration_ms)),
+        )
+        for i in range(chunks)
+    ]
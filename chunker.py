@@ -0,0 +1,317 @@
+"""
+Chunk extraction engines for long recordings.
+
+Every backend executes a chunk plan (see chunk_planner) and yields chunk files
+lazily, so only about one chunk is ever held in memory or on disk no matter
+how long the recording is. All backends share the ChunkExtractor interface so
+they can be benchmarked against each other and picked per format:
+
+- "copy":    ffmpeg seeks straight to each chunk (-ss/-t) and copies the
+             compressed frames without decoding them (mp3, m4a).
+- "compact": ffmpeg seeks to each chunk and re-encodes it as mono 16 kHz,
+             low-bitrate Opus/MP3, which Whisper handles well and which keeps
+             uploads small (wav and anything that cannot be copied).
+- "decode":  one streaming ffmpeg decode of the whole file to PCM; chunks are
+             re-encoded in the original format with pydub (legacy behaviour).
+"""
+import os
+import subprocess
+import tempfile
+from collections import namedtuple
+from pydub import AudioSegment
+
+SAMPLE_WIDTH = 2  # 16-bit PCM (s16le)
+
+# Compact re-encode settings (mono 16 kHz is what Whisper resamples to anyway)
+COMPACT_CODEC = os.getenv("CHUNK_COMPACT_CODEC", "opus")  # "opus" or "mp3"
+COMPACT_SAMPLE_RATE = 16000
+COMPACT_CODECS = {
+    # codec name: (file extension, ffmpeg encoder args, bit rate)
+    "opus": ("ogg", ["-c:a", "libopus", "-b:a", "24k", "-application", "voip"], 24000),
+    "mp3": ("mp3", ["-c:a", "libmp3lame", "-b:a", "32k"], 32000),
+}
+
+# Containers whose audio frames can be cut without re-encoding
+COPY_FORMATS = {"mp3", "m4a"}
+
+AudioInfo = namedtuple("AudioInfo", ["duration_ms", "frame_rate", "channels", "bit_rate", "format"])
+
+
+def is_url(source_path):
+    return source_path.startswith(("http://", "https://"))
+
+
+def ffmpeg_input(source_path):
+    """ffmpeg input arguments; HTTP sources (signed Storage URLs) reconnect on dropped connections."""
+    if is_url(source_path):
+        return ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "30", "-i", source_path]
+    return ["-i", source_path]
+
+
+def start_decoder(command):
+    """
+    Starts a streaming ffmpeg decode to stdout. Its messages go to a temporary
+    file (a pipe could fill up and stall the decoder); see decoder_error.
+    """
+    stderr = tempfile.TemporaryFile()
+    try:
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr), stderr
+    except Exception:
+        stderr.close()
+        raise
+
+
+def decoder_error(process, stderr):
+    """ffmpeg's messages if a finished decode failed, else None."""
+    process.wait()
+    if process.returncode == 0:
+        return None
+    stderr.seek(0)
+    message = stderr.read().decode(errors="replace").strip()
+    return f"ffmpeg exited with {process.returncode}: {message or 'no error output'}"
+
+
+def probe(source_path, original_format):
+    """Returns AudioInfo for the source WITHOUT loading the entire file into memory."""
+    frame_rate, channels, bit_rate = 44100, 2, 0
+    try:
+        # Use pydub's lightweight probe first
+        from pydub.utils import mediainfo
+        info = mediainfo(source_path)
+        duration_ms = float(info.get('duration', 0)) * 1000  # Convert to milliseconds
+        frame_rate = int(info.get('sample_rate') or frame_rate)
+        channels = int(info.get('channels') or channels)
+        bit_rate = int(float(info.get('bit_rate') or 0))
+    except Exception as e:
+        if is_url(source_path):
+            raise
+        # Fallback: Load just to get duration then release memory
+        print(f"Mediainfo failed, using fallback: {e}")
+        audio_temp = AudioSegment.from_file(source_path)
+        duration_ms = len(audio_temp)
+        frame_rate, channels = audio_temp.frame_rate, audio_temp.channels
+        del audio_temp  # Release memory immediately
+    return AudioInfo(duration_ms, frame_rate, channels, bit_rate, original_format)
+
+
+class ChunkExtractor:
+    """Common interface for chunk extraction backends."""
+
+    name = None
+
+    def chunk_bit_rate(self, info):
+        """Bit rate (bps) of the chunk files this backend produces, for size budgeting."""
+        raise NotImplementedError
+
+    def iter_chunks(self, source_path, info, plan, name_prefix, auto_cleanup=True):
+        """
+        Executes a chunk plan, yielding (index, start_ms, end_ms, chunk_path) per chunk.
+
+        `plan` is an iterable of (index, start_ms, end_ms) entries in time
+        order; gaps are allowed (e.g. chunks skipped on resume). It may be a
+        generator; each entry is only pulled when the previous chunk has been
+        cut.
+
+        With auto_cleanup the chunk file only exists until the caller asks for
+        the next chunk. Pass auto_cleanup=False to hand ownership of the file
+        to the consumer (e.g. when chunks are transcribed by a worker pool).
+        """
+        for index, start_ms, end_ms in plan:
+            chunk_path = self.extract(source_path, info, start_ms, end_ms, f"{name_prefix}_{index}")
+            try:
+                yield index, start_ms, end_ms, chunk_path
+            finally:
+                if auto_cleanup and os.path.exists(chunk_path):
+                    os.remove(chunk_path)
+
+    def extract(self, source_path, info, start_ms, end_ms, chunk_stem):
+        """Cuts a single chunk and returns the path of the chunk file."""
+        raise NotImplementedError
+
+
+def _run_ffmpeg_slice(source_path, start_ms, end_ms, output_args, chunk_path):
+    """
+    Writes the slice [start_ms, end_ms). Both limits are input options, so
+    ffmpeg neither decodes what comes before the slice nor reads past its end
+    (which matters when a filter makes the output shorter than the slice).
+    """
+    command = [
+        AudioSegment.converter, "-v", "error", "-y",
+        "-ss", f"{start_ms / 1000:.3f}",
+        "-t", f"{(end_ms - start_ms) / 1000:.3f}",
+    ] + ffmpeg_input(source_path) + [
+        "-vn", "-map_metadata", "-1",
+    ] + output_args + [chunk_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return chunk_path
+
+
+class CompactExtractor(ChunkExtractor):
+    """Seeks to each chunk and re-encodes it as mono 16 kHz low-bitrate Opus/MP3."""
+
+    name = "compact"
+
+    def __init__(self, codec=None):
+        self.codec = codec or COMPACT_CODEC
+        self.extension, self.encoder_args, self.bit_rate = COMPACT_CODECS[self.codec]
+
+    def chunk_bit_rate(self, info):
+        # Container overhead on top of the nominal codec rate
+        return int(self.bit_rate * 1.1)
+
+    def extract(self, source_path, info, start_ms, end_ms, chunk_stem):
+        output_args = ["-ac", "1", "-ar", str(COMPACT_SAMPLE_RATE)] + self.encoder_args
+        return _run_ffmpeg_slice(source_path, start_ms, end_ms, output_args, f"{chunk_stem}.{self.extension}")
+
+    def extract_regions(self, source_path, regions, chunk_stem):
+        """
+        Cuts several (start_ms, end_ms) regions in one ffmpeg pass and joins
+        them back to back into a single chunk file (see vad.py). Only the
+        span from the first region's start to the last region's end is read.
+        """
+        if len(regions) == 1:
+            return self.extract(source_path, None, regions[0][0], regions[0][1], chunk_stem)
+        first_ms, last_ms = regions[0][0], regions[-1][1]
+        # The slice starts at first_ms, so the filter's times are relative to it
+        selection = "+".join(
+            f"between(t,{(start_ms - first_ms) / 1000:.3f},{(end_ms - first_ms) / 1000:.3f})"
+            for start_ms, end_ms in regions
+        )
+        output_args = [
+            "-af", f"aselect='{selection}',asetpts=N/SR/TB",
+            "-ac", "1", "-ar", str(COMPACT_SAMPLE_RATE),
+        ] + self.encoder_args
+        return _run_ffmpeg_slice(source_path, first_ms, last_ms, output_args, f"{chunk_stem}.{self.extension}")
+
+
+class CopyExtractor(ChunkExtractor):
+    """Seeks to each chunk and copies the compressed frames without decoding them."""
+
+    name = "copy"
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback or CompactExtractor()
+
+    def chunk_bit_rate(self, info):
+        # Planning must hold for both the copy and its re-encode fallback
+        return max(info.bit_rate or 128000, self.fallback.chunk_bit_rate(info))
+
+    def extract(self, source_path, info, start_ms, end_ms, chunk_stem):
+        try:
+            return _run_ffmpeg_slice(
+                source_path, start_ms, end_ms, ["-c:a", "copy"], f"{chunk_stem}.{info.format}"
+            )
+        except RuntimeError as e:
+            print(f"Stream copy failed, re-encoding chunk instead: {e}")
+            return self.fallback.extract(source_path, info, start_ms, end_ms, chunk_stem)
+
+
+class DecodeExtractor(ChunkExtractor):
+    """
+    Decodes the whole file in a single streaming ffmpeg pass and re-encodes
+    each chunk in the original format with pydub. Only one chunk of PCM is
+    held in memory at a time.
+    """
+
+    name = "decode"
+
+    def chunk_bit_rate(self, info):
+        # WAV chunks are raw PCM; compressed chunks come out at least at the
+        # encoder's default 128 kbps
+        if info.format == "wav":
+            return info.frame_rate * info.channels * SAMPLE_WIDTH * 8
+        return max(info.bit_rate, 128000)
+
+    def iter_chunks(self, source_path, info, plan, name_prefix, auto_cleanup=True):
+        frame_rate, channels = info.frame_rate, info.channels
+        frame_bytes = channels * SAMPLE_WIDTH
+
+        command = [
+            AudioSegment.converter, "-v", "error",
+        ] + ffmpeg_input(source_path) + [
+            "-vn",
+            "-f", "s16le", "-acodec", "pcm_s16le",
+            "-ar", str(frame_rate), "-ac", str(channels),
+            "pipe:1",
+        ]
+        process, stderr = start_decoder(command)
+
+        try:
+            frames_read = 0
+            for index, start_ms, end_ms in plan:
+                # Skip audio between chunks (e.g. chunks already done on resume)
+                start_frame = int(start_ms * frame_rate / 1000)
+                while frames_read < start_frame:
+                    skipped = process.stdout.read(min(start_frame - frames_read, frame_rate * 60) * frame_bytes)
+                    if not skipped:
+                        break
+                    frames_read += len(skipped) // frame_bytes
+
+                # Read exactly this chunk's PCM from the decoder pipe
+                end_frame = int(end_ms * frame_rate / 1000)
+                pcm = process.stdout.read(max(0, end_frame - frames_read) * frame_bytes)
+                frames_read = end_frame
+                if not pcm:
+                    # The decode ended before this chunk: a failed decode, or
+                    # a file shorter than probed. Either way the plan is not done.
+                    error = decoder_error(process, stderr)
+                    raise RuntimeError(error or f"Decoded audio ended before chunk {index} ({start_ms}-{end_ms} ms)")
+
+                audio_chunk = AudioSegment(
+                    data=pcm,
+                    sample_width=SAMPLE_WIDTH,
+                    frame_rate=frame_rate,
+                    channels=channels,
+                )
+                del pcm
+
+                chunk_path = f"{name_prefix}_{index}.{info.format}"
+                audio_chunk.export(chunk_path, format=info.format)
+                del audio_chunk
+
+                try:
+                    yield index, start_ms, end_ms, chunk_path
+                finally:
+                    if auto_cleanup and os.path.exists(chunk_path):
+                        os.remove(chunk_path)
+
+            # At the end of the output, make sure the decode did not stop on
+            # an error just after the last chunk (if audio is left, the plan
+            # simply ended before the file did)
+            if not process.stdout.read(frame_bytes):
+                error = decoder_error(process, stderr)
+                if error:
+                    raise RuntimeError(error)
+        finally:
+            # Stop the decoder if the consumer bailed out early
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            stderr.close()
+
+
+EXTRACTORS = {
+    "copy": CopyExtractor,
+    "compact": CompactExtractor,
+    "decode": DecodeExtractor,
+}
+
+
+def select_extractor(original_format, name=None):
+    """
+    Picks the extraction backend for a format.
+
+    CHUNK_EXTRACTOR (or `name`) forces a backend; otherwise compressed
+    containers are stream-copied and everything else is re-encoded compactly.
+    """
+    name = name or os.getenv("CHUNK_EXTRACTOR", "").strip().lower()
+    if name:
+        return EXTRACTORS[name]()
+    if original_format in COPY_FORMATS:
+        return CopyExtractor()
+    return CompactExtractor()
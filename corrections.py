@@ -0,0 +1,193 @@
+"""
+Global search & replace for transcripts ("Pasta John" -> "Pastor John").
+
+An organization's glossary lives in glossaries/{org_id}. It is compiled once
+into a single combined regex: one alternative per entry, longest first, so
+the longer entry wins where two overlap. The whole transcript is then
+corrected in one pass over its segments. Compiled glossaries are cached by
+content, so Streamlit reruns never rebuild them.
+
+Every replacement is recorded in the job's correction log
+(transcripts/{job_id}/corrections/log), so a reviewer can undo any single
+edit later. New jobs are corrected with their organization's glossary as
+they finish.
+"""
+import functools
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+GLOSSARY_COLLECTION = "glossaries"
+CORRECTIONS_COLLECTION = "corrections"
+LOG_DOCUMENT = "log"
+# Until jobs carry their own organization, everything uses this glossary
+ORG_ID = os.getenv("ORG_ID", "default")
+
+GlossaryEntry = namedtuple("GlossaryEntry", ["find", "replace", "whole_word", "case_sensitive"], defaults=(True, False))
+
+# `start` is the position of `after` in the segment's current text
+Edit = namedtuple("Edit", ["segment", "start", "before", "after", "batch", "undone"], defaults=(False,))
+
+
+class Matcher:
+    """A glossary compiled into one regex; each entry is one capturing alternative."""
+
+    def __init__(self, entries):
+        self.entries = [entry for entry in entries if entry.find]
+        alternatives = []
+        self._entry_of_group = {}
+        for group, entry in enumerate(sorted(self.entries, key=lambda entry: -len(entry.find)), start=1):
+            pattern = re.escape(entry.find)
+            if entry.whole_word:
+                pattern = rf"(?<!\w){pattern}(?!\w)"
+            if not entry.case_sensitive:
+                pattern = f"(?i:{pattern})"
+            alternatives.append(f"({pattern})")
+            self._entry_of_group[group] = entry
+        self.regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    def replacements(self, text):
+        """Yields (start, end, replacement) for every match that changes the text."""
+        if self.regex is None:
+            return
+        for match in self.regex.finditer(text):
+            replacement = self._entry_of_group[match.lastindex].replace
+            if match.group() != replacement:
+                yield match.start(), match.end(), replacement
+
+
+@functools.lru_cache(maxsize=32)
+def compile_glossary(entries):
+    """Cached Matcher for a tuple of GlossaryEntry."""
+    return Matcher(entries)
+
+
+class CorrectionLog:
+    """Every replacement made to one transcript, in order, so each can be undone."""
+
+    def __init__(self, edits=None):
+        self.edits = list(edits or [])
+
+    def next_batch(self):
+        return max((edit.batch for edit in self.edits), default=0) + 1
+
+    def _live(self):
+        """{segment: numbers of the edits still in place}"""
+        live = {}
+        for i, edit in enumerate(self.edits):
+            if not edit.undone:
+                live.setdefault(edit.segment, []).append(i)
+        return live
+
+    def _replacements(self, text, edits, matcher):
+        """
+        The matcher's replacements in one segment, except those touching the
+        text of an earlier edit still in place: rewriting it would leave that
+        edit impossible to undo. Undoing the earlier edit frees the text again.
+        """
+        spans = [(edit.start, edit.start + len(edit.after)) for edit in edits]
+        for start, end, replacement in matcher.replacements(text):
+            if not any((start < span_end and end > span_start) or start == span_start
+                       for span_start, span_end in spans):
+                yield start, end, replacement
+
+    def count(self, transcript, matcher):
+        """The number of replacements apply() would make."""
+        live = self._live()
+        return sum(
+            1 for segment, text in enumerate(transcript.texts)
+            for _ in self._replacements(text, [self.edits[i] for i in live.get(segment, ())], matcher)
+        )
+
+    def apply(self, transcript, matcher):
+        """Corrects a SegmentList in place in one pass; returns the number of replacements."""
+        batch = self.next_batch()
+        count = 0
+        # Earlier edits still in place move with this batch's replacements
+        earlier = self._live()
+        for segment, text in enumerate(transcript.texts):
+            pieces, last, shift = [], 0, 0
+            changes = []
+            edits = [self.edits[i] for i in earlier.get(segment, ())]
+            for start, end, replacement in self._replacements(text, edits, matcher):
+                pieces += [text[last:start], replacement]
+                self.edits.append(Edit(segment, start + shift, text[start:end], replacement, batch))
+                changes.append((start, len(replacement) - (end - start)))
+                shift += len(replacement) - (end - start)
+                last = end
+            if pieces:
+                transcript.texts[segment] = "".join(pieces) + text[last:]
+                count += len(pieces) // 2
+                for i in earlier.get(segment, ()):
+                    other = self.edits[i]
+                    moved = sum(delta for start, delta in changes if start <= other.start)
+                    if moved:
+                        self.edits[i] = other._replace(start=other.start + moved)
+        return count
+
+    def undo(self, transcript, number):
+        """Reverts edit `number`; later edits in the same segment shift with it."""
+        edit = self.edits[number]
+        if edit.undone:
+            return
+        text = transcript.texts[edit.segment]
+        if text[edit.start:edit.start + len(edit.after)] != edit.after:
+            raise ValueError("The segment was changed after this replacement")
+        transcript.texts[edit.segment] = text[:edit.start] + edit.before + text[edit.start + len(edit.after):]
+        delta = len(edit.before) - len(edit.after)
+        for i, other in enumerate(self.edits):
+            if other.segment == edit.segment and other.start > edit.start and not other.undone:
+                self.edits[i] = other._replace(start=other.start + delta)
+        self.edits[number] = edit._replace(undone=True)
+
+    def to_dict(self):
+        """Parallel arrays, like the segment pages."""
+        data = {field: [getattr(edit, field) for edit in self.edits] for field in Edit._fields}
+        data["updated_at"] = datetime.now()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        columns = [data.get(field) or [] for field in Edit._fields]
+        return cls(Edit(*values) for values in zip(*columns))
+
+
+def load_glossary(db, org_id=ORG_ID):
+    """The organization's glossary as a tuple of GlossaryEntry (hashable, for compile_glossary)."""
+    snapshot = db.collection(GLOSSARY_COLLECTION).document(org_id).get()
+    entries = (snapshot.to_dict() or {}).get("entries", []) if snapshot.exists else []
+    return tuple(
+        GlossaryEntry(entry["find"], entry.get("replace", ""), entry.get("whole_word", True), entry.get("case_sensitive", False))
+        for entry in entries if entry.get("find")
+    )
+
+
+def save_glossary(db, entries, org_id=ORG_ID):
+    db.collection(GLOSSARY_COLLECTION).document(org_id).set({
+        "entries": [entry._asdict() for entry in entries],
+        "updated_at": datetime.now(),
+    })
+
+
+def load_log(doc_ref):
+    snapshot = doc_ref.collection(CORRECTIONS_COLLECTION).document(LOG_DOCUMENT).get()
+    return CorrectionLog.from_dict(snapshot.to_dict() or {}) if snapshot.exists else CorrectionLog()
+
+
+def save_log(doc_ref, log):
+    doc_ref.collection(CORRECTIONS_COLLECTION).document(LOG_DOCUMENT).set(log.to_dict())
+
+
+def save_corrections(doc_ref, transcript, log, filename=None, upload_date=None):
+    """Stores a corrected transcript with its log and re-indexes it for search."""
+    import search_index
+    import segments
+
+    segments.save_pages(doc_ref, transcript)
+    save_log(doc_ref, log)
+    search_index.index_job(doc_ref.id, filename, upload_date, transcript)
+
+
+def delete_log(doc_ref):
+    doc_ref.collection(CORRECTIONS_COLLECTION).document(LOG_DOCUMENT).delete()
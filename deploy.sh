@@ -24,3 +24,20 @@ gcloud run deploy taglish-transcriber-v1 \
   --no-cpu-throttling \
   --max-instances 3
 
+
+echo "👷 Deploying transcription worker service..."
+
+# Same image, different entry point. CPU stays allocated between requests so
+# jobs keep running; at least one instance is kept warm to drain the queue.
+gcloud run deploy taglish-transcriber-worker \
+  --source . \
+  --region us-central1 \
+  --no-allow-unauthenticated \
+  --command python \
+  --args="-m,worker,--jobs,2" \
+  --set-env-vars OPENAI_API_KEY=$OPENAI_API_KEY \
+  --memory 8Gi \
+  --cpu 4 \
+  --no-cpu-throttling \
+  --min-instances 1 \
+  --max-instances 3
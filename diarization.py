@@ -0,0 +1,442 @@
+"""
+Speaker diarization ("Speaker A" / "Speaker B" labels).
+
+Diarization is CPU-bound while the Whisper calls are I/O-bound, so it runs
+in a separate process pool alongside transcription. Each pool process has
+its resident memory capped (DIARIZATION_MAX_MEMORY_MB, a process over it is
+stopped and the job is saved without speakers), its math libraries limited
+to DIARIZATION_THREADS threads, and runs at a lower priority. The
+job only waits for it after the last chunk is transcribed. The speaker turns
+are then merged onto the transcript segments through an interval index.
+A job that fails or gives up waiting stops its diarization (see stop), so
+it does not hold the pool for the next job.
+
+DIARIZATION selects a backend:
+
+- "off":      no speaker labels (the default).
+- "pyannote": the pyannote.audio pipeline (needs the optional dependency,
+              a Hugging Face token in HF_TOKEN and a few GB of RAM).
+- "light":    a small numpy backend. It computes log-mel statistics over
+              1.5s windows of voiced audio and clusters them with k-means.
+              It fits in containers that can't hold the full model.
+- "auto":     pyannote when it is installed, light otherwise.
+"""
+import bisect
+import importlib.util
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pydub import AudioSegment
+
+from chunker import ffmpeg_input
+
+DIARIZATION = os.getenv("DIARIZATION", "off").strip().lower()
+DIARIZATION_WORKERS = int(os.getenv("DIARIZATION_WORKERS", "1"))
+DIARIZATION_THREADS = int(os.getenv("DIARIZATION_THREADS", "2"))
+# Resident memory per pool process (torch and the pyannote weights alone take 1-2 GB); 0 for no cap
+DIARIZATION_MAX_MEMORY_MB = int(os.getenv("DIARIZATION_MAX_MEMORY_MB", "4096"))
+MEMORY_CHECK_SECONDS = 1
+# How long a finished transcription waits for the speaker turns
+DIARIZATION_TIMEOUT = int(os.getenv("DIARIZATION_TIMEOUT_MINUTES", "30")) * 60
+PYANNOTE_MODEL = os.getenv("PYANNOTE_MODEL", "pyannote/speaker-diarization-3.1")
+MAX_SPEAKERS = 8
+
+# Light backend settings
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 400  # 25ms analysis frames
+HOP_SAMPLES = 160  # every 10ms
+FFT_SIZE = 512
+MEL_BANDS = 24
+WINDOW_SECONDS = 1.5  # one embedding per window
+STEP_SECONDS = 0.75
+VOICED_DBFS = -45
+SMOOTHING_WINDOWS = 5  # majority vote over neighbouring windows
+
+
+def speaker_name(n):
+    return f"Speaker {chr(ord('A') + n)}" if n < 26 else f"Speaker {n + 1}"
+
+
+def relabel(turns):
+    """Renames backend labels to Speaker A, B, ... in order of first appearance."""
+    names = {}
+    for start, end, label in sorted(turns):
+        if label not in names:
+            names[label] = speaker_name(len(names))
+    return [(start, end, names[label]) for start, end, label in sorted(turns)]
+
+
+# --- Pool processes ---
+
+def _resident_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _watch_memory(max_memory_bytes):
+    """
+    Stops the process once its resident memory passes the cap. (An address
+    space limit would not do: torch reserves far more than it ever touches.)
+    """
+    while True:
+        resident = _resident_bytes()
+        if resident > max_memory_bytes:
+            print(f"⚠️ Diarization process using {resident // 2**20} MB (cap {max_memory_bytes // 2**20} MB), stopping it")
+            os._exit(1)
+        time.sleep(MEMORY_CHECK_SECONDS)
+
+
+def _limit_resources(max_memory_bytes, threads):
+    """Pool initializer: caps memory, math-library threads and priority of the process."""
+    for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    if max_memory_bytes and os.path.exists("/proc/self/statm"):
+        threading.Thread(target=_watch_memory, args=(max_memory_bytes,), name="memory-cap", daemon=True).start()
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+def _decode_command(source_path):
+    return [AudioSegment.converter, "-v", "error"] + ffmpeg_input(source_path) + [
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "pipe:1",
+    ]
+
+
+_pyannote_pipeline = None
+
+
+def _diarize_pyannote(source_path, num_speakers):
+    """Full pyannote pipeline on a temporary 16 kHz mono WAV (the model is loaded once per process)."""
+    global _pyannote_pipeline
+    import torch
+    from pyannote.audio import Pipeline
+
+    torch.set_num_threads(DIARIZATION_THREADS)
+    if _pyannote_pipeline is None:
+        _pyannote_pipeline = Pipeline.from_pretrained(PYANNOTE_MODEL, use_auth_token=os.getenv("HF_TOKEN"))
+
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        subprocess.run(
+            [AudioSegment.converter, "-v", "error", "-y"] + ffmpeg_input(source_path)
+            + ["-vn", "-ar", str(SAMPLE_RATE), "-ac", "1", wav_path],
+            check=True,
+        )
+        options = {"num_speakers": num_speakers} if num_speakers else {"max_speakers": MAX_SPEAKERS}
+        annotation = _pyannote_pipeline(wav_path, **options)
+        return [(turn.start, turn.end, label) for turn, _, label in annotation.itertracks(yield_label=True)]
+    finally:
+        os.remove(wav_path)
+
+
+def _mel_filterbank(np):
+    """Triangular mel filters (MEL_BANDS x FFT_SIZE // 2 + 1) between 80 Hz and 7.6 kHz."""
+    def to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    edges = to_hz(np.linspace(to_mel(80.0), to_mel(7600.0), MEL_BANDS + 2))
+    bins = np.floor((FFT_SIZE + 1) * edges / SAMPLE_RATE).astype(int)
+    bank = np.zeros((MEL_BANDS, FFT_SIZE // 2 + 1))
+    for band in range(MEL_BANDS):
+        lo, mid, hi = bins[band], bins[band + 1], bins[band + 2]
+        bank[band, lo:mid] = (np.arange(lo, mid) - lo) / max(1, mid - lo)
+        bank[band, mid:hi] = (hi - np.arange(mid, hi)) / max(1, hi - mid)
+    return bank
+
+
+def _embeddings(np, source_path):
+    """(window start times, embeddings) for the voiced 1.5s windows of the recording, streamed from ffmpeg."""
+    window = int(WINDOW_SECONDS * SAMPLE_RATE)
+    step = int(STEP_SECONDS * SAMPLE_RATE)
+    bank = _mel_filterbank(np)
+    taper = np.hamming(FRAME_SAMPLES)
+    threshold = 32768 * 10 ** (VOICED_DBFS / 20)
+
+    starts, features = [], []
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0  # sample index of buffer[0]
+    process = subprocess.Popen(_decode_command(source_path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = process.stdout.read(step * 2)
+            if data:
+                buffer = np.concatenate([buffer, np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2").astype(np.float32)])
+            while len(buffer) >= window:
+                samples = buffer[:window]
+                if np.sqrt(np.mean(samples ** 2)) > threshold:
+                    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SAMPLES)[::HOP_SAMPLES]
+                    power = np.abs(np.fft.rfft(frames * taper, FFT_SIZE)) ** 2
+                    mel = np.log(power @ bank.T + 1e-6)
+                    starts.append(offset / SAMPLE_RATE)
+                    features.append(np.concatenate([mel.mean(axis=0), mel.std(axis=0)]))
+                buffer = buffer[step:]
+                offset += step
+            if not data:
+                break
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+    return np.array(starts), np.array(features, dtype=np.float32).reshape(-1, 2 * MEL_BANDS)
+
+
+def _kmeans(np, points, k, rng, iterations=50):
+    """Cosine k-means (points are unit vectors) with k-means++ seeding; returns labels."""
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        distance = 1 - np.max(points @ np.array(centers).T, axis=1)
+        distance = np.clip(distance, 0, None)
+        total = distance.sum()
+        centers.append(points[rng.choice(len(points), p=distance / total) if total > 0 else rng.integers(len(points))])
+    centers = np.array(centers)
+    labels = np.zeros(len(points), dtype=int)
+    for _ in range(iterations):
+        labels = np.argmax(points @ centers.T, axis=1)
+        updated = np.array([
+            points[labels == c].mean(axis=0) if np.any(labels == c) else centers[c] for c in range(k)
+        ])
+        updated /= np.linalg.norm(updated, axis=1, keepdims=True) + 1e-9
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+    return labels
+
+
+def _silhouette(np, points, labels):
+    """Mean silhouette score under cosine distance."""
+    distance = 1 - points @ points.T
+    scores = []
+    for i in range(len(points)):
+        own = labels == labels[i]
+        if own.sum() < 2:
+            scores.append(0.0)
+            continue
+        a = distance[i, own].sum() / (own.sum() - 1)
+        b = min(distance[i, labels == c].mean() for c in set(labels.tolist()) if c != labels[i])
+        scores.append((b - a) / max(a, b, 1e-9))
+    return float(np.mean(scores))
+
+
+def _diarize_light(source_path, num_speakers):
+    import numpy as np
+
+    starts, features = _embeddings(np, source_path)
+    if len(features) == 0:
+        return []
+    # Normalise per recording (removes the room / microphone colouring)
+    features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-6)
+    features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-9
+
+    rng = np.random.default_rng(0)
+    if num_speakers:
+        k = max(1, min(num_speakers, MAX_SPEAKERS, len(features)))
+    else:
+        # Pick the speaker count with the best silhouette on a sample
+        sample = features[rng.choice(len(features), min(len(features), 1500), replace=False)]
+        k, best = 1, 0.1  # below this, one speaker explains the audio as well
+        for candidate in range(2, min(MAX_SPEAKERS, len(sample) - 1) + 1):
+            score = _silhouette(np, sample, _kmeans(np, sample, candidate, rng))
+            if score > best:
+                k, best = candidate, score
+    labels = _kmeans(np, features, k, rng) if k > 1 else np.zeros(len(features), dtype=int)
+
+    # Majority vote over neighbouring windows smooths out single-window flips
+    half = SMOOTHING_WINDOWS // 2
+    smoothed = [
+        int(np.bincount(labels[max(0, i - half):i + half + 1]).argmax()) for i in range(len(labels))
+    ]
+
+    # Each window speaks for the STEP_SECONDS around its centre
+    turns = []
+    for start, label in zip(starts, smoothed):
+        centre = start + WINDOW_SECONDS / 2
+        turn_start, turn_end = centre - STEP_SECONDS / 2, centre + STEP_SECONDS / 2
+        if turns and turns[-1][2] == label and turn_start - turns[-1][1] <= STEP_SECONDS:
+            turns[-1] = (turns[-1][0], turn_end, label)
+        else:
+            turns.append((max(0.0, turn_start), turn_end, label))
+    return turns
+
+
+BACKENDS = {
+    "pyannote": _diarize_pyannote,
+    "light": _diarize_light,
+}
+
+
+def _run(backend, source_path, num_speakers):
+    """Runs in a pool process; returns (turns, seconds)."""
+    started = time.perf_counter()
+    turns = relabel(BACKENDS[backend](source_path, num_speakers))
+    return turns, time.perf_counter() - started
+
+
+# --- Job side ---
+
+def select_backend(name=None):
+    """The configured backend name, or None when diarization is off."""
+    name = name or DIARIZATION
+    if name == "off":
+        return None
+    if name == "auto":
+        return "pyannote" if importlib.util.find_spec("pyannote") is not None else "light"
+    return name
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(replace=False):
+    """
+    Process-wide diarization pool (spawned processes, so they start from a
+    clean interpreter). `replace` starts a new one after a process was stopped.
+    """
+    global _pool
+    with _pool_lock:
+        if replace and _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=DIARIZATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_resources,
+                initargs=(DIARIZATION_MAX_MEMORY_MB * 1024 * 1024, DIARIZATION_THREADS),
+            )
+        return _pool
+
+
+# Result future -> (pool future, arguments) for every diarization not finished yet
+_tasks = {}
+# Reentrant: cancelling a pool future runs its callback in the same thread
+_tasks_lock = threading.RLock()
+
+
+def _submit(result, args):
+    try:
+        pool_future = get_pool().submit(_run, *args)
+    except BrokenProcessPool:
+        # A process went over the memory cap during an earlier job
+        pool_future = get_pool(replace=True).submit(_run, *args)
+    _tasks[result] = (pool_future, args)
+    pool_future.add_done_callback(lambda pool_future: _finished(result, pool_future))
+
+
+def _finished(result, pool_future):
+    """Passes a pool future's outcome on to the job's future, unless it was resubmitted or stopped."""
+    with _tasks_lock:
+        if _tasks.get(result, (None,))[0] is not pool_future:
+            return
+        del _tasks[result]
+    if result.done() or pool_future.cancelled():
+        result.cancel()
+        return
+    error = pool_future.exception()
+    if error is not None:
+        result.set_exception(error)
+    else:
+        result.set_result(pool_future.result())
+
+
+def start(source_path, num_speakers=None, backend=None):
+    """
+    Starts diarizing `source_path` (a local path or signed URL) in the pool.
+    Returns a Future of (turns, seconds), or None when diarization is off.
+    """
+    backend = select_backend(backend)
+    if backend is None:
+        return None
+    result = Future()
+    with _tasks_lock:
+        _submit(result, (backend, source_path, num_speakers or None))
+    return result
+
+
+def _terminate(pool):
+    terminate_workers = getattr(pool, "terminate_workers", None)  # Python 3.14+
+    if terminate_workers is not None:
+        terminate_workers()
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+def stop(result):
+    """
+    Stops a diarization whose job no longer waits for it. A pool process
+    cannot be interrupted, so one that is already running is terminated with
+    its pool; the other jobs' diarizations are started again in a new pool.
+    """
+    with _tasks_lock:
+        pool_future, _ = _tasks.pop(result, (None, None))
+        result.cancel()
+        if pool_future is None or pool_future.cancel() or pool_future.done():
+            return
+        print("Stopping a diarization that is no longer needed")
+        # Taken off the books first, so the old pool's failures are not passed on
+        others = [(other, args) for other, (_, args) in _tasks.items()]
+        _tasks.clear()
+        with _pool_lock:
+            pool = _pool
+        if pool is not None:
+            _terminate(pool)
+        get_pool(replace=True)
+        for other, args in others:
+            _submit(other, args)
+
+
+class SpeakerIndex:
+    """
+    Interval index over speaker turns: turns sorted by start plus the length
+    of the longest turn. A turn overlapping a segment starts less than that
+    length before the segment, so the candidates are found with two binary
+    searches instead of a pass over all turns.
+    """
+
+    def __init__(self, turns):
+        turns = sorted(turns)
+        self.starts = [start for start, _, _ in turns]
+        self.ends = [end for _, end, _ in turns]
+        self.speakers = [speaker for _, _, speaker in turns]
+        self.longest = max((end - start for start, end, _ in turns), default=0)
+
+    def overlapping(self, start, end):
+        """Yields (speaker, overlap seconds) for every turn overlapping [start, end)."""
+        first = bisect.bisect_right(self.starts, start - self.longest)
+        last = bisect.bisect_left(self.starts, end)
+        for i in range(first, last):
+            overlap = min(end, self.ends[i]) - max(start, self.starts[i])
+            if overlap > 0:
+                yield self.speakers[i], overlap
+
+    def speaker_at(self, start, end):
+        """The speaker with the most overlap with [start, end), or None."""
+        if end <= start:
+            end = start + 0.01
+        totals = {}
+        for speaker, overlap in self.overlapping(start, end):
+            totals[speaker] = totals.get(speaker, 0) + overlap
+        return max(totals, key=totals.get) if totals else None
+
+
+def label_segments(transcript, turns):
+    """Sets transcript.speakers (a SegmentList) from speaker turns; returns the speaker count."""
+    index = SpeakerIndex(turns)
+    transcript.speakers = [
+        index.speaker_at(transcript.starts[i], transcript.ends[i]) for i in range(len(transcript))
+    ]
+    return len({speaker for speaker in transcript.speakers if speaker})
@@ -0,0 +1,302 @@
+"""
+Transcription engines.
+
+Every engine turns one chunk file into Whisper-style segment dicts
+(start/end/text/avg_logprob, times relative to the chunk), so the rest of the
+pipeline does not care where the transcription ran:
+
+- "openai": the hosted whisper-1 API, behind the shared adaptive rate
+            limiter (see rate_limit.py).
+- "local":  a quantized Whisper model on CPU via faster-whisper
+            (CTranslate2, int8). Chunks submitted by any job in the process
+            are gathered into batches. Each chunk is split into <=30s speech
+            clips, the clips of the whole batch are decoded together, and
+            the segments are mapped back to their chunks.
+
+TRANSCRIBE_ENGINE picks one ("openai", "local") or "auto", which sends
+short recordings to the local engine while its backlog is small and
+everything else to the API. faster-whisper is optional; without it "auto"
+always uses the API.
+"""
+import bisect
+import importlib.util
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+import rate_limit
+import resources
+
+ENGINE = os.getenv("TRANSCRIBE_ENGINE", "openai").strip().lower()
+
+WHISPER_MODEL = "whisper-1"
+
+LOCAL_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_THREADS", "0")) or (os.cpu_count() or 1)
+# Clips decoded together per forward pass, and chunks gathered into one batch
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_WHISPER_BATCH_SIZE", "8"))
+LOCAL_BATCH_CHUNKS = int(os.getenv("LOCAL_WHISPER_BATCH_CHUNKS", "4"))
+# How long the batcher waits for more chunks before starting a batch
+LOCAL_BATCH_WAIT_SECONDS = float(os.getenv("LOCAL_WHISPER_BATCH_WAIT", "0.5"))
+
+# "auto" routing: recordings up to this long go local while its backlog is short
+AUTO_LOCAL_MAX_SECONDS = int(os.getenv("AUTO_LOCAL_MAX_MINUTES", "20")) * 60
+AUTO_LOCAL_MAX_QUEUE = int(os.getenv("AUTO_LOCAL_MAX_QUEUE", "8"))
+
+SAMPLE_RATE = 16000
+CLIP_SECONDS = 30  # Whisper's context window
+
+
+class TranscriptionEngine:
+    """Common interface for transcription backends."""
+
+    name = None
+    # Chunks a job should keep in flight for this engine
+    job_concurrency = None
+
+    @property
+    def model_id(self):
+        """Identifies the model in cache keys, so results from different engines never mix."""
+        raise NotImplementedError
+
+    def transcribe(self, file_path, prompt, temperature, audio_seconds=0, turn=None):
+        """
+        Returns the chunk's segments as dicts with chunk-relative times.
+        `turn` (a context manager factory) is held around each request only.
+        """
+        raise NotImplementedError
+
+    def queue_depth(self):
+        """Chunks waiting for this engine in this process."""
+        return 0
+
+
+class OpenAIEngine(TranscriptionEngine):
+    """The hosted whisper-1 API."""
+
+    name = "openai"
+
+    def __init__(self, api_key=None):
+        # Shared by every job in the process, with pooled connections
+        self.client = resources.get_openai_client(api_key)
+
+    @property
+    def model_id(self):
+        return WHISPER_MODEL
+
+    def transcribe(self, file_path, prompt, temperature, audio_seconds=0, turn=None):
+        def request():
+            with open(file_path, "rb") as audio_file:
+                raw = self.client.audio.transcriptions.with_raw_response.create(
+                    model=WHISPER_MODEL,
+                    file=audio_file,
+                    prompt=prompt,
+                    temperature=temperature,
+                    response_format="verbose_json" # Critical for timestamps
+                )
+            return raw.parse(), raw.headers
+
+        response = rate_limit.call_with_retries(request, audio_seconds=audio_seconds, turn=turn)
+        return [
+            segment.model_dump() if hasattr(segment, "model_dump") else dict(segment)
+            for segment in (response.segments or [])
+        ]
+
+
+class _LocalRequest:
+    __slots__ = ("file_path", "prompt", "temperature", "done", "result", "error")
+
+    def __init__(self, file_path, prompt, temperature):
+        self.file_path = file_path
+        self.prompt = prompt
+        self.temperature = temperature
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def speech_clips(samples, sample_rate=SAMPLE_RATE, max_seconds=CLIP_SECONDS):
+    """
+    Splits decoded audio into (start, end) windows in seconds, each at most
+    `max_seconds` long, cut between speech regions found by faster-whisper's
+    VAD. Falls back to fixed windows if the VAD is unavailable.
+    """
+    duration = len(samples) / sample_rate
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+        speech = get_speech_timestamps(samples, VadOptions(max_speech_duration_s=max_seconds))
+    except Exception as e:
+        print(f"VAD unavailable, using fixed {max_seconds}s clips: {e}")
+        speech = None
+
+    if speech is None:
+        starts = range(0, int(duration) + 1, max_seconds)
+        return [(start, min(duration, start + max_seconds)) for start in starts if start < duration]
+
+    # Merge neighbouring speech regions into windows that fill the context
+    clips = []
+    for region in speech:
+        start, end = region["start"] / sample_rate, region["end"] / sample_rate
+        if clips and end - clips[-1][0] <= max_seconds:
+            clips[-1] = (clips[-1][0], end)
+        else:
+            clips.append((start, end))
+    return clips
+
+
+class LocalWhisperEngine(TranscriptionEngine):
+    """Quantized Whisper on CPU (faster-whisper), batching chunks across jobs."""
+
+    name = "local"
+    job_concurrency = LOCAL_BATCH_CHUNKS
+
+    def __init__(self, model=LOCAL_MODEL, compute_type=LOCAL_COMPUTE_TYPE, cpu_threads=LOCAL_CPU_THREADS,
+                 batch_size=LOCAL_BATCH_SIZE, batch_chunks=LOCAL_BATCH_CHUNKS):
+        self.model = model
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.batch_size = batch_size
+        self.batch_chunks = batch_chunks
+        self._requests = queue.Queue()
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._pipeline = None
+        self._thread = None
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("faster_whisper") is not None
+
+    @property
+    def model_id(self):
+        return f"faster-whisper:{self.model}:{self.compute_type}"
+
+    def queue_depth(self):
+        return self._requests.qsize() + self._busy
+
+    def transcribe(self, file_path, prompt, temperature, audio_seconds=0, turn=None):
+        request = _LocalRequest(file_path, prompt, temperature)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="local-whisper", daemon=True)
+                self._thread.start()
+        with turn() if turn else nullcontext():
+            self._requests.put(request)
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _load(self):
+        """Loads the model once per process (first batch only)."""
+        if self._pipeline is None:
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+            print(f"🧠 Loading {self.model_id} on {self.cpu_threads} CPU threads...")
+            model = WhisperModel(
+                self.model, device="cpu", compute_type=self.compute_type, cpu_threads=self.cpu_threads
+            )
+            self._pipeline = BatchedInferencePipeline(model=model)
+        return self._pipeline
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            # Give concurrent chunks a moment to join the batch
+            deadline = time.monotonic() + LOCAL_BATCH_WAIT_SECONDS
+            while len(batch) < self.batch_chunks:
+                try:
+                    batch.append(self._requests.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            # One inference call shares its prompt and temperature
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.prompt, request.temperature), []).append(request)
+            self._busy = len(batch)
+            for requests in groups.values():
+                self._transcribe_batch(requests)
+            self._busy = 0
+
+    def _transcribe_batch(self, requests):
+        try:
+            import numpy as np
+            from faster_whisper import decode_audio
+
+            pipeline = self._load()
+            audio, clips, owners = [], [], []
+            offset = 0.0
+            for n, request in enumerate(requests):
+                samples = decode_audio(request.file_path, sampling_rate=SAMPLE_RATE)
+                for start, end in speech_clips(samples):
+                    clips.append({"start": offset + start, "end": offset + end})
+                    owners.append((n, offset))
+                audio.append(samples)
+                offset += len(samples) / SAMPLE_RATE
+
+            results = [[] for _ in requests]
+            if clips:
+                segments, _ = pipeline.transcribe(
+                    np.concatenate(audio),
+                    clip_timestamps=clips,
+                    batch_size=self.batch_size,
+                    initial_prompt=requests[0].prompt,
+                    temperature=requests[0].temperature,
+                )
+                clip_starts = [clip["start"] for clip in clips]
+                for segment in segments:
+                    # Segments never span clips; map each back to its chunk
+                    n, chunk_offset = owners[max(0, bisect.bisect_right(clip_starts, segment.start + 1e-3) - 1)]
+                    results[n].append({
+                        "start": segment.start - chunk_offset,
+                        "end": segment.end - chunk_offset,
+                        "text": segment.text,
+                        "avg_logprob": segment.avg_logprob,
+                        "no_speech_prob": segment.no_speech_prob,
+                    })
+            for request, result in zip(requests, results):
+                request.result = result
+        except Exception as e:
+            for request in requests:
+                request.error = e
+        finally:
+            for request in requests:
+                request.done.set()
+
+
+ENGINES = {
+    "openai": OpenAIEngine,
+    "local": LocalWhisperEngine,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name):
+    """Process-wide engine instance (one API client, one loaded local model)."""
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = ENGINES[name]()
+        return _engines[name]
+
+
+def select_engine(audio_seconds, name=None):
+    """
+    Picks the engine for a recording.
+
+    TRANSCRIBE_ENGINE (or `name`) forces one; "auto" routes recordings up to
+    AUTO_LOCAL_MAX_MINUTES to the local engine while fewer than
+    AUTO_LOCAL_MAX_QUEUE chunks are waiting for it, and the rest to the API.
+    """
+    name = name or ENGINE
+    if name != "auto":
+        return get_engine(name)
+    if LocalWhisperEngine.available():
+        local = get_engine("local")
+        if audio_seconds <= AUTO_LOCAL_MAX_SECONDS and local.queue_depth() < AUTO_LOCAL_MAX_QUEUE:
+            return local
+    return get_engine("openai")
@@ -0,0 +1,43 @@
+"""
+Lightweight transcript history for the sidebar.
+
+The list is read with a projection query (only the fields the sidebar shows),
+and a tiny change-token document lets the UI cache that list across sessions
+until a job is created, changes status or is deleted.
+"""
+# Only what the sidebar list needs (no transcript, no plan, no lease)
+HISTORY_FIELDS = ["filename", "upload_date", "status", "progress", "last_heartbeat"]
+META_COLLECTION = "meta"
+TOKEN_DOCUMENT = "transcripts_history"
+
+
+def bump_version(db):
+    """Invalidates cached history lists; call whenever a job is added, changes status or is removed."""
+    from firebase_admin import firestore
+
+    try:
+        db.collection(META_COLLECTION).document(TOKEN_DOCUMENT).set(
+            {"version": firestore.Increment(1), "updated_at": firestore.SERVER_TIMESTAMP},
+            merge=True,
+        )
+    except Exception as e:
+        print(f"History token update failed: {e}")
+
+
+def read_version(db):
+    """Current change token (a single small document read)."""
+    snapshot = db.collection(META_COLLECTION).document(TOKEN_DOCUMENT).get()
+    return (snapshot.to_dict() or {}).get("version", 0) if snapshot.exists else 0
+
+
+def fetch_history(db, limit=10):
+    """Most recent jobs as plain dicts ({"id": ..., plus HISTORY_FIELDS})."""
+    from firebase_admin import firestore
+
+    query = (
+        db.collection("transcripts")
+        .order_by("upload_date", direction=firestore.Query.DESCENDING)
+        .limit(limit)
+        .select(HISTORY_FIELDS)
+    )
+    return [dict(doc.to_dict() or {}, id=doc.id) for doc in query.stream()]
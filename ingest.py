@@ -0,0 +1,107 @@
+"""
+Streaming ingest of uploads from Cloud Storage.
+
+Instead of downloading the whole upload before anything else happens (Cloud
+Run's disk is in memory, so a 400 MB file costs 400 MB of RAM), ffmpeg reads
+the blob over HTTP from a short-lived signed URL:
+
+- probing reads only the container header,
+- the silence planner streams the audio once, front to back,
+- each chunk cut seeks into the blob with HTTP range requests.
+
+The first chunk is cut and transcribed while the planner is still reading the
+rest of the file, and the only local files are the chunk files themselves,
+which the pipeline keeps within INGEST_SCRATCH_MAX_MB.
+
+INGEST_MODE=download keeps the old behaviour (download to a local file first).
+It is also the fallback when a signed URL cannot be created, so it takes
+uploads of any size; the scratch budget only limits the chunk files.
+"""
+import base64
+import os
+from datetime import timedelta
+
+# "stream" (read the blob over HTTP) or "download" (local copy first)
+INGEST_MODE = os.getenv("INGEST_MODE", "stream").strip().lower()
+# Local scratch budget per job for chunk files (a downloaded upload comes on top)
+SCRATCH_MAX_BYTES = int(float(os.getenv("INGEST_SCRATCH_MAX_MB", "256")) * 1024 * 1024)
+# The URL has to stay valid for the whole job
+SIGNED_URL_EXPIRATION = timedelta(hours=int(os.getenv("INGEST_URL_HOURS", "6")))
+
+
+def blob_content_hash(blob):
+    """Content hash from the object's stored checksums, so the upload never has to be read for it."""
+    if blob.md5_hash:
+        return "md5:" + base64.b64decode(blob.md5_hash).hex()
+    # Composite objects only carry a CRC32C
+    return f"crc32c:{base64.b64decode(blob.crc32c).hex()}:{blob.size}"
+
+
+class AudioSource:
+    """An upload as ffmpeg sees it: `path` is either a signed URL or a local file."""
+
+    def __init__(self, path, content_hash, size, local_path=None, scratch_max_bytes=SCRATCH_MAX_BYTES):
+        self.path = path
+        self.content_hash = content_hash
+        self.size = size
+        self.local_path = local_path
+        self.scratch_max_bytes = scratch_max_bytes
+
+    @property
+    def is_remote(self):
+        return self.local_path is None
+
+    @property
+    def error(self):
+        """
+        An exception for a read that failed where ffmpeg cannot tell (a
+        stalled upload looks like the end of the file), or None.
+        """
+        return None
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def max_pending_chunks(self, chunk_bytes):
+        """How many chunk files may exist at once within the scratch budget (at least one)."""
+        return max(1, int(self.scratch_max_bytes // max(1, chunk_bytes)))
+
+    def close(self):
+        """Removes the local copy, if there is one."""
+        if self.local_path and os.path.exists(self.local_path):
+            os.remove(self.local_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_source(blob, local_path, mode=None, scratch_max_bytes=SCRATCH_MAX_BYTES):
+    """
+    Returns an AudioSource for an uploaded blob.
+
+    In stream mode nothing is downloaded here; in download mode (or when the
+    URL cannot be signed) the blob is copied to `local_path`, whatever its size.
+    """
+    blob.reload()  # size and checksums; raises NotFound for a missing upload
+    content_hash = blob_content_hash(blob)
+
+    if (mode or INGEST_MODE) == "stream":
+        try:
+            url = blob.generate_signed_url(
+                version="v4",
+                expiration=SIGNED_URL_EXPIRATION,
+                method="GET",
+            )
+            return AudioSource(url, content_hash, blob.size, scratch_max_bytes=scratch_max_bytes)
+        except Exception as e:
+            print(f"Signed URL unavailable, downloading the upload instead: {e}")
+
+    if blob.size > scratch_max_bytes:
+        print(f"⚠️ Downloading a {blob.size / 1024 / 1024:.0f} MB upload to local disk "
+              f"(more than the {scratch_max_bytes / 1024 / 1024:.0f} MB chunk scratch budget)")
+    blob.download_to_filename(local_path)
+    return AudioSource(local_path, content_hash, blob.size, local_path=local_path, scratch_max_bytes=scratch_max_bytes)
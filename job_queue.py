@@ -0,0 +1,310 @@
+"""
+Job queues for the transcription worker service.
+
+FirestoreJobQueue treats `queued` documents in the `transcripts` collection as
+the queue. Workers claim a job with a lease (lease_owner / lease_expires_at)
+and keep renewing it while the job runs. A job whose lease expires, because
+its worker was scaled down or crashed, can be claimed again by any worker, and
+the per-chunk checkpoints mean only the missing chunks are redone.
+
+Which queued job is claimed next, and whether one may start at all, is up to
+the scheduler (see scheduler.py): shortest first with aging, within global
+and per-organization concurrency limits.
+
+LocalJobQueue is a SQLite-backed stand-in with the same interface for local
+development and benchmarks.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import history
+import scheduler
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Queued jobs considered per claim
+QUEUE_SCAN_LIMIT = 200
+
+ClaimedJob = namedtuple("ClaimedJob", ["job_id", "data"])
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+
+class FirestoreJobQueue:
+    """Queue backed by the status field of the `transcripts` collection."""
+
+    def __init__(self, db, lease_seconds=LEASE_SECONDS, collection="transcripts"):
+        self.db = db
+        self.lease_seconds = lease_seconds
+        self.collection = db.collection(collection)
+
+    def enqueue(self, job_id, data):
+        """Creates the job document in the queued state."""
+        self.collection.document(job_id).set(dict(data, status="queued"))
+
+    def requeue(self, job_id):
+        """Puts an existing job back in the queue (e.g. to retry a failed job)."""
+        from firebase_admin import firestore
+
+        self.collection.document(job_id).update({
+            "status": "queued",
+            "message": "Queued for resume...",
+            "lease_owner": firestore.DELETE_FIELD,
+            "lease_expires_at": firestore.DELETE_FIELD,
+        })
+
+    def _is_claimable(self, data, now):
+        status = data.get("status")
+        if status == "queued":
+            return True
+        # A processing job whose worker stopped renewing its lease
+        lease_expires_at = data.get("lease_expires_at")
+        return status == "processing" and lease_expires_at is not None and lease_expires_at < now
+
+    def _holds_lease(self, data, now):
+        """
+        True for a job whose worker is alive: a lease that has not expired and
+        a heartbeat (written with every renewal) from within the lease period.
+        Processing documents without a lease (from before the worker service,
+        or released without a final status) do not count against the limits.
+        """
+        lease_expires_at = data.get("lease_expires_at")
+        if lease_expires_at is None or lease_expires_at <= now:
+            return False
+        heartbeat = data.get("last_heartbeat")
+        if isinstance(heartbeat, datetime):
+            heartbeat = heartbeat if heartbeat.tzinfo else heartbeat.replace(tzinfo=timezone.utc)
+            return heartbeat >= now - timedelta(seconds=2 * self.lease_seconds)
+        return True
+
+    def _running(self, now, transaction=None):
+        """Data of the jobs that hold a live lease."""
+        return [
+            data for data in (
+                snapshot.to_dict() for snapshot in
+                self.collection.where("status", "==", "processing").stream(transaction=transaction)
+            )
+            if self._holds_lease(data, now)
+        ]
+
+    def _queued(self):
+        return [
+            (snapshot.id, snapshot.to_dict()) for snapshot in
+            self.collection.where("status", "==", "queued").limit(QUEUE_SCAN_LIMIT).stream()
+        ]
+
+    def claim(self, worker_id):
+        """Claims the job the scheduler picks, returning a ClaimedJob or None."""
+        now = _utcnow()
+        # Single-field filters only, so no composite index is needed
+        running = self._running(now)
+        queued = scheduler.admissible(self._queued(), running, now)
+        expired = [
+            (snapshot.id, snapshot.to_dict()) for snapshot in
+            self.collection.where("lease_expires_at", "<", now).limit(10).stream()
+        ]
+        # Jobs that lost their worker were admitted before, so they go first
+        expired = [(job_id, data) for job_id, data in expired if scheduler.admits(data, running)]
+
+        for job_id, _ in expired + queued:
+            data = self._claim_document(self.collection.document(job_id), worker_id)
+            if data is not None:
+                return ClaimedJob(job_id, data)
+        return None
+
+    def positions(self):
+        """{job_id: (queue position, estimated start)} for every queued job."""
+        now = _utcnow()
+        return scheduler.estimate_starts(self._queued(), self._running(now), now)
+
+    def _claim_document(self, doc_ref, worker_id):
+        from firebase_admin import firestore
+
+        queue = self
+
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            now = _utcnow()
+            snapshot = doc_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data is None or not queue._is_claimable(data, now):
+                return None
+            # Checked again inside the transaction, against jobs other workers just claimed
+            if not scheduler.admits(data, queue._running(now, transaction=transaction)):
+                return None
+            transaction.update(doc_ref, {
+                "status": "processing",
+                "message": "Claimed by worker...",
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=queue.lease_seconds),
+                "last_heartbeat": now,
+                "queue_position": firestore.DELETE_FIELD,
+                "estimated_start": firestore.DELETE_FIELD,
+            })
+            return data
+
+        return claim_in_transaction(self.db.transaction())
+
+    def renew(self, job_id, worker_id):
+        """Extends the lease. Returns False if another worker has taken the job over."""
+        from firebase_admin import firestore
+
+        doc_ref = self.collection.document(job_id)
+        queue = self
+
+        @firestore.transactional
+        def renew_in_transaction(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists or (snapshot.to_dict() or {}).get("lease_owner") != worker_id:
+                return False
+            now = _utcnow()
+            transaction.update(doc_ref, {
+                "lease_expires_at": now + timedelta(seconds=queue.lease_seconds),
+                "last_heartbeat": now,
+            })
+            return True
+
+        return renew_in_transaction(self.db.transaction())
+
+    def release(self, job_id, worker_id):
+        """Drops the lease once the job has finished (its status is set by the pipeline)."""
+        from firebase_admin import firestore
+
+        doc_ref = self.collection.document(job_id)
+        snapshot = doc_ref.get()
+        if snapshot.exists and (snapshot.to_dict() or {}).get("lease_owner") == worker_id:
+            doc_ref.update({
+                "lease_owner": firestore.DELETE_FIELD,
+                "lease_expires_at": firestore.DELETE_FIELD,
+            })
+
+
+class LocalJobQueue:
+    """SQLite-backed queue with the same interface, for local development and tests."""
+
+    def __init__(self, path="job_queue.sqlite3", lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " lease_owner TEXT,"
+                " lease_expires_at REAL,"
+                " created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, job_id, data):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, 'queued', NULL, NULL, ?)",
+                (job_id, json.dumps(data, default=str), _utcnow().timestamp()),
+            )
+
+    def requeue(self, job_id):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL"
+                " WHERE job_id = ?",
+                (job_id,),
+            )
+
+    def _jobs(self, conn, now):
+        """(queued (job_id, data) pairs, running job data) as the scheduler sees them."""
+        queued, running = [], []
+        rows = conn.execute(
+            "SELECT job_id, data, status, lease_expires_at FROM jobs WHERE status IN ('queued', 'processing')"
+        ).fetchall()
+        for job_id, data, status, lease_expires_at in rows:
+            data = json.loads(data)
+            if status == "queued" or lease_expires_at < now:
+                queued.append((job_id, data))
+            else:
+                running.append(data)
+        return queued, running
+
+    def claim(self, worker_id):
+        now = _utcnow()
+        with self._lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued, running = self._jobs(conn, now.timestamp())
+            candidates = scheduler.admissible(queued, running, now)
+            if not candidates:
+                conn.execute("COMMIT")
+                return None
+            job_id, data = candidates[0]
+            conn.execute(
+                "UPDATE jobs SET status = 'processing', lease_owner = ?, lease_expires_at = ?"
+                " WHERE job_id = ?",
+                (worker_id, now.timestamp() + self.lease_seconds, job_id),
+            )
+            conn.execute("COMMIT")
+        return ClaimedJob(job_id, data)
+
+    def positions(self):
+        now = _utcnow()
+        with self._lock, self._connect() as conn:
+            queued, running = self._jobs(conn, now.timestamp())
+        return scheduler.estimate_starts(queued, running, now)
+
+    def renew(self, job_id, worker_id):
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE job_id = ? AND lease_owner = ?",
+                (_utcnow().timestamp() + self.lease_seconds, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job_id, worker_id):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires_at = NULL"
+                " WHERE job_id = ? AND lease_owner = ?",
+                (job_id, worker_id),
+            )
+
+
+def get_queue(db):
+    """
+    Queue selected by JOB_QUEUE: "firestore" (default) or "sqlite:PATH" for the
+    local stand-in. The UI and the worker must use the same setting.
+    """
+    setting = os.getenv("JOB_QUEUE", "firestore").strip()
+    if setting.startswith("sqlite:"):
+        return LocalJobQueue(setting[len("sqlite:"):] or "job_queue.sqlite3")
+    return FirestoreJobQueue(db)
+
+
+def submit_job(db, queue, job_id, data):
+    """
+    Creates the job's status document (which the UI monitors) and queues the job.
+    With the Firestore queue the document itself is the queue entry.
+    """
+    if isinstance(queue, FirestoreJobQueue):
+        queue.enqueue(job_id, data)
+    else:
+        db.collection("transcripts").document(job_id).set(dict(data, status="queued"))
+        queue.enqueue(job_id, data)
+    history.bump_version(db)
@@ -0,0 +1,229 @@
+"""
+Cheap, shared job-status reads for the monitor UI.
+
+One Firestore real-time listener (on_snapshot) per watched job is shared by
+every open tab in the process. Each UI refresh reads the latest status from
+memory instead of downloading the job document again, so the Firestore read
+cost scales with status changes rather than with open tabs. Finished jobs
+stay followed until nobody has looked at them for IDLE_SECONDS, because any
+instance can requeue them.
+
+Only the small status fields are kept. The transcript lives in its own pages
+(see segments.py) and is fetched once when the job completes.
+
+While a job runs, ChunkFeed follows its per-chunk checkpoints
+(transcripts/{job_id}/chunks, see checkpoints.py) the same way, so finished
+chunks can be shown as soon as they land. The listener only delivers the
+chunk documents that changed, so every chunk is read once per process.
+"""
+import threading
+import time
+
+from checkpoints import CHUNKS_COLLECTION
+
+STATUS_FIELDS = [
+    "filename", "upload_id", "status", "progress", "message", "total_chunks",
+    "last_heartbeat", "upload_date", "segment_pages", "segment_count",
+    "queue_position", "estimated_start",
+]
+TERMINAL_STATUSES = {"completed", "error"}
+# Listeners nobody has looked at for this long are closed
+IDLE_SECONDS = 10 * 60
+# Without a listener, a finished job is re-read at most this often (it may be retried elsewhere)
+TERMINAL_RECHECK_SECONDS = 60
+
+
+def read_status(doc_ref):
+    """Field-masked read: fetches only the status fields, never the (legacy) transcript."""
+    snapshot = doc_ref.get(field_paths=STATUS_FIELDS)
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+class _Entry:
+    __slots__ = ("status", "version", "watch", "last_access", "last_read")
+
+    def __init__(self):
+        self.status = None
+        self.version = 0
+        self.watch = None
+        self.last_access = time.monotonic()
+        self.last_read = 0.0
+
+
+class JobStatusWatcher:
+    """Process-wide cache of job statuses, kept current by Firestore listeners."""
+
+    def __init__(self, db, collection="transcripts"):
+        self.collection = db.collection(collection)
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, job_id):
+        """Latest status fields for a job (None if it does not exist)."""
+        with self._lock:
+            self._close_idle()
+            entry = self._entries.get(job_id)
+            if entry is None:
+                entry = self._entries[job_id] = _Entry()
+                start_listener = True
+            else:
+                start_listener = False
+            entry.last_access = time.monotonic()
+
+        if start_listener:
+            doc_ref = self.collection.document(job_id)
+            # First view: one masked read so there is something to show right away
+            self._read(job_id, entry)
+            # Finished jobs are followed too: another instance may requeue them
+            try:
+                entry.watch = doc_ref.on_snapshot(
+                    lambda snapshots, changes, read_time: self._on_snapshot(job_id, snapshots)
+                )
+            except Exception as e:
+                print(f"Status listener unavailable for {job_id}, falling back to reads: {e}")
+
+        elif entry.watch is None:
+            # No listener: fall back to a field-masked read per refresh (less often once finished)
+            finished = (entry.status or {}).get("status") in TERMINAL_STATUSES
+            if not finished or time.monotonic() - entry.last_read > TERMINAL_RECHECK_SECONDS:
+                self._read(job_id, entry)
+        return entry.status
+
+    def _read(self, job_id, entry):
+        entry.last_read = time.monotonic()
+        self._store(job_id, read_status(self.collection.document(job_id)))
+
+    def version(self, job_id):
+        """Increments every time the job's status changes."""
+        entry = self._entries.get(job_id)
+        return entry.version if entry else 0
+
+    def _on_snapshot(self, job_id, snapshots):
+        for snapshot in snapshots:
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data is not None:
+                data = {field: data.get(field) for field in STATUS_FIELDS}
+            self._store(job_id, data)
+
+    def _store(self, job_id, data):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                entry.status = data
+                entry.version += 1
+
+    def _stop(self, job_id):
+        entry = self._entries.get(job_id)
+        if entry is not None and entry.watch is not None:
+            watch, entry.watch = entry.watch, None
+            # unsubscribe() joins the listener thread, so never call it from that thread inline
+            threading.Thread(target=watch.unsubscribe, daemon=True).start()
+
+    def forget(self, job_id):
+        """Drops the cached status (e.g. after this instance requeued the job) so the next get() reads it again."""
+        with self._lock:
+            self._stop(job_id)
+            self._entries.pop(job_id, None)
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for job_id, entry in list(self._entries.items()):
+            if now - entry.last_access > IDLE_SECONDS:
+                self._stop(job_id)
+                del self._entries[job_id]
+
+
+class _Feed:
+    __slots__ = ("chunks", "version", "watch", "last_access", "last_completed_at")
+
+    def __init__(self):
+        self.chunks = {}
+        self.version = 0
+        self.watch = None
+        self.last_access = time.monotonic()
+        self.last_completed_at = None
+
+
+class ChunkFeed:
+    """Process-wide cache of each running job's finished chunks, kept current by listeners."""
+
+    def __init__(self, db, collection="transcripts"):
+        self.collection = db.collection(collection)
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def get(self, job_id):
+        """Returns (version, {chunk index: segments}) for the chunks finished so far."""
+        with self._lock:
+            self._close_idle()
+            feed = self._feeds.get(job_id)
+            start_listener = feed is None
+            if start_listener:
+                feed = self._feeds[job_id] = _Feed()
+            feed.last_access = time.monotonic()
+
+        chunks_ref = self.collection.document(job_id).collection(CHUNKS_COLLECTION)
+        if start_listener:
+            try:
+                feed.watch = chunks_ref.on_snapshot(
+                    lambda snapshots, changes, read_time: self._on_changes(job_id, changes)
+                )
+            except Exception as e:
+                print(f"Chunk listener unavailable for {job_id}, falling back to reads: {e}")
+
+        if feed.watch is None:
+            # No listener: read only chunks finished since the last read
+            query = chunks_ref
+            if feed.last_completed_at is not None:
+                query = query.where("completed_at", ">=", feed.last_completed_at)
+            self._store(job_id, [(doc.id, doc.to_dict()) for doc in query.stream()])
+
+        with self._lock:
+            return feed.version, dict(feed.chunks)
+
+    def _on_changes(self, job_id, changes):
+        updates = []
+        for change in changes:
+            if change.type.name == "REMOVED":
+                updates.append((change.document.id, None))
+            else:
+                updates.append((change.document.id, change.document.to_dict()))
+        self._store(job_id, updates)
+
+    def _store(self, job_id, updates):
+        with self._lock:
+            feed = self._feeds.get(job_id)
+            if feed is None:
+                return
+            changed = False
+            for doc_id, data in updates:
+                if data is None:
+                    changed |= feed.chunks.pop(int(doc_id), None) is not None
+                    continue
+                completed_at = data.get("completed_at")
+                if completed_at is not None and (feed.last_completed_at is None or completed_at > feed.last_completed_at):
+                    feed.last_completed_at = completed_at
+                if feed.chunks.get(data["index"]) != data["segments"]:
+                    feed.chunks[data["index"]] = data["segments"]
+                    changed = True
+            if changed:
+                feed.version += 1
+
+    def _stop(self, job_id):
+        feed = self._feeds.get(job_id)
+        if feed is not None and feed.watch is not None:
+            watch, feed.watch = feed.watch, None
+            threading.Thread(target=watch.unsubscribe, daemon=True).start()
+
+    def forget(self, job_id):
+        """Stops following a job (e.g. once it has finished and the full transcript is loaded)."""
+        with self._lock:
+            self._stop(job_id)
+            self._feeds.pop(job_id, None)
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for job_id, feed in list(self._feeds.items()):
+            if now - feed.last_access > IDLE_SECONDS:
+                self._stop(job_id)
+                del self._feeds[job_id]
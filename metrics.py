@@ -0,0 +1,316 @@
+"""
+Per-stage timing and resource metrics for transcription jobs.
+
+background_worker wraps each stage (download, probe, plan, cut, api,
+firestore) in a span. A span records its duration, bytes, audio seconds and
+the process's peak RSS, and can be tied to a chunk so every chunk gets its
+own real-time factor (processing seconds per second of audio). Jobs run with
+the voice-activity filter also record how much audio it skipped.
+
+Each job's spans are summed into one metrics record, stored at
+transcripts/{job_id}/metrics/summary when the job ends. Every span also
+feeds process-wide counters that the worker serves in Prometheus text format
+on /metrics. Set METRICS_OTEL=1 to also emit each span to OpenTelemetry when
+the opentelemetry API is installed.
+"""
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional
+    otel_trace = None
+
+METRICS_COLLECTION = "metrics"
+SUMMARY_DOCUMENT = "summary"
+USE_OTEL = os.getenv("METRICS_OTEL", "0") == "1" and otel_trace is not None
+
+# Histogram buckets for span durations (seconds) and real-time factors
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2)
+FIRST_TEXT_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1200, 1800)
+
+
+def peak_rss_bytes():
+    """High-water resident set size of this process (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Span:
+    """One timed stage. Callers may add bytes / audio seconds / attributes while it runs."""
+
+    __slots__ = ("stage", "chunk", "bytes", "audio_seconds", "attributes", "seconds")
+
+    def __init__(self, stage, chunk=None, bytes=0, audio_seconds=0, **attributes):
+        self.stage = stage
+        self.chunk = chunk
+        self.bytes = bytes
+        self.audio_seconds = audio_seconds
+        self.attributes = attributes
+        self.seconds = 0.0
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class _Registry:
+    """Process-wide aggregates across every job, for the Prometheus endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = {}
+        self.stage_bytes = {}
+        self.stage_audio_seconds = {}
+        self.chunk_rtf = _Histogram(RTF_BUCKETS)
+        self.first_text = _Histogram(FIRST_TEXT_BUCKETS)
+        self.jobs = {}
+        self.skipped_audio_seconds = 0.0
+
+    def record_span(self, span):
+        with self._lock:
+            self.stage_seconds.setdefault(span.stage, _Histogram(SECONDS_BUCKETS)).observe(span.seconds)
+            self.stage_bytes[span.stage] = self.stage_bytes.get(span.stage, 0) + span.bytes
+            self.stage_audio_seconds[span.stage] = self.stage_audio_seconds.get(span.stage, 0) + span.audio_seconds
+
+    def record_chunk(self, realtime_factor):
+        with self._lock:
+            self.chunk_rtf.observe(realtime_factor)
+
+    def record_first_text(self, seconds):
+        with self._lock:
+            self.first_text.observe(seconds)
+
+    def record_job(self, status, skipped_audio_seconds=0):
+        with self._lock:
+            self.jobs[status] = self.jobs.get(status, 0) + 1
+            self.skipped_audio_seconds += skipped_audio_seconds
+
+    def render(self):
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in histograms:
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {hist.count}')
+                selector = f"{{{labels.rstrip(',')}}}" if labels else ""
+                lines.append(f"{name}_sum{selector} {hist.total}")
+                lines.append(f"{name}_count{selector} {hist.count}")
+
+        def counter(name, help_text, values, label):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{{label}="{key}"}} {value}')
+
+        with self._lock:
+            histogram(
+                "transcriber_stage_seconds", "Duration of pipeline stage spans.",
+                [(f'stage="{stage}",', hist) for stage, hist in sorted(self.stage_seconds.items())],
+            )
+            counter("transcriber_stage_bytes_total", "Bytes handled per pipeline stage.", self.stage_bytes, "stage")
+            counter(
+                "transcriber_stage_audio_seconds_total", "Seconds of audio handled per pipeline stage.",
+                self.stage_audio_seconds, "stage",
+            )
+            histogram(
+                "transcriber_chunk_realtime_factor", "Processing seconds per second of audio, per chunk.",
+                [("", self.chunk_rtf)],
+            )
+            histogram(
+                "transcriber_time_to_first_text_seconds", "Seconds from job start to the first finished chunk.",
+                [("", self.first_text)],
+            )
+            counter("transcriber_jobs_total", "Finished jobs by final status.", self.jobs, "status")
+            lines.append(
+                "# HELP transcriber_vad_skipped_audio_seconds_total Seconds of silence and music not sent for transcription."
+            )
+            lines.append("# TYPE transcriber_vad_skipped_audio_seconds_total counter")
+            lines.append(f"transcriber_vad_skipped_audio_seconds_total {self.skipped_audio_seconds}")
+        lines.append("# HELP transcriber_peak_rss_bytes Peak resident set size of the process.")
+        lines.append("# TYPE transcriber_peak_rss_bytes gauge")
+        lines.append(f"transcriber_peak_rss_bytes {peak_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = _Registry()
+
+
+def render_prometheus():
+    """Process-wide metrics in the Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+class JobMetrics:
+    """Collects the spans of one job and summarises them per stage and per chunk."""
+
+    def __init__(self, job_id, registry=REGISTRY):
+        self.job_id = job_id
+        self.registry = registry
+        self.started_at = datetime.now()
+        self.audio_seconds = 0.0
+        self.engine = None
+        # Voice-activity filter totals (see pipeline.vad_summary), if it ran
+        self.vad = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._chunks = {}
+        self.time_to_first_text = None
+        self._tracer = otel_trace.get_tracer("taglish-transcriber") if USE_OTEL else None
+
+    @contextmanager
+    def span(self, stage, chunk=None, **attributes):
+        """Times the enclosed block as `stage` (optionally for chunk `chunk`) and yields its Span."""
+        span = Span(stage, chunk, **attributes)
+        otel_span = None
+        if self._tracer is not None:
+            otel_span = self._tracer.start_span(stage, attributes={"job_id": self.job_id})
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - started
+            self._record(span)
+            if otel_span is not None:
+                otel_span.set_attributes({
+                    "bytes": span.bytes,
+                    "audio_seconds": span.audio_seconds,
+                    **({"chunk": span.chunk} if span.chunk is not None else {}),
+                    **{key: value for key, value in span.attributes.items() if isinstance(value, (str, int, float, bool))},
+                })
+                otel_span.end()
+
+    def add(self, stage, seconds, chunk=None, bytes=0, audio_seconds=0, **attributes):
+        """Records a stage that was timed by the caller."""
+        span = Span(stage, chunk, bytes, audio_seconds, **attributes)
+        span.seconds = seconds
+        self._record(span)
+
+    def first_text(self):
+        """Marks the first chunk transcript published (only the first call counts)."""
+        with self._lock:
+            if self.time_to_first_text is not None:
+                return
+            self.time_to_first_text = round(time.perf_counter() - self._started, 3)
+        self.registry.record_first_text(self.time_to_first_text)
+
+    def annotate(self, chunk, **attributes):
+        """Adds attributes (e.g. cache_hit) to a chunk's record."""
+        with self._lock:
+            self._chunks.setdefault(chunk, {"index": chunk, "audio_seconds": 0.0, "bytes": 0}).update(attributes)
+
+    def _record(self, span):
+        rss = peak_rss_bytes()
+        with self._lock:
+            totals = self._stages.setdefault(span.stage, {
+                "count": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "audio_seconds": 0.0, "peak_rss_bytes": 0,
+            })
+            totals["count"] += 1
+            totals["seconds"] += span.seconds
+            totals["max_seconds"] = max(totals["max_seconds"], span.seconds)
+            totals["bytes"] += span.bytes
+            totals["audio_seconds"] += span.audio_seconds
+            totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"], rss)
+
+            if span.chunk is not None:
+                chunk = self._chunks.setdefault(span.chunk, {"index": span.chunk, "audio_seconds": 0.0, "bytes": 0})
+                chunk[f"{span.stage}_seconds"] = chunk.get(f"{span.stage}_seconds", 0.0) + span.seconds
+                chunk["audio_seconds"] = max(chunk["audio_seconds"], span.audio_seconds)
+                chunk["bytes"] = max(chunk["bytes"], span.bytes)
+                chunk.update(span.attributes)
+        self.registry.record_span(span)
+
+    def finish_chunk(self, index):
+        """Computes the chunk's real-time factor once all of its spans are in."""
+        with self._lock:
+            chunk = self._chunks.get(index)
+            if not chunk or not chunk["audio_seconds"]:
+                return None
+            seconds = sum(value for key, value in chunk.items() if key.endswith("_seconds") and key != "audio_seconds")
+            chunk["realtime_factor"] = round(seconds / chunk["audio_seconds"], 4)
+        self.registry.record_chunk(chunk["realtime_factor"])
+        return chunk["realtime_factor"]
+
+    def summary(self, status=None):
+        """The per-job metrics record."""
+        wall = time.perf_counter() - self._started
+        with self._lock:
+            stages = {
+                stage: dict(totals, seconds=round(totals["seconds"], 3), max_seconds=round(totals["max_seconds"], 3))
+                for stage, totals in self._stages.items()
+            }
+            chunks = [dict(self._chunks[index]) for index in sorted(self._chunks)]
+        return {
+            "job_id": self.job_id,
+            "status": status,
+            "engine": self.engine,
+            "started_at": self.started_at,
+            "finished_at": datetime.now(),
+            "wall_seconds": round(wall, 3),
+            "audio_seconds": self.audio_seconds,
+            "realtime_factor": round(wall / self.audio_seconds, 4) if self.audio_seconds else None,
+            "time_to_first_text_seconds": self.time_to_first_text,
+            "vad": self.vad,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": stages,
+            "chunks": chunks,
+        }
+
+    def save(self, doc_ref, status=None):
+        """Stores the summary as transcripts/{job_id}/metrics/summary and returns it."""
+        record = self.summary(status)
+        self.registry.record_job(status or "unknown", (self.vad or {}).get("skipped_seconds", 0))
+        doc_ref.collection(METRICS_COLLECTION).document(SUMMARY_DOCUMENT).set(record)
+        return record
+
+
+def format_summary(record):
+    """One log line per stage, slowest first."""
+    lines = [
+        f"📊 Job {record['job_id']}: {record['wall_seconds']:.1f}s for {record['audio_seconds'] / 60:.1f} min of audio"
+        + (f" (RTF {record['realtime_factor']:.3f})" if record["realtime_factor"] else "")
+        + f", peak RSS {record['peak_rss_bytes'] / 1024 / 1024:.0f} MB"
+        + (f", first text after {record['time_to_first_text_seconds']:.1f}s"
+           if record.get("time_to_first_text_seconds") is not None else "")
+    ]
+    if record.get("vad"):
+        lines.append(
+            f"   vad ({record['vad']['mode']}): kept {record['vad']['speech_seconds'] / 60:.1f} min of speech,"
+            f" skipped {record['vad']['skipped_seconds'] / 60:.1f} min"
+            f" ({record['vad']['music_seconds'] / 60:.1f} min of it music)"
+        )
+    for stage, totals in sorted(record["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        lines.append(
+            f"   {stage:<10} {totals['seconds']:>8.1f}s in {totals['count']} spans"
+            f" (max {totals['max_seconds']:.1f}s, {totals['bytes'] / 1024 / 1024:.1f} MB)"
+        )
+    return "\n".join(lines)
+
+
+def load_metrics(doc_ref):
+    """The stored metrics record of a job, or None."""
+    snapshot = doc_ref.collection(METRICS_COLLECTION).document(SUMMARY_DOCUMENT).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def delete_metrics(doc_ref):
+    doc_ref.collection(METRICS_COLLECTION).document(SUMMARY_DOCUMENT).delete()
@@ -0,0 +1,696 @@
+"""
+The transcription job pipeline: open, probe, plan, cut, transcribe, save.
+
+The upload is read straight from Cloud Storage (see ingest.py), even while
+the browser is still sending its later parts (see uploads.py). A planner
+thread streams the silence envelope while the job's thread cuts each planned
+chunk as soon as it is known, and a bounded pool of workers sends the chunks
+to Whisper in parallel. Results are stitched back in offset order, so global
+timestamps are unaffected by completion order.
+
+With the voice-activity filter on (VAD_MODE, see vad.py) the planner drops
+silence and music, and each chunk is packed from speech regions only; its
+segments are mapped back to recording time before they are stored.
+
+With DIARIZATION on (see diarization.py) speaker turns are computed in a
+separate process pool while the chunks are transcribed, and merged onto the
+segments before the transcript is saved. Chunks of all jobs in a process take
+fair turns at the API (see scheduler.py). Completed transcripts are added
+to the full-text search index (see search_index.py).
+
+This module has no Streamlit dependency so it can run inside the worker
+service (worker.py) as well as the UI process.
+"""
+import math
+import os
+import queue
+import threading
+import time
+import traceback
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import chunker
+import chunk_planner
+import transcription_cache
+import checkpoints
+import corrections
+import diarization
+import engines
+import history
+import metrics
+import rate_limit
+import resources
+import scheduler
+import search_index
+import segments as segment_store
+import uploads
+import vad
+from segments import SegmentList, format_timestamp
+
+# Max Whisper calls in flight for a single job (the process-wide limit adapts
+# to the API's rate limits, see rate_limit.py)
+JOB_CONCURRENCY = int(os.getenv("TRANSCRIBE_JOB_CONCURRENCY", "3"))
+# How many cut chunks may wait on disk beyond the ones being transcribed
+PREFETCH_CHUNKS = int(os.getenv("TRANSCRIBE_PREFETCH_CHUNKS", "2"))
+# Chunks that keep failing are split in half down to this length
+MIN_BISECT_MS = int(os.getenv("TRANSCRIBE_MIN_BISECT_SECONDS", "30")) * 1000
+# A scan ending this close to the probed duration has covered the file
+PLAN_END_TOLERANCE_MS = 2000
+
+
+class JobCancelled(Exception):
+    """The job's lease was taken over by another worker, which now runs it."""
+
+
+def transcribe_chunks(chunk_stream, transcribe_chunk, job_concurrency=None, on_chunk_done=None, max_pending=None):
+    """
+    Transcribes every chunk from `chunk_stream` and returns the results in chunk order.
+
+    `chunk_stream` yields (index, start_ms, end_ms, chunk_path) tuples and hands
+    ownership of each chunk file to this function. `transcribe_chunk` is called
+    with the same four values from a worker thread. `on_chunk_done(done, index)`
+    is called after each chunk finishes, in completion order. `max_pending`
+    caps the number of chunk files on disk at once (scratch space).
+    """
+    job_concurrency = max(1, job_concurrency or JOB_CONCURRENCY)
+    # Bounds how far the cutter may run ahead of the workers
+    pending = job_concurrency + PREFETCH_CHUNKS
+    if max_pending:
+        pending = max(1, min(pending, max_pending))
+    pending_slots = threading.BoundedSemaphore(pending)
+    results = {}
+    done_lock = threading.Lock()
+    done_count = [0]
+    failed = threading.Event()
+
+    def run(index, start_ms, end_ms, chunk_path):
+        try:
+            if failed.is_set():
+                # Another chunk failed, so the job will too
+                return None
+            result = transcribe_chunk(index, start_ms, end_ms, chunk_path)
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+            pending_slots.release()
+
+        with done_lock:
+            results[index] = result
+            done_count[0] += 1
+            done = done_count[0]
+        if on_chunk_done:
+            on_chunk_done(done, index)
+        return result
+
+    futures = []
+    chunks = iter(chunk_stream)
+    with ThreadPoolExecutor(max_workers=job_concurrency, thread_name_prefix="transcribe") as pool:
+        while True:
+            # Take the slot before the next chunk is cut, so at most `pending`
+            # chunk files exist at once
+            pending_slots.acquire()
+            chunk = None if failed.is_set() else next(chunks, None)
+            if chunk is None:
+                pending_slots.release()
+                break
+            futures.append(pool.submit(run, *chunk))
+        if failed.is_set() and hasattr(chunks, "close"):
+            # Stop the cutter (and its decoder) instead of cutting the rest
+            chunks.close()
+
+    # Surface the first worker failure, if any
+    for future in futures:
+        future.result()
+
+    return [results[index] for index in sorted(results)]
+
+
+def iter_in_background(iterable, name="planner"):
+    """
+    Runs `iterable` in its own thread and yields its items as they arrive.
+
+    Used for the chunk plan so the silence scan keeps reading the upload at
+    full speed while chunks are cut and transcribed, instead of pausing
+    whenever the workers are busy. Exceptions are re-raised in the consumer.
+    """
+    items = queue.Queue()
+    finished = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+        items.put((finished, None))
+
+    threading.Thread(target=produce, name=name, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is finished:
+            return
+        yield item
+
+
+def stream_plan(source_path, duration_ms, chunk_bit_rate, on_cut=None):
+    """
+    Yields the silence-aware chunk plan while the envelope streams in.
+
+    If the scan fails or ends short of the probed duration, the rest of the
+    file is covered with fixed chunks from the last cut on.
+    """
+    start_ms, index = 0, 0
+    try:
+        for spec in chunk_planner.plan_chunks(source_path, chunk_bit_rate, on_cut=on_cut):
+            start_ms, index = spec.end_ms, spec.index + 1
+            yield spec
+        if index and start_ms >= duration_ms - PLAN_END_TOLERANCE_MS:
+            return
+        print(f"Silence scan ended at {format_timestamp(start_ms / 1000)} of "
+              f"{format_timestamp(duration_ms / 1000)}, using fixed chunks for the rest")
+    except Exception as e:
+        print(f"Silence planning failed, using fixed chunks from {format_timestamp(start_ms / 1000)}: {e}")
+    yield from chunk_planner.fixed_plan(
+        duration_ms, chunk_planner.max_chunk_ms_for_budget(chunk_bit_rate), start_ms, index
+    )
+
+
+def stream_vad_plan(source_path, duration_ms, chunk_ms, chunk_regions, stats):
+    """
+    Yields the speech-only chunk plan (see vad.plan_speech_chunks), filling
+    `chunk_regions` with each chunk's speech regions before the chunk is yielded.
+
+    If the scan fails or ends short of the probed duration, the rest of the
+    file is covered with fixed chunks from the last cut on (transcribed in full).
+    """
+    start_ms, index = 0, 0
+    try:
+        for spec, regions in vad.plan_speech_chunks(source_path, chunk_ms, stats=stats):
+            chunk_regions[spec.index] = regions
+            start_ms, index = spec.end_ms, spec.index + 1
+            yield spec
+        scanned_ms = stats.get("total_ms") or 0
+        if scanned_ms and scanned_ms >= duration_ms - PLAN_END_TOLERANCE_MS:
+            return
+        print(f"Voice-activity scan ended at {format_timestamp(scanned_ms / 1000)} of "
+              f"{format_timestamp(duration_ms / 1000)}, using fixed chunks for the rest")
+        if not index:
+            stats.clear()
+    except Exception as e:
+        print(f"Voice-activity scan failed, using fixed chunks from {format_timestamp(start_ms / 1000)}: {e}")
+        stats.clear()
+    yield from chunk_planner.fixed_plan(duration_ms, chunk_ms, start_ms, index)
+
+
+def timed_chunks(chunk_stream, job_metrics, plan_wait, audio_ms=None):
+    """
+    Passes chunks through, recording each cut (minus time spent waiting for
+    the planner) as a span. `audio_ms(index, start_ms, end_ms)` gives the
+    length of audio in a chunk when it is not the whole range (packed chunks).
+    """
+    iterator = iter(chunk_stream)
+    while True:
+        started, waited = time.perf_counter(), plan_wait[0]
+        try:
+            index, start_ms, end_ms, chunk_path = next(iterator)
+        except StopIteration:
+            return
+        job_metrics.add(
+            "cut", time.perf_counter() - started - (plan_wait[0] - waited), index,
+            bytes=os.path.getsize(chunk_path),
+            audio_seconds=(audio_ms(index, start_ms, end_ms) if audio_ms else end_ms - start_ms) / 1000,
+        )
+        yield index, start_ms, end_ms, chunk_path
+
+
+def vad_summary(stats):
+    """Seconds of audio kept and skipped by the voice-activity filter."""
+    total, speech, music = (stats.get(key, 0) / 1000 for key in ("total_ms", "speech_ms", "music_ms"))
+    return {
+        "mode": stats.get("mode", vad.VAD_MODE),
+        "speech_seconds": round(speech, 1),
+        "music_seconds": round(music, 1),
+        "skipped_seconds": round(max(0.0, total - speech), 1),
+    }
+
+
+def request_segments(engine, file_path, system_prompt, temperature, audio_seconds=0, turn=None):
+    """Transcribes one chunk file with `engine` and returns its raw segments (chunk-relative times)."""
+    return engine.transcribe(file_path, system_prompt, temperature, audio_seconds, turn=turn)
+
+
+def split_point_ms(file_path, duration_ms):
+    """Quietest moment in the middle fifth of a chunk (falls back to the exact middle)."""
+    middle = duration_ms // 2
+    try:
+        envelope = array("d", chunk_planner.iter_envelope(file_path))
+        cut_ms, _ = chunk_planner.find_cut(envelope, middle - duration_ms // 10, middle + duration_ms // 10)
+        return cut_ms
+    except Exception as e:
+        print(f"Could not scan chunk for a pause, splitting in the middle: {e}")
+        return middle
+
+
+def request_segments_bisecting(engine, file_path, system_prompt, temperature, duration_ms, turn=None):
+    """
+    Like request_segments, but a chunk that is too large or keeps failing is
+    split in half (at a pause) and each half is transcribed on its own, down
+    to MIN_BISECT_MS. Times stay relative to the original chunk.
+    """
+    try:
+        return request_segments(engine, file_path, system_prompt, temperature, duration_ms / 1000, turn=turn)
+    except Exception as e:
+        if not rate_limit.should_bisect(e) or duration_ms < 2 * MIN_BISECT_MS:
+            raise
+        print(f"Splitting {file_path} ({duration_ms / 1000:.0f}s) after: {e}")
+
+    cut_ms = split_point_ms(file_path, duration_ms)
+    stem = os.path.splitext(file_path)[0]
+    segments = []
+    for half, (start_ms, end_ms) in enumerate(((0, cut_ms), (cut_ms, duration_ms))):
+        half_path = chunker.CompactExtractor().extract(file_path, None, start_ms, end_ms, f"{stem}_{half}")
+        try:
+            half_segments = request_segments_bisecting(
+                engine, half_path, system_prompt, temperature, end_ms - start_ms, turn=turn
+            )
+        finally:
+            if os.path.exists(half_path):
+                os.remove(half_path)
+        offset = start_ms / 1000
+        for segment in half_segments:
+            segment = dict(segment, start=segment["start"] + offset)
+            if segment.get("end") is not None:
+                segment["end"] += offset
+            segments.append(segment)
+    return segments
+
+
+def fetch_segments(engine, file_path, system_prompt, temperature, cache=None, cache_key=None, on_cache_hit=None, duration_ms=None, turn=None):
+    """
+    Returns the raw Whisper segments for a chunk (chunk-relative times).
+    If a cache and key are given, a cached result skips the API call entirely.
+    With `duration_ms`, failing chunks are split and retried in halves.
+    `turn` (a context manager factory) is taken for each API request
+    attempt only, never across retries, backoff or bisection.
+    """
+    segments = cache.get(cache_key) if cache and cache_key else None
+    if segments is not None:
+        if on_cache_hit:
+            on_cache_hit()
+        return segments
+
+    if duration_ms:
+        segments = request_segments_bisecting(engine, file_path, system_prompt, temperature, duration_ms, turn=turn)
+    else:
+        segments = request_segments(engine, file_path, system_prompt, temperature, turn=turn)
+    if cache and cache_key:
+        cache.put(cache_key, segments)
+    return segments
+
+
+def render_segments(segments, offset_seconds=0):
+    """Renders segments as markdown lines with global timestamps."""
+    return "".join(SegmentList.from_dicts(segments, offset_seconds).iter_markdown())
+
+
+def system_error_line(offset_seconds, error):
+    return f"\n⚠️ [SYSTEM ERROR at {format_timestamp(offset_seconds)}]: {str(error)}\n"
+
+
+def system_error_segment(start_ms, end_ms, error):
+    """A placeholder segment so a failed chunk stays visible in the transcript."""
+    return {
+        "start": start_ms / 1000,
+        "end": end_ms / 1000,
+        "text": f"⚠️ [SYSTEM ERROR at {format_timestamp(start_ms / 1000)}]: {str(error)}",
+        "avg_logprob": None,
+    }
+
+
+def transcribe_segment_with_timestamps(engine, file_path, system_prompt, offset_seconds, temperature, cache=None, cache_key=None, on_cache_hit=None):
+    """Transcribes a chunk with `engine` (see engines.py) and returns text with global timestamps."""
+    try:
+        segments = fetch_segments(engine, file_path, system_prompt, temperature, cache, cache_key, on_cache_hit)
+        return render_segments(segments, offset_seconds)
+    except Exception as e:
+        print(f"Error in segment: {e}")
+        return system_error_line(offset_seconds, e)
+
+
+def background_worker(job_id, filename, context, temperature_setting, db, upload_id=None, cancel=None):
+    """
+    Runs one transcription job end to end (The 'Plug-Out' Logic).
+    Called by the worker service (worker.py) for every claimed job, with
+    streaming chunks and keepalive heartbeats. Once `cancel` (a
+    threading.Event) is set, the run stops without touching the job again.
+    """
+    source = None
+    speaker_turns = None
+    job_metrics = metrics.JobMetrics(job_id)
+    final_status = "error"
+    doc_ref = db.collection("transcripts").document(job_id)
+
+    def check_cancelled():
+        if cancel is not None and cancel.is_set():
+            raise JobCancelled(f"Job {job_id} was taken over by another worker")
+
+    try:
+        print(f"Starting Background Job {job_id} for {filename}")
+        doc_ref.update({
+            "status": "processing", 
+            "progress": 0, 
+            "message": "Starting engine...",
+            "last_heartbeat": datetime.now()
+        })
+        history.bump_version(db)
+
+        def report_upload_wait(part, parts):
+            doc_ref.update({
+                "message": f"Waiting for the upload (part {part + 1} of {parts})...",
+                "last_heartbeat": datetime.now()
+            })
+
+        # 1. Open the upload in Storage (Direct Upload Location) without
+        # downloading it; it may still be arriving in parts
+        bucket = resources.get_bucket()
+        local_filename = f"temp_bg_{job_id}_{filename}"
+        
+        # Detect original file format
+        original_format = "mp3"  # default
+        if filename.lower().endswith(".m4a"):
+            original_format = "m4a"
+        elif filename.lower().endswith(".wav"):
+            original_format = "wav"
+        
+        doc_ref.update({"message": "Opening file in cloud storage..."})
+        with job_metrics.span("download") as span:
+            source = uploads.open_upload(
+                bucket, filename, local_filename, on_wait=report_upload_wait, upload_id=upload_id
+            )
+            span.bytes = 0 if source.is_remote else source.size
+        
+        doc_ref.update({"message": "Analyzing audio file..."})
+        
+        # 2. Get audio metadata WITHOUT reading the whole file
+        with job_metrics.span("probe"):
+            info = chunker.probe(source.path, original_format)
+        source.check()
+        duration_ms = info.duration_ms
+        job_metrics.audio_seconds = duration_ms / 1000
+
+        # Resume support: a previous run (possibly on another instance) may
+        # already have planned this job and finished some of its chunks.
+        # Plans are deterministic, so checkpoints also match a re-planned job.
+        snapshot = doc_ref.get()
+        plan = checkpoints.load_plan(snapshot, chunk_planner.ChunkSpec)
+        done_chunks = checkpoints.load_checkpoints(doc_ref)
+
+        # Speaker turns are worked out in another process while chunks are transcribed
+        speaker_turns = diarization.start(source.path, (snapshot.to_dict() or {}).get("speaker_count"))
+
+        # Voice-activity filter: a stored plan keeps the mode it was made with
+        if plan is None:
+            chunk_regions = {} if vad.VAD_MODE != "off" else None
+            vad_stats = {}
+        else:
+            chunk_regions = vad.load_regions(snapshot, plan)
+            vad_stats = vad.load_stats(snapshot) or {}
+
+        # Pick how chunks are cut (stream copy for mp3/m4a, compact re-encode
+        # otherwise; packed speech chunks are always re-encoded)
+        if chunk_regions is not None:
+            extractor = chunker.CompactExtractor()
+        else:
+            extractor = chunker.select_extractor(original_format)
+        chunk_bit_rate = extractor.chunk_bit_rate(info)
+        chunk_ms = chunk_planner.max_chunk_ms_for_budget(chunk_bit_rate)
+
+        planned = []
+        if plan is None and chunk_regions is not None:
+            # Plan dense chunks from the speech regions only, while the scan
+            # is still reading the rest of the file
+            def timed_plan():
+                with job_metrics.span("plan", audio_seconds=duration_ms / 1000):
+                    yield from stream_vad_plan(source.path, duration_ms, chunk_ms, chunk_regions, vad_stats)
+
+            plan_stream = iter_in_background(timed_plan(), name=f"plan-{job_id}")
+            chunks = max(1, math.ceil(duration_ms / chunk_ms))
+        elif plan is None:
+            # Plan size-bounded chunks, cutting at pauses near each limit.
+            # Chunks are cut as soon as they are planned, while the scan
+            # is still reading the rest of the file.
+            def on_cut(cut_ms, dbfs):
+                if dbfs is not None and dbfs <= chunk_planner.SILENCE_DBFS:
+                    print(f"Detected silence at {format_timestamp(cut_ms / 1000)}")
+
+            def timed_plan():
+                with job_metrics.span("plan", audio_seconds=duration_ms / 1000):
+                    yield from stream_plan(source.path, duration_ms, chunk_bit_rate, on_cut=on_cut)
+
+            plan_stream = iter_in_background(timed_plan(), name=f"plan-{job_id}")
+            # Estimate until the scan has finished
+            chunks = max(1, math.ceil(duration_ms / chunk_ms))
+        else:
+            plan_stream = iter(plan)
+            chunks = len(plan)
+        progress = {"chunks": chunks, "planned": plan is not None}
+
+        # Only the chunks without a matching checkpoint are cut and transcribed
+        finished_segments = {}
+        resumed = [0]
+
+        # Time spent waiting for the planner, so it is not counted as cutting
+        plan_wait = [0.0]
+
+        def pending_specs():
+            while True:
+                waited = time.perf_counter()
+                spec = next(plan_stream, None)
+                plan_wait[0] += time.perf_counter() - waited
+                if spec is None:
+                    break
+                planned.append(spec)
+                if checkpoints.is_done(done_chunks, spec):
+                    finished_segments[spec.index] = done_chunks[spec.index]["segments"]
+                    resumed[0] += 1
+                else:
+                    yield spec
+            # A plan of a truncated upload must not be stored
+            source.check()
+            if not progress["planned"]:
+                with job_metrics.span("firestore", op="plan"):
+                    checkpoints.save_plan(doc_ref, planned)
+                    doc_ref.update({"total_chunks": len(planned)})
+                    if chunk_regions is not None:
+                        vad.save_regions(
+                            doc_ref, [region for spec in planned for region in chunk_regions.get(spec.index, [])],
+                            vad_stats,
+                        )
+                progress["chunks"], progress["planned"] = len(planned), True
+        
+        doc_ref.update({
+            "message": f"File duration: {int(duration_ms/1000/60)} minutes. Processing "
+                       + (f"{chunks} chunks..." if plan is not None else f"about {chunks} chunks...")
+                       + (f" (resuming, {len(done_chunks)} already done)" if done_chunks else ""),
+            "total_chunks": chunks,
+            "duration_seconds": duration_ms / 1000
+        })
+        
+        # 3. Pick the transcription engine (hosted API or local CPU model)
+        engine = engines.select_engine(duration_ms / 1000)
+        print(f"Transcribing {job_id} with the {engine.name} engine ({engine.model_id})")
+        job_metrics.engine = engine.model_id
+        system_prompt = (
+            "You are an expert transcriber for Taglish (Tagalog-English) church meetings. "
+            "Transcribe exactly what is said. "
+            "Context: " + context
+        )
+
+        # Cache lookups are keyed by the audio content, so re-runs of the same
+        # recording (or the same file uploaded twice) skip the API calls
+        cache = transcription_cache.get_cache(db)
+        audio_hash = source.content_hash
+        cache_hits = []
+        fair_share = scheduler.get_fair_share()
+
+        # 4. Process Loop - chunks are cut ahead of time (one at a time, never
+        # the whole file) and transcribed by a bounded worker pool
+        def regions_of(i, start_ms, end_ms):
+            """The parts of a chunk's range that are transcribed."""
+            return (chunk_regions or {}).get(i) or [(start_ms, end_ms)]
+
+        def packed_ms(i, start_ms, end_ms):
+            return sum(end - start for start, end in regions_of(i, start_ms, end_ms))
+
+        def packed_chunks(specs):
+            for spec in specs:
+                chunk_path = extractor.extract_regions(
+                    source.path, regions_of(*spec), f"chunk_{job_id}_{spec.index}"
+                )
+                yield spec.index, spec.start_ms, spec.end_ms, chunk_path
+
+        if chunk_regions is not None:
+            chunk_stream = timed_chunks(packed_chunks(pending_specs()), job_metrics, plan_wait, audio_ms=packed_ms)
+        else:
+            chunk_stream = timed_chunks(
+                extractor.iter_chunks(source.path, info, pending_specs(), name_prefix=f"chunk_{job_id}", auto_cleanup=False),
+                job_metrics, plan_wait,
+            )
+        # Chunk files are the only scratch space in stream mode
+        max_pending = source.max_pending_chunks(chunk_bit_rate * chunk_ms / 8 / 1000)
+
+        def transcribe_chunk(i, start_ms, end_ms, chunk_name):
+            check_cancelled()
+            # The chunk may have been cut from a stalled upload; it must get no checkpoint
+            source.check()
+            # Offset logic for global timestamps: chunk times are mapped back
+            # through the chunk's regions (a single one unless VAD packed it)
+            offset_map = vad.OffsetMap(regions_of(i, start_ms, end_ms))
+            chunk_hash = audio_hash
+            if chunk_regions is not None:
+                chunk_hash = f"{audio_hash}:{vad.regions_key(offset_map.regions)}"
+            key = transcription_cache.cache_key(
+                chunk_hash, start_ms, end_ms, engine.model_id, temperature_setting, system_prompt
+            )
+            try:
+                with job_metrics.span(
+                    "api", i, bytes=os.path.getsize(chunk_name), audio_seconds=offset_map.packed_ms / 1000
+                ):
+                    segments = fetch_segments(
+                        engine, chunk_name, system_prompt, temperature_setting,
+                        cache=cache, cache_key=key, on_cache_hit=lambda: cache_hits.append(i),
+                        duration_ms=offset_map.packed_ms,
+                        # Chunks of every job in this process take fair turns at the API
+                        turn=lambda: fair_share.turn(job_id, offset_map.packed_ms / 1000),
+                    )
+            except Exception as e:
+                # Failed chunks get no checkpoint, so a resume retries them
+                print(f"Error in segment: {e}")
+                segments = [system_error_segment(start_ms, end_ms, e)]
+                job_metrics.annotate(i, error=str(e))
+            else:
+                segments = checkpoints.global_segments(offset_map.to_global(segments), 0)
+                # The checkpoint is also what the monitor shows while the job runs
+                with job_metrics.span("firestore", i, op="checkpoint"):
+                    checkpoints.save_checkpoint(doc_ref, i, start_ms, end_ms, segments)
+                job_metrics.first_text()
+            job_metrics.annotate(i, cache_hit=i in cache_hits)
+            job_metrics.finish_chunk(i)
+            finished_segments[i] = segments
+            return segments
+
+        def on_chunk_done(done, i):
+            check_cancelled()
+            total = progress["chunks"]
+            done += resumed[0]
+            # Update heartbeat to keep Cloud Run alive
+            with job_metrics.span("firestore", op="progress"):
+                doc_ref.update({
+                    "progress": min(99, int((done / total) * 100)),
+                    "message": f"Transcribed {done} of {'' if progress['planned'] else 'about '}{total} chunks"
+                               f" ({len(cache_hits)} from cache)...",
+                    "last_heartbeat": datetime.now()
+                })
+
+        doc_ref.update({"message": "Transcribing chunks..."})
+        transcribe_chunks(
+            chunk_stream, transcribe_chunk, job_concurrency=engine.job_concurrency,
+            on_chunk_done=on_chunk_done, max_pending=max_pending,
+        )
+        chunks = len(planned)
+        transcript = SegmentList()
+        for spec in planned:
+            transcript.extend_dicts(finished_segments[spec.index])
+
+        speakers = 0
+        if speaker_turns is not None:
+            doc_ref.update({"message": "Labelling speakers..."})
+            try:
+                with job_metrics.span("diarize") as span:
+                    turns, diarize_seconds = speaker_turns.result(timeout=diarization.DIARIZATION_TIMEOUT)
+                    speakers = diarization.label_segments(transcript, turns)
+                    span.attributes.update(turns=len(turns), speakers=speakers, process_seconds=round(diarize_seconds, 1))
+                print(f"Labelled {speakers} speakers in {diarize_seconds:.0f}s of diarization")
+            except Exception as e:
+                # Speaker labels are optional; the transcript is saved without them
+                print(f"Diarization failed, saving the transcript without speakers: {e}")
+        
+        # The organization's glossary fixes known names and terms; every
+        # replacement is logged so the reviewer can undo it
+        corrected = 0
+        try:
+            matcher = corrections.compile_glossary(corrections.load_glossary(db))
+            if matcher.entries:
+                with job_metrics.span("corrections", entries=len(matcher.entries)):
+                    log = corrections.CorrectionLog()
+                    corrected = log.apply(transcript, matcher)
+                    if corrected:
+                        corrections.save_log(doc_ref, log)
+        except Exception as e:
+            print(f"Glossary corrections skipped: {e}")
+
+        # 5. Finish - segments are stored in pages, outside the job document
+        check_cancelled()
+        source.check()
+        with job_metrics.span("firestore", op="pages", segments=len(transcript)):
+            page_info = segment_store.save_pages(doc_ref, transcript)
+        with job_metrics.span("index", segments=len(transcript)):
+            search_index.index_job(job_id, filename, (snapshot.to_dict() or {}).get("upload_date"), transcript)
+        message = f"Done! ({len(cache_hits)} of {chunks} chunks from cache)" if cache_hits else "Done!"
+        if vad_stats.get("total_ms"):
+            job_metrics.vad = vad_summary(vad_stats)
+            if job_metrics.vad["skipped_seconds"] >= 60:
+                message += f" Skipped {job_metrics.vad['skipped_seconds'] / 60:.0f} min of silence and music."
+        if corrected:
+            message += f" Applied {corrected} glossary corrections."
+
+        doc_ref.update(dict(page_info, **{
+            "status": "completed",
+            "progress": 100,
+            "message": message,
+            "last_heartbeat": datetime.now()
+        }))
+        history.bump_version(db)
+        final_status = "completed"
+            
+        print(f"Job {job_id} Completed Success.")
+
+    except JobCancelled as e:
+        # The job now belongs to the other worker; it is left as it is
+        print(f"⚠️ {e}, stopping")
+        final_status = "cancelled"
+    except Exception as e:
+        if source is not None and source.error is not None:
+            # ffmpeg only saw a failed read; the source knows why
+            e = source.error
+        error_msg = f"Background Job Failed: {e}"
+        print(error_msg)
+        traceback.print_exc()
+        # Try to update DB with error
+        try:
+            doc_ref.update({
+                "status": "error", 
+                "message": str(e),
+                "last_heartbeat": datetime.now()
+            })
+            history.bump_version(db)
+        except:
+            pass
+    finally:
+        scheduler.get_fair_share().forget(job_id)
+        if speaker_turns is not None:
+            # Frees the pool when the job failed or stopped waiting for it
+            diarization.stop(speaker_turns)
+        # Removes the local copy when the upload had to be downloaded
+        if source is not None:
+            source.close()
+        try:
+            print(metrics.format_summary(job_metrics.save(doc_ref, final_status)))
+        except Exception as e:
+            print(f"Could not save job metrics: {e}")
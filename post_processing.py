@@ -0,0 +1,280 @@
+"""
+AI post-processing: the "Secretary" documents of PROJECT_DEFINITION.md §3C
+(executive summary, action items, minutes, sermon/study guide).
+
+A 3-hour transcript is too long for one comfortable LLM call, so documents
+are made map-reduce style:
+
+1. map:    the stored (corrected) transcript is split into timestamped
+           sections on a fixed SECTION_MINUTES grid; each section goes through
+           the document's extraction prompt, POST_PROCESSING_CONCURRENCY at a
+           time.
+2. reduce: the section notes, in order, go through the document's writing
+           prompt. Notes too long for one call are first combined in groups.
+
+Every call is cached by its prompt, input and model: in the stored document
+(its section notes) and in the transcription cache's tiers (see
+transcription_cache.py). Because sections sit on a fixed time grid, an edit
+only changes its own section, so regenerating after a correction only sends
+that section (and the reduce step) to the LLM.
+
+The LLM is any OpenAI-compatible chat endpoint (OPENAI_BASE_URL), such as
+the local stand-in in benchmarks/fake_openai.py.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import rate_limit
+import resources
+import transcription_cache
+from segments import format_timestamp
+
+MODEL = os.getenv("POST_PROCESSING_MODEL", "gpt-4o-mini")
+SECTION_MINUTES = int(os.getenv("POST_PROCESSING_SECTION_MINUTES", "10"))
+CONCURRENCY = int(os.getenv("POST_PROCESSING_CONCURRENCY", "4"))
+# Characters per map input and per reduce input (well inside the context window)
+SECTION_MAX_CHARS = 12000
+REDUCE_MAX_CHARS = 24000
+TEMPERATURE = 0.2
+# Bump when the prompts change, so cached notes are not reused
+PROMPT_VERSION = 1
+
+DOCUMENTS_COLLECTION = "documents"
+
+DocumentType = namedtuple("DocumentType", ["label", "map_prompt", "reduce_prompt"])
+
+DOCUMENT_TYPES = {
+    "summary": DocumentType(
+        "📄 Executive Summary",
+        "Summarize this part of a Taglish (Tagalog-English) church meeting in a few English bullet points: "
+        "topics discussed, decisions, and anything notable. Keep the timestamps of key moments.",
+        "Write a one-page executive summary in English of the whole meeting from these notes, "
+        "which cover it part by part in order. Use short paragraphs and a closing list of key decisions.",
+    ),
+    "action_items": DocumentType(
+        "✅ Action Items & Owners",
+        "Analyze the following transcript. Extract every specific task, the person responsible, and the "
+        "mentioned deadline. Format as a checkbox list with the timestamp. Answer 'None' if there are none.",
+        "Merge these action item lists from consecutive parts of one meeting into a single checkbox list. "
+        "Remove duplicates, keep owners, deadlines and timestamps, and group by owner.",
+    ),
+    "minutes": DocumentType(
+        "📝 Standard Meeting Minutes",
+        "Take notes on this part of a meeting: attendees mentioned, agenda items discussed, decisions "
+        "(with who decided) and action items. Keep the timestamps.",
+        "Summarize this meeting into formal minutes from the notes below. Start with date, time and "
+        "attendees, then group by topic (agenda items discussed), bold any final decisions, and end "
+        "with the action items.",
+    ),
+    "sermon_guide": DocumentType(
+        "⛪ Sermon/Study Guide",
+        "From this part of a sermon or Bible study, extract the scripture references, the theological "
+        "points made and any life applications, with timestamps.",
+        "Write a sermon/study guide from these notes: key scripture references, the main theological "
+        "points in order, life applications, and a few discussion questions.",
+    ),
+}
+
+COMBINE_PROMPT = (
+    "These are notes on consecutive parts of one meeting. Combine them into one set of notes, "
+    "keeping every fact, name, decision, task and timestamp."
+)
+
+Section = namedtuple("Section", ["index", "start", "end", "text"])
+
+
+def split_sections(transcript, section_seconds=None, max_chars=SECTION_MAX_CHARS):
+    """
+    Splits a SegmentList into Sections of timestamped lines. Sections follow
+    a fixed time grid (and are cut further only when longer than
+    max_chars), so editing one segment leaves every other section as it was.
+    """
+    section_seconds = section_seconds or SECTION_MINUTES * 60
+    sections = []
+    lines, cell, first = [], None, None
+    size = 0
+
+    def close(end):
+        if lines:
+            sections.append(Section(len(sections), first, end, "".join(lines)))
+
+    for segment in transcript:
+        speaker = f"{segment.speaker}: " if segment.speaker else ""
+        line = f"[{format_timestamp(segment.start)}] {speaker}{segment.text.strip()}\n"
+        segment_cell = int(segment.start // section_seconds)
+        if lines and (segment_cell != cell or size + len(line) > max_chars):
+            close(segment.start)
+            lines, size = [], 0
+        if not lines:
+            first = segment.start
+        cell = segment_cell
+        lines.append(line)
+        size += len(line)
+    close(transcript.ends[-1] if len(transcript) else 0)
+    return sections
+
+
+def call_key(system, user, model=MODEL):
+    payload = json.dumps(["post_processing", PROMPT_VERSION, model, system, user], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Chat calls get their own adaptive limiter (chat and audio quotas are separate)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = rate_limit.AdaptiveLimiter(initial=CONCURRENCY, maximum=max(CONCURRENCY, 8))
+        return _limiter
+
+
+def complete(system, user, model=MODEL):
+    """One chat completion, with the shared retry and backoff rules."""
+    client, limiter = resources.get_openai_client(), get_limiter()
+
+    def request():
+        raw = client.chat.completions.with_raw_response.create(
+            model=model,
+            temperature=TEMPERATURE,
+            messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+        )
+        return raw.parse().choices[0].message.content or "", raw.headers
+
+    return rate_limit.call_with_retries(request, limiter=limiter)
+
+
+class _Calls:
+    """Cached LLM calls for one document, with counts of what was sent and reused."""
+
+    def __init__(self, known=None, cache=None, model=MODEL):
+        self.known = dict(known or {})
+        self.cache = cache
+        self.model = model
+        self.sent = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, system, user):
+        key = call_key(system, user, self.model)
+        text = self.known.get(key)
+        if text is None and self.cache is not None:
+            text = self.cache.get(key)
+        if text is not None:
+            with self._lock:
+                self.reused += 1
+            return key, text
+        text = complete(system, user, self.model)
+        if self.cache is not None:
+            self.cache.put(key, text)
+        with self._lock:
+            self.sent += 1
+        return key, text
+
+
+def _context_prompt(prompt, context):
+    return f"{prompt}\n\nMeeting context: {context}" if context else prompt
+
+
+def _groups(notes, max_chars):
+    """Packs consecutive notes into groups of at most max_chars (at least two notes each)."""
+    groups, current, size = [], [], 0
+    for note in notes:
+        if len(current) >= 2 and size + len(note) > max_chars:
+            groups.append(current)
+            current, size = [], 0
+        current.append(note)
+        size += len(note)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def generate(transcript, kind, context="", previous=None, cache=None, model=MODEL, on_progress=None):
+    """
+    Makes one document from a SegmentList and returns it as a dict (see
+    save_document). `previous` is the stored document of the same kind,
+    whose section notes are reused where the sections did not change.
+    `on_progress(done, total)` is called from the calling thread.
+    """
+    document_type = DOCUMENT_TYPES[kind]
+    sections = split_sections(transcript)
+    previous = previous or {}
+    known = dict(zip(previous.get("section_keys") or [], previous.get("section_notes") or []))
+    if previous.get("reduce_key"):
+        known[previous["reduce_key"]] = previous.get("text")
+    calls = _Calls(known, cache, model)
+    map_prompt = _context_prompt(document_type.map_prompt, context)
+
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY), thread_name_prefix="post-map") as pool:
+        futures = {pool.submit(calls, map_prompt, section.text): section.index for section in sections}
+        mapped = [None] * len(sections)
+        # Progress is reported from the calling thread (Streamlit widgets only work there)
+        for count, future in enumerate(as_completed(futures), start=1):
+            mapped[futures[future]] = future.result()
+            if on_progress:
+                on_progress(count, len(sections))
+        notes = [
+            f"Part {section.index + 1} ({format_timestamp(section.start)}-{format_timestamp(section.end)}):\n{text}"
+            for section, (_, text) in zip(sections, mapped)
+        ]
+        # Too long for one reduce call: combine neighbouring notes first
+        while len(notes) > 1 and sum(len(note) for note in notes) > REDUCE_MAX_CHARS:
+            groups = _groups(notes, REDUCE_MAX_CHARS)
+            if len(groups) == len(notes):
+                break
+            notes = [text for _, text in pool.map(lambda group: calls(COMBINE_PROMPT, "\n\n".join(group)), groups)]
+
+    reduce_key, text = calls(_context_prompt(document_type.reduce_prompt, context), "\n\n".join(notes)) if notes else (None, "")
+    print(f"🧾 {document_type.label}: {len(sections)} sections, {calls.sent} LLM calls, {calls.reused} reused")
+    return {
+        "kind": kind,
+        "text": text,
+        "model": model,
+        "section_keys": [key for key, _ in mapped],
+        "section_notes": [notes for _, notes in mapped],
+        "reduce_key": reduce_key,
+        "llm_calls": calls.sent,
+        "reused_calls": calls.reused,
+        "generated_at": datetime.now(),
+    }
+
+
+def load_document(doc_ref, kind):
+    snapshot = doc_ref.collection(DOCUMENTS_COLLECTION).document(kind).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def save_document(doc_ref, document):
+    doc_ref.collection(DOCUMENTS_COLLECTION).document(document["kind"]).set(document)
+
+
+def delete_documents(doc_ref):
+    for doc in doc_ref.collection(DOCUMENTS_COLLECTION).stream():
+        doc.reference.delete()
+
+
+def generate_for_job(db, job_id, kind, transcript=None, on_progress=None):
+    """Generates (or refreshes) one document for a finished job and stores it with the job."""
+    import segments
+
+    doc_ref = db.collection("transcripts").document(job_id)
+    if transcript is None:
+        transcript = segments.load_transcript(doc_ref)
+        if transcript is None:
+            raise ValueError("This job has no stored segments to work from")
+    context = ((doc_ref.get().to_dict() or {}).get("context_provided") or "").strip()
+    document = generate(
+        transcript, kind, context=context, previous=load_document(doc_ref, kind),
+        cache=transcription_cache.get_cache(db), on_progress=on_progress,
+    )
+    save_document(doc_ref, document)
+    return document
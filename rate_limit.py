@@ -0,0 +1,231 @@
+"""
+Adaptive rate limiting and retries for Whisper API calls.
+
+One AdaptiveLimiter per process is shared by every job. It caps the number of
+requests in flight and adapts that cap AIMD-style: it grows by one after a
+full window of successful calls and halves on every 429. It also reads
+OpenAI's x-ratelimit-* headers, so it paces requests to the per-minute limit
+and pauses until the reset when the remaining budget runs out, instead of
+finding out through errors.
+
+call_with_retries() retries rate limits, timeouts, connection errors and 5xx
+responses with full-jitter exponential backoff. Errors that retrying cannot
+fix (bad key, bad request) are raised right away; should_bisect() tells the
+caller whether splitting the chunk is worth a try.
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+# Requests in flight across every job in this process: starting point and bounds
+INITIAL_CONCURRENCY = int(os.getenv("TRANSCRIBE_PROCESS_CONCURRENCY", "6"))
+MAX_CONCURRENCY = int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", "16"))
+MIN_CONCURRENCY = 1
+
+MAX_ATTEMPTS = int(os.getenv("WHISPER_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("WHISPER_RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_SECONDS = float(os.getenv("WHISPER_RETRY_MAX_SECONDS", "60"))
+
+WINDOW_SECONDS = 60
+
+
+def parse_reset(value):
+    """Parses OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def _int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Process-wide AIMD concurrency limit plus requests-per-minute pacing."""
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(self.maximum, max(minimum, initial)))
+        self.in_flight = 0
+        self.requests_per_minute_limit = None
+        self._cond = threading.Condition()
+        self._successes = 0
+        self._paused_until = 0.0
+        # (monotonic time, audio seconds) per request started in the last minute
+        self._window = deque()
+
+    def _trim(self, now):
+        while self._window and now - self._window[0][0] > WINDOW_SECONDS:
+            self._window.popleft()
+
+    def _wait_seconds(self, now):
+        wait = self._paused_until - now
+        rpm = self.requests_per_minute_limit
+        if rpm and len(self._window) >= rpm:
+            wait = max(wait, self._window[0][0] + WINDOW_SECONDS - now)
+        return wait
+
+    @contextmanager
+    def slot(self, audio_seconds=0):
+        """Waits for a free request slot (and any rate-limit pause) and holds it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._trim(now)
+                wait = self._wait_seconds(now)
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+            self._window.append((now, audio_seconds))
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def record_success(self, headers=None):
+        """Additive increase, unless the server says the budget is nearly used up."""
+        headers = headers or {}
+        with self._cond:
+            limit = _int_header(headers, "x-ratelimit-limit-requests")
+            if limit:
+                self.requests_per_minute_limit = limit
+            remaining = _int_header(headers, "x-ratelimit-remaining-requests")
+            if remaining == 0:
+                reset = parse_reset(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self._paused_until = max(self._paused_until, time.monotonic() + reset)
+            if remaining is not None and remaining <= self.in_flight:
+                return
+
+            self._successes += 1
+            if self._successes >= int(self.limit):
+                self._successes = 0
+                self.limit = min(self.maximum, self.limit + 1)
+                self._cond.notify_all()
+
+    def record_rate_limited(self, retry_after=None):
+        """Multiplicative decrease, and no new requests until retry_after has passed."""
+        with self._cond:
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit / 2)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        """Current limit, requests in flight, and requests / audio seconds over the last minute."""
+        with self._cond:
+            self._trim(time.monotonic())
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "requests_per_minute": len(self._window),
+                "audio_seconds_per_minute": sum(seconds for _, seconds in self._window),
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """The process-wide limiter shared by every job."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter()
+        return _limiter
+
+
+def _status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def is_rate_limited(error):
+    import openai  # imported on first use, so importing this module stays cheap
+
+    return isinstance(error, openai.RateLimitError) or _status_code(error) == 429
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, dropped connections and server errors."""
+    import openai
+
+    if is_rate_limited(error):
+        return True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status >= 500 or status == 408)
+
+
+def is_too_large(error):
+    """The chunk itself was rejected for its size or length."""
+    if _status_code(error) == 413:
+        return True
+    message = str(error).lower()
+    return _status_code(error) == 400 and ("maximum content size" in message or "too large" in message or "too long" in message)
+
+
+def should_bisect(error):
+    """Splitting helps oversized chunks and chunks that keep timing out, but not quota or auth problems."""
+    return is_too_large(error) or (is_retryable(error) and not is_rate_limited(error))
+
+
+def retry_after_seconds(error):
+    """Server-suggested wait from a 429 response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    return parse_reset(headers.get("retry-after")) or parse_reset(headers.get("x-ratelimit-reset-requests"))
+
+
+def backoff_seconds(attempt, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+    """Full-jitter exponential backoff for the given (1-based) attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def call_with_retries(request, limiter=None, max_attempts=MAX_ATTEMPTS, audio_seconds=0, turn=None):
+    """
+    Calls `request()` inside a limiter slot, retrying transient failures.
+
+    `request` returns (result, response_headers). The last error is raised
+    once the attempts are used up. `turn` (a context manager factory, see
+    scheduler.FairShare) is taken per attempt, so backoff sleeps never hold it.
+    """
+    limiter = limiter or get_limiter()
+    for attempt in range(1, max_attempts + 1):
+        with turn() if turn else nullcontext(), limiter.slot(audio_seconds):
+            try:
+                result, headers = request()
+            except Exception as e:
+                if not is_retryable(e) or attempt == max_attempts:
+                    raise
+                error, retry_after = e, None
+                if is_rate_limited(e):
+                    retry_after = retry_after_seconds(e)
+                    limiter.record_rate_limited(retry_after)
+            else:
+                limiter.record_success(headers)
+                return result
+        # Sleep outside the slot so other requests can use it
+        delay = max(retry_after or 0, backoff_seconds(attempt))
+        print(f"Whisper call failed ({error.__class__.__name__}), retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+        time.sleep(delay)
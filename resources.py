@@ -0,0 +1,124 @@
+"""
+Shared clients for the UI (app.py) and the worker service (worker.py).
+
+Every client is created on first use and then cached for the whole process,
+so Streamlit reruns, jobs and chunks all share one Firestore client, one
+bucket handle and one OpenAI client, whose HTTP transport keeps a pool of
+connections alive between requests. The SDKs themselves are imported on
+first use too: importing this module costs nothing, so a cold instance can
+render the login page before firebase_admin or openai have even loaded.
+"""
+import os
+import threading
+import time
+
+BUCKET_NAME = "taglish-transcriber-v1.firebasestorage.app"
+
+# Connections kept open to the OpenAI API (shared by every job in the process)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "16"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "600"))
+
+_lock = threading.RLock()
+_db = None
+_bucket = None
+_openai_clients = {}
+# Seconds spent creating each client, for the cold start summary
+startup_seconds = {}
+
+
+def _timed(name, create):
+    started = time.perf_counter()
+    value = create()
+    startup_seconds[name] = round(time.perf_counter() - started, 3)
+    print(f"⏱️ {name} ready in {startup_seconds[name]:.2f}s")
+    return value
+
+
+def _create_firestore():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        # Dual Auth Strategy: Local Key vs Cloud Identity
+        if os.path.exists("serviceAccountKey.json"):
+            cred = credentials.Certificate("serviceAccountKey.json")
+        else:
+            # Production: Use Google Cloud Identity (ADC)
+            print("🔑 Using Application Default Credentials (Cloud Run)")
+            cred = credentials.ApplicationDefault()
+
+        firebase_admin.initialize_app(cred, {
+            'storageBucket': BUCKET_NAME
+        })
+    return firestore.client()
+
+
+def initialize_firebase():
+    """
+    Initializes Firebase Admin SDK if not already initialized and returns the
+    process-wide Firestore client. Raises if the credentials cannot be loaded.
+    """
+    global _db
+    with _lock:
+        if _db is None:
+            _db = _timed("firestore", _create_firestore)
+        return _db
+
+
+def get_bucket():
+    """The uploads bucket (explicitly by name to avoid default config issues)."""
+    global _bucket
+    with _lock:
+        if _bucket is None:
+            initialize_firebase()
+            from firebase_admin import storage
+
+            _bucket = _timed("bucket", lambda: storage.bucket(name=BUCKET_NAME))
+        return _bucket
+
+
+def get_openai_client(api_key=None):
+    """Process-wide OpenAI client per API key, on a pooled keep-alive HTTP transport."""
+    api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY", "").strip()
+    with _lock:
+        if api_key not in _openai_clients:
+            def create():
+                import httpx
+                import openai
+
+                http_client = openai.DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+                    ),
+                    timeout=OPENAI_TIMEOUT_SECONDS,
+                )
+                # Retries are handled by rate_limit, not by the SDK
+                return openai.OpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+
+            _openai_clients[api_key] = _timed("openai", create)
+        return _openai_clients[api_key]
+
+
+_warm_up_started = False
+
+
+def warm_up():
+    """
+    Creates the Firestore client and the bucket in a background thread, once
+    per process, e.g. while the login page waits for a password.
+    """
+    global _warm_up_started
+    with _lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+
+    def run():
+        try:
+            get_bucket()
+        except Exception as e:
+            print(f"Warm-up failed (retried on first use): {e}")
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
@@ -0,0 +1,222 @@
+"""
+Fair, duration-aware scheduling of transcription jobs.
+
+Admission: workers claim queued jobs shortest first (by the recording's
+estimated length), with aging so a long job is not starved: every minute in
+the queue counts as SCHEDULER_AGING minutes less audio. A job is only claimed
+while fewer than SCHEDULER_MAX_JOBS jobs run in total and fewer than
+SCHEDULER_ORG_MAX_JOBS run for its organization (org_id on the job, see the
+org model in docs/multi_tenancy_design_patterns.md). Queued jobs get their
+queue_position and estimated_start on their status document.
+
+Chunks: inside a worker process, the jobs' chunks share the API through
+FairShare, a weighted fair queue with one virtual clock. Every chunk request
+is tagged with the virtual time at which it would finish if each job got an
+equal share; the smallest tag is served first. A short job's few chunks
+therefore go ahead of a long job's backlog instead of waiting behind it,
+and no job can take every slot.
+"""
+import heapq
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import rate_limit
+
+MAX_JOBS = int(os.getenv("SCHEDULER_MAX_JOBS", "6"))
+ORG_MAX_JOBS = int(os.getenv("SCHEDULER_ORG_MAX_JOBS", "2"))
+# Minutes of audio a job is moved up for each minute it waits
+AGING = float(os.getenv("SCHEDULER_AGING", "10"))
+# Processing seconds per second of audio, for start time estimates
+SECONDS_PER_AUDIO_SECOND = float(os.getenv("SCHEDULER_SECONDS_PER_AUDIO_SECOND", "0.1"))
+# Assumed length of a job whose size is unknown
+DEFAULT_AUDIO_SECONDS = 30 * 60
+DEFAULT_ORG = "default"
+# How often workers refresh the queued jobs' positions
+PUBLISH_SECONDS = int(os.getenv("SCHEDULER_PUBLISH_SECONDS", "30"))
+
+# Bit rates used to guess a recording's length from its size
+BIT_RATES = {"mp3": 128000, "m4a": 96000, "wav": 1411200}
+
+
+def estimate_audio_seconds(size_bytes, filename):
+    """Rough recording length from the upload size, before anything has been probed."""
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else "mp3"
+    return size_bytes * 8 / BIT_RATES.get(extension, BIT_RATES["mp3"])
+
+
+def job_org(data):
+    return data.get("org_id") or DEFAULT_ORG
+
+
+def audio_seconds(data):
+    """The probed length once the job has started, else the estimate made at upload."""
+    return float(data.get("duration_seconds") or data.get("estimated_seconds") or DEFAULT_AUDIO_SECONDS)
+
+
+def _timestamp(value, now):
+    if value is None:
+        return now
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return now
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def priority(data, now):
+    """Smaller runs first: audio seconds, minus AGING seconds per second waited."""
+    waited = (now - _timestamp(data.get("upload_date"), now)).total_seconds()
+    return audio_seconds(data) - AGING * max(0.0, waited)
+
+
+def order(queued, now):
+    """Queued (job_id, data) pairs in the order they should run."""
+    return sorted(queued, key=lambda job: (priority(job[1], now), job[0]))
+
+
+def admits(data, running, max_jobs=MAX_JOBS, org_max_jobs=ORG_MAX_JOBS):
+    """True if a job may start next to the `running` jobs' data."""
+    if len(running) >= max_jobs:
+        return False
+    org = job_org(data)
+    return sum(1 for other in running if job_org(other) == org) < org_max_jobs
+
+
+def admissible(queued, running, now):
+    """Queued jobs that may start now, best first."""
+    return [(job_id, data) for job_id, data in order(queued, now) if admits(data, running)]
+
+
+def remaining_seconds(data):
+    """Processing time left for a running job."""
+    done = min(99, data.get("progress") or 0) / 100
+    return audio_seconds(data) * (1 - done) * SECONDS_PER_AUDIO_SECOND
+
+
+def estimate_starts(queued, running, now, max_jobs=MAX_JOBS, org_max_jobs=ORG_MAX_JOBS):
+    """
+    {job_id: (queue position, estimated start)} for queued jobs, by
+    replaying the queue against the global and per-organization slots.
+    """
+    slots = [0.0] * max(0, max_jobs - len(running))
+    org_slots = {}
+    for data in running:
+        finish = remaining_seconds(data)
+        slots.append(finish)
+        org_slots.setdefault(job_org(data), []).append(finish)
+    heapq.heapify(slots)
+    for busy in org_slots.values():
+        heapq.heapify(busy)
+
+    estimates = {}
+    for position, (job_id, data) in enumerate(order(queued, now), start=1):
+        busy = org_slots.setdefault(job_org(data), [])
+        org_free = 0.0 if len(busy) < org_max_jobs else heapq.heappop(busy)
+        start = max(heapq.heappop(slots) if slots else 0.0, org_free)
+        finish = start + audio_seconds(data) * SECONDS_PER_AUDIO_SECOND
+        heapq.heappush(slots, finish)
+        heapq.heappush(busy, finish)
+        estimates[job_id] = (position, now + timedelta(seconds=start))
+    return estimates
+
+
+_published = {}
+_published_lock = threading.Lock()
+
+
+def publish_positions(db, estimates, collection="transcripts"):
+    """Writes queue_position / estimated_start to queued jobs whose values changed."""
+    for job_id, (position, start) in estimates.items():
+        minute = start.replace(second=0, microsecond=0)
+        with _published_lock:
+            if _published.get(job_id) == (position, minute):
+                continue
+            _published[job_id] = (position, minute)
+        try:
+            db.collection(collection).document(job_id).update({
+                "queue_position": position,
+                "estimated_start": start,
+                "message": f"Queued (position {position})...",
+            })
+        except Exception as e:
+            print(f"Could not publish the queue position of {job_id}: {e}")
+    with _published_lock:
+        for job_id in set(_published) - set(estimates):
+            del _published[job_id]
+
+
+class FairShare:
+    """
+    Weighted fair queuing of chunk requests across the jobs in this process.
+
+    At most `capacity()` requests hold a turn at once (by default the
+    adaptive API limit of rate_limit.py). A turn covers one request attempt;
+    retries queue again with a new tag. A request's tag is the job's
+    virtual finish time: max(virtual clock, job's previous tag) plus the
+    chunk's audio seconds divided by the job's weight.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or (lambda: int(rate_limit.get_limiter().limit))
+        self.virtual_time = 0.0
+        self.active = 0
+        self._finish = {}
+        self._waiting = []
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def turn(self, job_id, audio_seconds, weight=1.0):
+        """Waits until this chunk is the best-tagged request and a slot is free, and holds it."""
+        with self._cond:
+            start = max(self.virtual_time, self._finish.get(job_id, 0.0))
+            tag = start + max(1.0, audio_seconds) / weight
+            self._finish[job_id] = tag
+            entry = (tag, threading.get_ident(), job_id)
+            heapq.heappush(self._waiting, entry)
+            granted = False
+            try:
+                while self._waiting[0] != entry or self.active >= max(1, self.capacity()):
+                    self._cond.wait(timeout=5)
+                heapq.heappop(self._waiting)
+                self.virtual_time = max(self.virtual_time, start)
+                self.active += 1
+                granted = True
+            finally:
+                if not granted:
+                    # Interrupted while waiting: leave the queue so nobody waits behind this entry
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def forget(self, job_id):
+        """Drops a finished job's tag."""
+        with self._cond:
+            self._finish.pop(job_id, None)
+
+    def stats(self):
+        with self._cond:
+            return {"active": self.active, "waiting": len(self._waiting), "jobs": len(self._finish)}
+
+
+_fair_share = None
+_fair_share_lock = threading.Lock()
+
+
+def get_fair_share():
+    """The process-wide FairShare shared by every job."""
+    global _fair_share
+    with _fair_share_lock:
+        if _fair_share is None:
+            _fair_share = FairShare()
+        return _fair_share
@@ -0,0 +1,666 @@
+"""
+Full-text search across all transcripts.
+
+An inverted index maps each token of the (Taglish) transcript text to the
+transcript, segment and word position where it occurs, so phrase and prefix
+queries never scan the `transcripts` collection.
+
+The index is a set of immutable shards. Every completed job adds one small
+shard. Shards are merged by size tier (MERGE_FACTOR shards of a similar
+size into one, in a background thread), so a job never waits for a merge
+and each transcript is only rewritten a logarithmic number of times.
+Merges go term by term and never hold the whole index in memory. A shard
+is two files:
+
+- {name}.dict.gz: the sorted term dictionary with postings offsets, and the
+                  shard's documents (job id, filename, date).
+- {name}.post:    varint, delta-encoded postings (document, segment,
+                  position) followed by each document's segment start
+                  times (uint32 milliseconds), so a hit links to its
+                  exact timestamp.
+
+manifest.json lists the shards and which shard holds the live copy of each
+job. Re-indexing or deleting a job only rewrites the manifest. Postings are
+read through a memory map, and the most recently used ones are kept decoded
+in an in-memory LRU.
+
+SEARCH_INDEX selects where the index lives:
+
+- "bucket": local files in SEARCH_INDEX_DIR, shared through Cloud Storage
+            under search_index/ (the default). The manifest is updated with
+            generation preconditions, so concurrent workers never lose
+            each other's jobs.
+- "local":  local files only. Processes sharing SEARCH_INDEX_DIR update the
+            manifest under a file lock.
+- "off":    no indexing.
+"""
+import bisect
+import contextlib
+import gzip
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from array import array
+from collections import OrderedDict, namedtuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locking between processes
+    fcntl = None
+
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "bucket").strip().lower()
+INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "/tmp/search_index")
+POSTINGS_CACHE_SIZE = int(os.getenv("SEARCH_POSTINGS_CACHE", "4096"))
+# This many shards of one size tier are merged into one. A shard's tier is
+# log(live transcripts in it, MERGE_FACTOR): 1-7 transcripts is tier 0, 8-63 tier 1, ...
+MERGE_FACTOR = 8
+# Prefix queries expand to at most this many terms
+MAX_PREFIX_TERMS = 256
+# How often readers check Storage for new shards
+SYNC_INTERVAL_SECONDS = 30
+BUCKET_PREFIX = "search_index/"
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "manifest.lock"
+# Unlisted local files younger than this are kept: another process may be
+# about to list them (a new shard) or still be writing them (.tmp files)
+UNUSED_MIN_AGE_SECONDS = 3600
+
+Hit = namedtuple("Hit", ["job_id", "filename", "date", "segment", "start"])
+
+# Words are runs of letters/digits, keeping inner apostrophes (don't, 'yung)
+TOKEN_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+
+def tokenize(text):
+    """Lower-cased word tokens; hyphenated Tagalog (mag-aral) becomes two tokens, in queries too."""
+    return TOKEN_RE.findall(unicodedata.normalize("NFKC", text).casefold())
+
+
+# --- Varint postings ---
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data, offset):
+    """Yields the varints in data[offset:] one at a time."""
+    value = shift = 0
+    for byte in memoryview(data)[offset:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+def encode_postings(postings):
+    """Encodes sorted (doc, segment, position) triples with per-field deltas."""
+    out = bytearray()
+    _write_varint(out, len(postings))
+    last_doc = last_segment = last_position = 0
+    for doc, segment, position in postings:
+        if doc != last_doc:
+            last_segment = last_position = 0
+        elif segment != last_segment:
+            last_position = 0
+        _write_varint(out, doc - last_doc)
+        _write_varint(out, segment - last_segment)
+        _write_varint(out, position - last_position)
+        last_doc, last_segment, last_position = doc, segment, position
+    return bytes(out)
+
+
+def decode_postings(data, offset=0):
+    values = _read_varints(data, offset)
+    postings = []
+    doc = segment = position = 0
+    for _ in range(next(values)):
+        doc_delta = next(values)
+        if doc_delta:
+            segment = position = 0
+        segment_delta = next(values)
+        if segment_delta:
+            position = 0
+        doc += doc_delta
+        segment += segment_delta
+        position += next(values)
+        postings.append((doc, segment, position))
+    return postings
+
+
+# --- Shards ---
+
+class ShardWriter:
+    """Writes one shard; terms must be added in sorted order."""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.docs = []
+        self.terms = []
+        self.offsets = []
+        self._post = open(os.path.join(directory, f"{name}.post.tmp"), "wb")
+        self._size = 0
+        self._starts = []
+
+    def add_doc(self, job_id, filename, date, starts):
+        """Registers a document (segment start times in seconds) and returns its number."""
+        self.docs.append({"job_id": job_id, "filename": filename, "date": date, "segments": len(starts)})
+        self._starts.append(array("I", (int(round(start * 1000)) for start in starts)))
+        return len(self.docs) - 1
+
+    def add_term(self, term, postings):
+        data = encode_postings(postings)
+        self.terms.append(term)
+        self.offsets.append(self._size)
+        self._post.write(data)
+        self._size += len(data)
+
+    def close(self):
+        for doc, starts in zip(self.docs, self._starts):
+            doc["starts_offset"] = self._size
+            data = starts.tobytes()
+            self._post.write(data)
+            self._size += len(data)
+        self._post.close()
+        dict_tmp = os.path.join(self.directory, f"{self.name}.dict.gz.tmp")
+        with gzip.open(dict_tmp, "wt", encoding="utf-8") as f:
+            json.dump({"docs": self.docs, "terms": self.terms, "offsets": self.offsets}, f, ensure_ascii=False)
+        os.replace(os.path.join(self.directory, f"{self.name}.post.tmp"), os.path.join(self.directory, f"{self.name}.post"))
+        os.replace(dict_tmp, os.path.join(self.directory, f"{self.name}.dict.gz"))
+
+
+def shard_files(name):
+    return [f"{name}.dict.gz", f"{name}.post"]
+
+
+class Shard:
+    """Read side of one shard: the term dictionary in memory, postings memory-mapped."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        with gzip.open(os.path.join(directory, f"{name}.dict.gz"), "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        self.docs = data["docs"]
+        self.terms = data["terms"]
+        self.offsets = data["offsets"]
+        self._file = open(os.path.join(directory, f"{name}.post"), "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self._file.name) else b""
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def postings(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return []
+        return decode_postings(self._data, self.offsets[i])
+
+    def terms_with_prefix(self, prefix, limit=MAX_PREFIX_TERMS):
+        i = bisect.bisect_left(self.terms, prefix)
+        terms = []
+        while i < len(self.terms) and self.terms[i].startswith(prefix) and len(terms) < limit:
+            terms.append(self.terms[i])
+            i += 1
+        return terms
+
+    def start_seconds(self, doc, segment):
+        offset = self.docs[doc]["starts_offset"] + segment * 4
+        return array("I", self._data[offset:offset + 4])[0] / 1000
+
+
+def write_transcript_shard(directory, job_id, filename, date, transcript):
+    """Builds a one-document shard for a SegmentList and returns its name."""
+    postings = {}
+    for segment, text in enumerate(transcript.texts):
+        for position, token in enumerate(tokenize(text)):
+            postings.setdefault(token, []).append((0, segment, position))
+    name = new_shard_name()
+    writer = ShardWriter(directory, name)
+    writer.add_doc(job_id, filename, date, transcript.starts)
+    for term in sorted(postings):
+        writer.add_term(term, postings[term])
+    writer.close()
+    return name
+
+
+def merge_shards(directory, shards, live):
+    """
+    Merges shards into a new one, keeping only documents that are live in
+    them (`live` maps job id -> shard name). Terms are merged in sorted
+    order, one term's postings at a time.
+    """
+    name = new_shard_name()
+    writer = ShardWriter(directory, name)
+    remap = []  # per shard: old doc number -> new doc number (None = dropped)
+    for shard in shards:
+        numbers = []
+        for doc_number, doc in enumerate(shard.docs):
+            if live.get(doc["job_id"]) == shard.name:
+                starts = [shard.start_seconds(doc_number, segment) for segment in range(doc["segments"])]
+                numbers.append(writer.add_doc(doc["job_id"], doc["filename"], doc.get("date"), starts))
+            else:
+                numbers.append(None)
+        remap.append(numbers)
+
+    for term in heapq.merge(*(shard.terms for shard in shards)):
+        if writer.terms and writer.terms[-1] == term:
+            continue
+        postings = []
+        for shard, numbers in zip(shards, remap):
+            for doc, segment, position in shard.postings(term):
+                if numbers[doc] is not None:
+                    postings.append((numbers[doc], segment, position))
+        if postings:
+            writer.add_term(term, postings)
+    writer.close()
+    return name
+
+
+def new_shard_name():
+    return f"{int(time.time() * 1000):x}-{uuid.uuid4().hex[:8]}"
+
+
+# --- Queries ---
+
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def parse_query(query):
+    """
+    Splits a query into clauses: "quoted phrases", prefix* words and plain
+    words. Every clause must match within the same segment.
+    """
+    clauses = []
+    for phrase, word in QUERY_RE.findall(query):
+        if phrase:
+            tokens = tokenize(phrase)
+            if tokens:
+                clauses.append(("phrase", tokens))
+            continue
+        tokens = tokenize(word)
+        if not tokens:
+            continue
+        if word.endswith("*"):
+            clauses.append(("prefix", tokens))
+        elif len(tokens) > 1:
+            clauses.append(("phrase", tokens))
+        else:
+            clauses.append(("term", tokens))
+    return clauses
+
+
+class SearchIndex:
+    """The shard set of one index directory, optionally shared through a Storage bucket."""
+
+    def __init__(self, directory=INDEX_DIR, bucket=None, cache_size=POSTINGS_CACHE_SIZE):
+        self.directory = directory
+        self.bucket = bucket
+        self.cache_size = cache_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # (shard, term) -> postings, least recently used first
+        self._shards = {}
+        self._manifest = {"shards": [], "docs": {}}
+        self._generation = None
+        self._synced_at = 0.0
+        # One merge at a time per process
+        self._merge_lock = threading.Lock()
+        self._load_local_manifest()
+
+    # --- Manifest ---
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _load_local_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                data = json.load(f)
+            self._manifest, self._generation = data["manifest"], data.get("generation")
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def _save_local_manifest(self):
+        tmp_path = f"{self._manifest_path()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"manifest": self._manifest, "generation": self._generation}, f)
+        os.replace(tmp_path, self._manifest_path())
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Holds the directory's lock file, so processes sharing it update the manifest one at a time."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, LOCK_NAME), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _update_manifest(self, change):
+        """Applies change(manifest) to the shared manifest, retrying when another writer got there first."""
+        with self._lock:
+            if self.bucket is None:
+                with self._file_lock():
+                    self._load_local_manifest()
+                    change(self._manifest)
+                    self._save_local_manifest()
+                return
+            from google.api_core.exceptions import PreconditionFailed
+
+            blob = self.bucket.blob(BUCKET_PREFIX + MANIFEST_NAME)
+            for _ in range(10):
+                manifest, generation = self._read_remote_manifest(blob)
+                change(manifest)
+                try:
+                    blob.upload_from_string(
+                        json.dumps(manifest), content_type="application/json", if_generation_match=generation or 0
+                    )
+                except PreconditionFailed:
+                    continue
+                self._manifest, self._generation = manifest, blob.generation
+                self._save_local_manifest()
+                return
+            raise RuntimeError("Search index manifest is busy, giving up")
+
+    @staticmethod
+    def _read_remote_manifest(blob):
+        if not blob.exists():
+            return {"shards": [], "docs": {}}, None
+        blob.reload()
+        generation = blob.generation
+        return json.loads(blob.download_as_bytes(if_generation_match=generation)), generation
+
+    def sync(self, force=False):
+        """Picks up shards written by other instances (at most every SYNC_INTERVAL_SECONDS)."""
+        if self.bucket is None or (not force and time.monotonic() - self._synced_at < SYNC_INTERVAL_SECONDS):
+            return
+        with self._lock:
+            blob = self.bucket.blob(BUCKET_PREFIX + MANIFEST_NAME)
+            if blob.exists():
+                blob.reload()
+                if blob.generation != self._generation:
+                    self._manifest, self._generation = self._read_remote_manifest(blob)
+                    self._save_local_manifest()
+                    self._drop_unused()
+            self._synced_at = time.monotonic()
+
+    # --- Shards ---
+
+    def _shard(self, name):
+        """Opens a shard, downloading it from the bucket if this instance has not seen it yet."""
+        shard = self._shards.get(name)
+        if shard is None:
+            if not os.path.exists(os.path.join(self.directory, f"{name}.dict.gz")) and self.bucket is not None:
+                for file_name in shard_files(name):
+                    self.bucket.blob(BUCKET_PREFIX + file_name).download_to_filename(
+                        os.path.join(self.directory, file_name)
+                    )
+            shard = self._shards[name] = Shard(self.directory, name)
+        return shard
+
+    def _upload(self, name):
+        if self.bucket is not None:
+            for file_name in shard_files(name):
+                self.bucket.blob(BUCKET_PREFIX + file_name).upload_from_filename(
+                    os.path.join(self.directory, file_name)
+                )
+
+    def _drop_unused(self, min_age_seconds=UNUSED_MIN_AGE_SECONDS):
+        """
+        Closes and deletes local shards that the manifest no longer lists.
+        Recent files are kept: another process may be about to list them.
+        """
+        listed = set(self._manifest["shards"])
+        for name in [name for name in self._shards if name not in listed]:
+            self._shards.pop(name).close()
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if file_name in (MANIFEST_NAME, LOCK_NAME) or file_name.split(".", 1)[0] in listed:
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) > min_age_seconds:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # --- Updates ---
+
+    def add_transcript(self, job_id, filename, date, transcript, merge=True):
+        """Indexes a completed job (replacing any earlier copy of it); a due merge runs in the background."""
+        with self._lock:
+            name = write_transcript_shard(self.directory, job_id, filename, date, transcript)
+            self._upload(name)
+
+            def add(manifest):
+                manifest["shards"].append(name)
+                manifest["docs"][job_id] = name
+
+            self._update_manifest(add)
+        if merge and self._merge_candidates() and not self._merge_lock.locked():
+            threading.Thread(target=self._merge_in_background, name="search-merge", daemon=True).start()
+
+    def remove(self, job_id):
+        def remove(manifest):
+            manifest["docs"].pop(job_id, None)
+
+        self._update_manifest(remove)
+
+    def _merge_candidates(self):
+        """The shards of the smallest tier holding at least MERGE_FACTOR shards, or [] (manifest only, no I/O)."""
+        with self._lock:
+            sizes = dict.fromkeys(self._manifest["shards"], 0)
+            for name in self._manifest["docs"].values():
+                if name in sizes:
+                    sizes[name] += 1
+        tiers = {}
+        for name, size in sizes.items():
+            tiers.setdefault(int(math.log(max(1, size), MERGE_FACTOR) + 1e-9), []).append(name)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= MERGE_FACTOR:
+                return tiers[tier][:MERGE_FACTOR]
+        return []
+
+    def merge_tiers(self):
+        """Merges similar-sized shards until no tier is full (a merged shard may fill the next one)."""
+        with self._merge_lock:
+            while True:
+                names = self._merge_candidates()
+                if not names:
+                    return
+                self._merge(names)
+
+    def _merge_in_background(self):
+        try:
+            self.merge_tiers()
+        except Exception as e:
+            # The shards stay as they are; the next completed job tries again
+            print(f"Search index merge failed: {e}")
+
+    def compact(self):
+        """Merges every current shard into one."""
+        with self._merge_lock:
+            with self._lock:
+                names = list(self._manifest["shards"])
+            if len(names) > 1:
+                self._merge(names)
+
+    def _merge(self, names):
+        """Merges the named shards into one (reading them outside the index lock) and swaps it in."""
+        with self._lock:
+            shards = [self._shard(name) for name in names]
+            live = dict(self._manifest["docs"])
+        merged = merge_shards(self.directory, shards, live)
+        with self._lock:
+            self._upload(merged)
+
+            def replace(manifest):
+                # Shards added by other writers in the meantime stay as they are
+                manifest["shards"] = [name for name in manifest["shards"] if name not in names] + [merged]
+                for job_id, shard in manifest["docs"].items():
+                    if shard in names:
+                        manifest["docs"][job_id] = merged
+
+            self._update_manifest(replace)
+            self._cache.clear()
+            self._drop_unused()
+            if self.bucket is not None:
+                for name in names:
+                    for file_name in shard_files(name):
+                        try:
+                            self.bucket.blob(BUCKET_PREFIX + file_name).delete()
+                        except Exception as e:
+                            print(f"Could not delete merged search shard {file_name}: {e}")
+
+    # --- Queries ---
+
+    def _postings(self, shard, term):
+        key = (shard.name, term)
+        with self._lock:
+            postings = self._cache.get(key)
+            if postings is not None:
+                self._cache.move_to_end(key)
+                return postings
+        postings = shard.postings(term)
+        with self._lock:
+            self._cache[key] = postings
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return postings
+
+    def _clause_segments(self, shard, clause):
+        """{(doc, segment)} matching one clause in a shard."""
+        kind, tokens = clause
+        if kind == "term":
+            return {(doc, segment) for doc, segment, _ in self._postings(shard, tokens[0])}
+        if kind == "prefix":
+            positions = self._phrase_positions(shard, tokens[:-1])
+            matches = set()
+            for term in shard.terms_with_prefix(tokens[-1]):
+                for doc, segment, position in self._postings(shard, term):
+                    if positions is None or position - 1 in positions.get((doc, segment), ()):
+                        matches.add((doc, segment))
+            return matches
+        return set(self._phrase_positions(shard, tokens))
+
+    def _phrase_positions(self, shard, tokens):
+        """{(doc, segment): positions of the phrase's last token}, or None for an empty phrase."""
+        if not tokens:
+            return None
+        positions = {}
+        for doc, segment, position in self._postings(shard, tokens[0]):
+            positions.setdefault((doc, segment), set()).add(position)
+        for token in tokens[1:]:
+            following = {}
+            for doc, segment, position in self._postings(shard, token):
+                if position - 1 in positions.get((doc, segment), ()):
+                    following.setdefault((doc, segment), set()).add(position)
+            positions = following
+            if not positions:
+                break
+        return positions
+
+    def search(self, query, limit=50):
+        """Hits for a query, newest recordings first and in time order within a recording."""
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        self.sync()
+        with self._lock:
+            names = list(self._manifest["shards"])
+            live = dict(self._manifest["docs"])
+        hits = []
+        for name in names:
+            try:
+                with self._lock:
+                    shard = self._shard(name)
+            except Exception as e:
+                # Merged away by another instance since our last sync
+                print(f"Search shard {name} unavailable: {e}")
+                continue
+            matches = None
+            for clause in sorted(clauses, key=lambda clause: clause[0] != "phrase"):
+                segments = self._clause_segments(shard, clause)
+                matches = segments if matches is None else matches & segments
+                if not matches:
+                    break
+            for doc, segment in matches or ():
+                info = shard.docs[doc]
+                if live.get(info["job_id"]) == name:
+                    hits.append(Hit(
+                        info["job_id"], info["filename"], info.get("date"), segment, shard.start_seconds(doc, segment),
+                    ))
+        hits.sort(key=lambda hit: (hit.date or "", hit.job_id, -hit.start), reverse=True)
+        return hits[:limit]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Process-wide index (None when SEARCH_INDEX=off)."""
+    global _index
+    if SEARCH_INDEX == "off":
+        return None
+    with _index_lock:
+        if _index is None:
+            bucket = None
+            if SEARCH_INDEX == "bucket":
+                import resources
+                bucket = resources.get_bucket()
+            _index = SearchIndex(bucket=bucket)
+        return _index
+
+
+def index_job(job_id, filename, upload_date, transcript):
+    """Adds a completed job to the index; never fails the job."""
+    index = get_index()
+    if index is None:
+        return
+    try:
+        date = upload_date.isoformat() if hasattr(upload_date, "isoformat") else upload_date
+        index.add_transcript(job_id, filename, date, transcript)
+    except Exception as e:
+        print(f"Search indexing failed for {job_id}: {e}")
+
+
+def rebuild(db):
+    """Indexes every completed job that has segment pages (one pass over the collection)."""
+    import segments
+
+    if get_index() is None:
+        print("Search indexing is off (SEARCH_INDEX=off)")
+        return
+    query = db.collection("transcripts").where("status", "==", "completed").select(["filename", "upload_date"])
+    count = 0
+    for doc in query.stream():
+        data = doc.to_dict() or {}
+        transcript = segments.load_transcript(doc.reference)
+        if transcript is not None:
+            index_job(doc.id, data.get("filename"), data.get("upload_date"), transcript)
+            count += 1
+    # Finish any merge before the process exits
+    get_index().merge_tiers()
+    print(f"🔎 Indexed {count} transcripts")
+
+
+if __name__ == "__main__":
+    import resources
+    rebuild(resources.initialize_firebase())
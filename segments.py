@@ -0,0 +1,199 @@
+"""
+Compact transcript segment model.
+
+A transcript is held as parallel arrays (start, end, avg_logprob) plus lists
+of texts and speaker labels instead of one growing markdown string. It keeps the segment end
+times and Whisper confidence that the Review Station needs, and it is stored
+in Firestore as fixed-size pages under transcripts/{job_id}/pages so a long
+meeting never approaches the 1 MiB document limit.
+
+Markdown, TXT, SRT and VTT are rendered lazily from the model on demand.
+"""
+import math
+from array import array
+from collections import namedtuple
+
+PAGES_COLLECTION = "pages"
+# ~500 segments is roughly 50-100KB per page document
+PAGE_SIZE = 500
+
+Segment = namedtuple("Segment", ["start", "end", "text", "avg_logprob", "speaker"], defaults=(None,))
+
+
+def format_timestamp(seconds):
+    """Converts seconds to [H:MM:SS] format for audio player compatibility."""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    sec = int(seconds % 60)
+    return f"[{hours}:{minutes:02d}:{sec:02d}]"
+
+
+def _clock(seconds, separator):
+    """HH:MM:SS<sep>mmm, as used by SRT (",") and VTT (".")."""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    sec, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{sec:02d}{separator}{millis:03d}"
+
+
+class SegmentList:
+    """Array-backed list of transcript segments (times in seconds, global to the recording)."""
+
+    __slots__ = ("starts", "ends", "logprobs", "texts", "speakers")
+
+    def __init__(self):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.logprobs = array("d")  # NaN where Whisper gave no confidence
+        self.texts = []
+        self.speakers = []  # None until diarization labels the segment
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        logprob = self.logprobs[i]
+        return Segment(
+            self.starts[i], self.ends[i], self.texts[i], None if math.isnan(logprob) else logprob, self.speakers[i]
+        )
+
+    def __iter__(self):
+        for i in range(len(self.texts)):
+            yield self[i]
+
+    def append(self, start, end, text, avg_logprob=None, speaker=None):
+        self.starts.append(start)
+        self.ends.append(end if end is not None else start)
+        self.logprobs.append(math.nan if avg_logprob is None else avg_logprob)
+        self.texts.append(text)
+        self.speakers.append(speaker)
+
+    def extend_dicts(self, segments, offset_seconds=0):
+        """Appends Whisper-style segment dicts (start/end/text/avg_logprob/speaker), skipping empty text."""
+        for segment in segments:
+            text = (segment.get("text") or "").strip()
+            if text:
+                end = segment.get("end")
+                self.append(
+                    segment["start"] + offset_seconds,
+                    end + offset_seconds if end is not None else None,
+                    text,
+                    segment.get("avg_logprob"),
+                    segment.get("speaker"),
+                )
+
+    @classmethod
+    def from_dicts(cls, segments, offset_seconds=0):
+        items = cls()
+        items.extend_dicts(segments, offset_seconds)
+        return items
+
+    # --- Storage ---
+
+    def to_pages(self, page_size=PAGE_SIZE):
+        """
+        Splits the list into page dicts of parallel arrays (null for missing
+        confidence). Speaker labels are only stored once a transcript has them.
+        """
+        labelled = any(self.speakers)
+        pages = []
+        for first in range(0, len(self), page_size):
+            last = min(first + page_size, len(self))
+            page = {
+                "first_index": first,
+                "start": list(self.starts[first:last]),
+                "end": list(self.ends[first:last]),
+                "avg_logprob": [None if math.isnan(lp) else lp for lp in self.logprobs[first:last]],
+                "text": self.texts[first:last],
+            }
+            if labelled:
+                page["speaker"] = self.speakers[first:last]
+            pages.append(page)
+        return pages
+
+    @classmethod
+    def from_pages(cls, pages):
+        segments = cls()
+        for page in sorted(pages, key=lambda page: page["first_index"]):
+            segments.starts.extend(page["start"])
+            segments.ends.extend(page["end"])
+            segments.logprobs.extend(math.nan if lp is None else lp for lp in page["avg_logprob"])
+            segments.texts.extend(page["text"])
+            segments.speakers.extend(page.get("speaker") or [None] * len(page["text"]))
+        return segments
+
+    # --- Rendering (lazy: each yields one segment's output at a time) ---
+
+    def _speaker_changes(self):
+        """Yields (i, speaker or None), giving the speaker only where it changes."""
+        previous = None
+        for i, speaker in enumerate(self.speakers):
+            yield i, speaker if speaker != previous else None
+            previous = speaker
+
+    def iter_markdown(self):
+        for i, speaker in self._speaker_changes():
+            label = f"**{speaker}:** " if speaker else ""
+            yield f"**{format_timestamp(self.starts[i])}** {label}{self.texts[i]}\n\n"
+
+    def iter_txt(self):
+        for i, speaker in self._speaker_changes():
+            label = f"{speaker}: " if speaker else ""
+            yield f"{format_timestamp(self.starts[i])} {label}{self.texts[i]}\n"
+
+    def iter_srt(self):
+        for i, text in enumerate(self.texts):
+            label = f"{self.speakers[i]}: " if self.speakers[i] else ""
+            yield f"{i + 1}\n{_clock(self.starts[i], ',')} --> {_clock(self.ends[i], ',')}\n{label}{text}\n\n"
+
+    def iter_vtt(self):
+        yield "WEBVTT\n\n"
+        for i, text in enumerate(self.texts):
+            voice = f"<v {self.speakers[i]}>" if self.speakers[i] else ""
+            yield f"{_clock(self.starts[i], '.')} --> {_clock(self.ends[i], '.')}\n{voice}{text}\n\n"
+
+    def render(self, fmt="md"):
+        """Renders the whole transcript in one of EXPORT_FORMATS."""
+        return "".join(getattr(self, EXPORT_FORMATS[fmt][1])())
+
+
+# format key: (label, renderer method, file extension, mime type)
+EXPORT_FORMATS = {
+    "md": ("Markdown", "iter_markdown", "md", "text/markdown"),
+    "txt": ("Plain text", "iter_txt", "txt", "text/plain"),
+    "srt": ("SRT subtitles", "iter_srt", "srt", "application/x-subrip"),
+    "vtt": ("WebVTT subtitles", "iter_vtt", "vtt", "text/vtt"),
+}
+
+
+def save_pages(doc_ref, segments, page_size=PAGE_SIZE):
+    """Writes the transcript as page documents and records the page count on the job."""
+    pages = segments.to_pages(page_size)
+    collection = doc_ref.collection(PAGES_COLLECTION)
+    for number, page in enumerate(pages):
+        collection.document(f"{number:05d}").set(page)
+    # Drop leftover pages from a previous, longer run of the same job
+    for doc in collection.stream():
+        if int(doc.id) >= len(pages):
+            doc.reference.delete()
+    return {"segment_pages": len(pages), "segment_count": len(segments)}
+
+
+def load_page(doc_ref, number):
+    """One page of a stored transcript (e.g. to show a search hit), or None."""
+    snapshot = doc_ref.collection(PAGES_COLLECTION).document(f"{number:05d}").get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def load_transcript(doc_ref):
+    """Loads the stored SegmentList, or None for jobs saved before segment pages existed."""
+    pages = [doc.to_dict() for doc in doc_ref.collection(PAGES_COLLECTION).stream()]
+    if not pages:
+        return None
+    return SegmentList.from_pages(pages)
+
+
+def delete_pages(doc_ref):
+    for doc in doc_ref.collection(PAGES_COLLECTION).stream():
+        doc.reference.delete()
@@ -0,0 +1,55 @@
+import chunk_planner
+from chunk_planner import ChunkSpec
+
+LOUD, QUIET = 3000.0, 10.0
+
+
+def envelope(seconds, quiet=()):
+    """50ms RMS windows: loud throughout, except the (start_ms, end_ms) stretches in `quiet`."""
+    windows = [LOUD] * int(seconds * 1000 // chunk_planner.ENVELOPE_WINDOW_MS)
+    for start_ms, end_ms in quiet:
+        for i in range(start_ms // chunk_planner.ENVELOPE_WINDOW_MS, end_ms // chunk_planner.ENVELOPE_WINDOW_MS):
+            windows[i] = QUIET
+    return windows
+
+
+def test_find_cut_lands_in_the_middle_of_the_pause():
+    cut_ms, rms = chunk_planner.find_cut(envelope(10, quiet=[(5000, 6000)]), 0, 10000)
+    assert cut_ms == 5500
+    assert rms == QUIET
+
+
+def test_find_cut_prefers_the_latest_position_on_a_tie():
+    cut_ms, rms = chunk_planner.find_cut(envelope(10), 2000, 8000)
+    assert cut_ms == 7500
+    assert rms == LOUD
+
+
+def test_find_cut_range_shorter_than_a_pause():
+    assert chunk_planner.find_cut(envelope(10), 4000, 4500) == (4500, None)
+
+
+def test_fixed_plan():
+    assert chunk_planner.fixed_plan(25000, 10000) == [
+        ChunkSpec(0, 0, 10000), ChunkSpec(1, 10000, 20000), ChunkSpec(2, 20000, 25000),
+    ]
+
+
+def test_fixed_plan_continues_a_partial_plan():
+    assert chunk_planner.fixed_plan(25000, 10000, start_ms=12000, first_index=3) == [
+        ChunkSpec(3, 12000, 22000), ChunkSpec(4, 22000, 25000),
+    ]
+    assert chunk_planner.fixed_plan(25000, 10000, start_ms=25000, first_index=3) == []
+
+
+def test_max_chunk_ms_for_budget():
+    # 24 MB at 128 kbps is about 26 minutes, so the 10 minute cap applies
+    assert chunk_planner.max_chunk_ms_for_budget(128000, max_chunk_ms=600000) == 600000
+    assert chunk_planner.max_chunk_ms_for_budget(128000, byte_budget=160000) == 10000
+    assert chunk_planner.max_chunk_ms_for_budget(0, max_chunk_ms=600000) == 600000
+
+
+def test_plan_chunks_cuts_at_pauses_and_covers_the_file(monkeypatch):
+    monkeypatch.setattr(chunk_planner, "iter_envelope", lambda *args, **kwargs: iter(envelope(25, quiet=[(8000, 9000)])))
+    plan = list(chunk_planner.plan_chunks("recording.mp3", 0, max_chunk_ms=10000))
+    assert plan == [ChunkSpec(0, 0, 8500), ChunkSpec(1, 8500, 18000), ChunkSpec(2, 18000, 25000)]
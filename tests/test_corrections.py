@@ -0,0 +1,62 @@
+import corrections
+from corrections import CorrectionLog, GlossaryEntry
+from segments import SegmentList
+
+
+def transcript_of(*texts):
+    transcript = SegmentList()
+    for i, text in enumerate(texts):
+        transcript.append(i * 5.0, i * 5.0 + 5.0, text)
+    return transcript
+
+
+def apply(log, transcript, find, replace):
+    return log.apply(transcript, corrections.compile_glossary((GlossaryEntry(find, replace),)))
+
+
+def test_undo_first_batch_after_a_later_one():
+    transcript = transcript_of("Sabi ni Pasta John, sabi niya.", "Walang pagbabago dito.")
+    log = CorrectionLog()
+    assert apply(log, transcript, "Pasta John", "Pastor John") == 1
+    assert apply(log, transcript, "sabi", "sinabi") == 2
+    assert transcript.texts[0] == "sinabi ni Pastor John, sinabi niya."
+
+    # The first batch's edit moved when the later replacement before it grew the text
+    log.undo(transcript, 0)
+    assert transcript.texts[0] == "sinabi ni Pasta John, sinabi niya."
+
+    log.undo(transcript, 1)
+    log.undo(transcript, 2)
+    assert transcript.texts[0] == "Sabi ni Pasta John, sabi niya."
+    assert transcript.texts[1] == "Walang pagbabago dito."
+
+
+def test_undo_in_any_order_restores_the_text():
+    original = "sabi ni Pasta John at sabi ni Pasta Mark"
+    transcript = transcript_of(original)
+    log = CorrectionLog()
+    apply(log, transcript, "Pasta", "Pastor")
+    apply(log, transcript, "sabi", "sinabi")
+    apply(log, transcript, "Mark", "Marcos")
+    for number in (1, 4, 0, 3, 2):
+        log.undo(transcript, number)
+    assert transcript.texts[0] == original
+
+
+def test_replacement_inside_an_earlier_edit_is_skipped():
+    transcript = transcript_of("Sabi ni Pasta John.")
+    log = CorrectionLog()
+    apply(log, transcript, "Pasta", "Pastor")
+    # "Pastor John" would rewrite the first edit's text, which could then never be undone
+    matcher = corrections.compile_glossary((GlossaryEntry("Pastor John", "Ptr. John"), GlossaryEntry("Sabi", "Sinabi")))
+    assert log.count(transcript, matcher) == 1
+    assert log.apply(transcript, matcher) == 1
+    assert transcript.texts[0] == "Sinabi ni Pastor John."
+
+    log.undo(transcript, 0)
+    assert transcript.texts[0] == "Sinabi ni Pasta John."
+    # With the first edit undone the text is free to correct again
+    assert apply(log, transcript, "Pasta John", "Ptr. John") == 1
+    log.undo(transcript, 1)
+    log.undo(transcript, 2)
+    assert transcript.texts[0] == "Sabi ni Pasta John."
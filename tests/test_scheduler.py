@@ -0,0 +1,71 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import scheduler
+
+NOW = datetime(2024, 5, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def queued(minutes_ago, seconds, org="default"):
+    return {"upload_date": NOW - timedelta(minutes=minutes_ago), "estimated_seconds": seconds, "org_id": org}
+
+
+def test_order_shortest_first():
+    jobs = [("long", queued(0, 3600)), ("short", queued(0, 600)), ("unknown", {"upload_date": NOW})]
+    assert [job_id for job_id, _ in scheduler.order(jobs, NOW)] == ["short", "unknown", "long"]
+
+
+def test_order_ages_long_jobs_forward():
+    # Ten minutes in the queue count as 100 minutes less audio
+    jobs = [("short", queued(0, 600)), ("long", queued(10, 3600))]
+    assert [job_id for job_id, _ in scheduler.order(jobs, NOW)] == ["long", "short"]
+    # The probed length replaces the estimate once there is one
+    jobs = [("short", queued(0, 600)), ("long", dict(queued(0, 60), duration_seconds=5400))]
+    assert [job_id for job_id, _ in scheduler.order(jobs, NOW)] == ["short", "long"]
+
+
+def test_admits_per_org_quota():
+    running = [{"org_id": "a"}, {"org_id": "a"}, {}]
+    assert not scheduler.admits({"org_id": "a"}, running, max_jobs=6, org_max_jobs=2)
+    assert scheduler.admits({"org_id": "b"}, running, max_jobs=6, org_max_jobs=2)
+    # Jobs without an org count against the default one
+    assert not scheduler.admits({}, running, max_jobs=6, org_max_jobs=1)
+    assert not scheduler.admits({"org_id": "b"}, running, max_jobs=3, org_max_jobs=2)
+
+
+def test_estimate_starts_waits_for_the_org_slot():
+    running = [{"org_id": "a", "estimated_seconds": 1000, "progress": 50}]
+    jobs = [("a2", queued(0, 600, org="a")), ("b1", queued(0, 300, org="b"))]
+    estimates = scheduler.estimate_starts(jobs, running, NOW, max_jobs=2, org_max_jobs=1)
+    # b1 takes the free slot; a2 waits for its organization's running job (50s left)
+    assert estimates == {"b1": (1, NOW), "a2": (2, NOW + timedelta(seconds=50))}
+
+
+def test_fair_share_drops_an_interrupted_waiter():
+    interrupted = [False]
+
+    def capacity():
+        if interrupted[0]:
+            raise KeyboardInterrupt
+        return 1
+
+    fair_share = scheduler.FairShare(capacity)
+    with fair_share.turn("long", 600):
+        interrupted[0] = True
+        with pytest.raises(KeyboardInterrupt):
+            with fair_share.turn("short", 60):
+                pass
+        interrupted[0] = False
+        assert fair_share.stats() == {"active": 1, "waiting": 0, "jobs": 2}
+
+    # Nobody is left waiting behind the interrupted request
+    granted = threading.Event()
+
+    def next_chunk():
+        with fair_share.turn("next", 60):
+            granted.set()
+
+    threading.Thread(target=next_chunk, daemon=True).start()
+    assert granted.wait(timeout=2)
@@ -0,0 +1,79 @@
+import search_index
+from search_index import SearchIndex
+from segments import SegmentList
+
+
+def transcript(*texts):
+    return SegmentList.from_dicts([
+        {"start": i * 2.5, "end": i * 2.5 + 2.5, "text": text} for i, text in enumerate(texts)
+    ])
+
+
+def index(tmp_path):
+    search = SearchIndex(directory=str(tmp_path))
+    search.add_transcript("job-a", "umaga.mp3", "2024-05-01", transcript(
+        "Magandang umaga po sa inyong lahat.",
+        "Let us pray for our mag-aaral.",
+    ), merge=False)
+    search.add_transcript("job-b", "gabi.mp3", "2024-05-02", transcript(
+        "Magandang gabi po.",
+        "Umaga na bukas, pray tayo.",
+    ), merge=False)
+    return search
+
+
+def test_postings_round_trip():
+    postings = [(0, 0, 0), (0, 0, 5), (0, 3, 1), (2, 0, 7), (2, 0, 200), (9, 1000, 0)]
+    data = search_index.encode_postings(postings)
+    assert search_index.decode_postings(data) == postings
+    # Postings are read at an offset into the .post file
+    assert search_index.decode_postings(b"\x00\x01" + data, offset=2) == postings
+    assert search_index.decode_postings(search_index.encode_postings([])) == []
+
+
+def test_merge_keeps_only_live_documents(tmp_path):
+    directory = str(tmp_path)
+    old = search_index.write_transcript_shard(directory, "job-a", "a.mp3", None, transcript("lumang kopya"))
+    new = search_index.write_transcript_shard(directory, "job-a", "a.mp3", None, transcript("bagong kopya"))
+    other = search_index.write_transcript_shard(directory, "job-b", "b.mp3", None, transcript("ibang kopya", "pa"))
+    shards = [search_index.Shard(directory, name) for name in (old, new, other)]
+    merged = search_index.merge_shards(directory, shards, {"job-a": new, "job-b": other})
+    for shard in shards:
+        shard.close()
+
+    shard = search_index.Shard(directory, merged)
+    assert [doc["job_id"] for doc in shard.docs] == ["job-a", "job-b"]
+    assert "lumang" not in shard.terms
+    assert shard.postings("kopya") == [(0, 0, 1), (1, 0, 1)]
+    assert shard.start_seconds(1, 1) == 2.5
+    shard.close()
+
+
+def test_parse_query():
+    assert search_index.parse_query('"Magandang umaga" pray* mag-aaral Po') == [
+        ("phrase", ["magandang", "umaga"]),
+        ("prefix", ["pray"]),
+        ("phrase", ["mag", "aaral"]),
+        ("term", ["po"]),
+    ]
+    assert search_index.parse_query('"" *') == []
+
+
+def test_search_terms_phrases_and_prefixes(tmp_path):
+    search = index(tmp_path)
+    assert [(hit.job_id, hit.segment) for hit in search.search("umaga")] == [("job-b", 1), ("job-a", 0)]
+    assert [(hit.job_id, hit.segment) for hit in search.search('"magandang umaga"')] == [("job-a", 0)]
+    assert [(hit.job_id, hit.start) for hit in search.search("pra*")] == [("job-b", 2.5), ("job-a", 2.5)]
+    # Every clause must match within the same segment
+    assert [hit.job_id for hit in search.search("gabi pray")] == []
+    assert [hit.job_id for hit in search.search("mag-aaral")] == ["job-a"]
+
+
+def test_search_after_reindex_and_merge(tmp_path):
+    search = index(tmp_path)
+    search.add_transcript("job-a", "umaga.mp3", "2024-05-01", transcript("Bagong bersyon."), merge=False)
+    assert [hit.job_id for hit in search.search("umaga")] == ["job-b"]
+    search.compact()
+    assert [hit.job_id for hit in search.search("bagong")] == ["job-a"]
+    search.remove("job-b")
+    assert search.search("umaga") == []
@@ -0,0 +1,65 @@
+import segments
+from segments import SegmentList
+
+
+def transcript():
+    items = SegmentList.from_dicts([
+        {"start": 0.0, "end": 2.5, "text": " Magandang umaga po. ", "avg_logprob": -0.2},
+        {"start": 2.5, "end": 3.0, "text": "   "},
+        {"start": 3.0, "end": 3661.25, "text": "Let us pray.", "avg_logprob": None},
+        {"start": 3661.25, "end": None, "text": "Amen."},
+    ])
+    items.speakers[0] = items.speakers[1] = "Speaker A"
+    return items
+
+
+def test_from_dicts_skips_empty_text():
+    items = transcript()
+    assert items.texts == ["Magandang umaga po.", "Let us pray.", "Amen."]
+    assert items[2].end == items[2].start
+    assert items[0].avg_logprob == -0.2
+    assert items[1].avg_logprob is None
+
+
+def test_pages_round_trip():
+    items = transcript()
+    pages = items.to_pages(page_size=2)
+    assert [page["first_index"] for page in pages] == [0, 2]
+    assert pages[0]["avg_logprob"] == [-0.2, None]
+
+    # Pages may come back from Firestore in any order
+    restored = SegmentList.from_pages(reversed(pages))
+    assert list(restored) == list(items)
+
+
+def test_pages_without_speakers_omit_them():
+    items = SegmentList.from_dicts([{"start": 1.0, "end": 2.0, "text": "Walang label"}])
+    (page,) = items.to_pages()
+    assert "speaker" not in page
+    assert SegmentList.from_pages([page]).speakers == [None]
+
+
+def test_render_srt():
+    assert transcript().render("srt") == (
+        "1\n00:00:00,000 --> 00:00:02,500\nSpeaker A: Magandang umaga po.\n\n"
+        "2\n00:00:03,000 --> 01:01:01,250\nSpeaker A: Let us pray.\n\n"
+        "3\n01:01:01,250 --> 01:01:01,250\nAmen.\n\n"
+    )
+
+
+def test_render_vtt():
+    assert transcript().render("vtt") == (
+        "WEBVTT\n\n"
+        "00:00:00.000 --> 00:00:02.500\n<v Speaker A>Magandang umaga po.\n\n"
+        "00:00:03.000 --> 01:01:01.250\n<v Speaker A>Let us pray.\n\n"
+        "01:01:01.250 --> 01:01:01.250\nAmen.\n\n"
+    )
+
+
+def test_markdown_labels_speaker_changes_only():
+    assert transcript().render("md") == (
+        "**[0:00:00]** **Speaker A:** Magandang umaga po.\n\n"
+        "**[0:00:03]** Let us pray.\n\n"
+        "**[1:01:01]** Amen.\n\n"
+    )
+    assert segments.format_timestamp(3599.9) == "[0:59:59]"
@@ -0,0 +1,62 @@
+import chunk_planner
+import vad
+
+REGIONS = [(1000, 3000), (10000, 12000)]
+
+
+def envelope(seconds, quiet):
+    """50ms RMS windows: speech level throughout, except the (start_ms, end_ms) stretches in `quiet`."""
+    window_ms = chunk_planner.ENVELOPE_WINDOW_MS
+    return [10.0 if any(start <= i * window_ms < end for start, end in quiet) else 3000.0
+            for i in range(seconds * 1000 // window_ms)]
+
+
+def test_offset_map_maps_packed_times_back():
+    offset_map = vad.OffsetMap(REGIONS)
+    assert offset_map.packed_ms == 4000
+    assert offset_map.to_source_ms(500) == 1500
+    assert offset_map.to_source_ms(3500) == 11500
+    # Past the end of the packed audio stays at the end of the last region
+    assert offset_map.to_source_ms(5000) == 12000
+
+
+def test_offset_map_region_boundary():
+    offset_map = vad.OffsetMap(REGIONS)
+    # A start on the boundary belongs to the next region, an end to the previous one
+    assert offset_map.to_source_ms(2000) == 10000
+    assert offset_map.to_source_ms(2000, at_end=True) == 3000
+
+
+def test_to_global():
+    segments = vad.OffsetMap(REGIONS).to_global([
+        {"start": 0.5, "end": 2.0, "text": "Magandang umaga"},
+        {"start": 2.0, "end": 3.9, "text": "po"},
+        {"start": 3.0, "end": None, "text": "Amen"},
+    ])
+    assert [(segment["start"], segment["end"]) for segment in segments] == [(1.5, 3.0), (10.0, 11.9), (11.0, 11.0)]
+    assert segments[1]["text"] == "po"
+
+
+def test_skipped_spans():
+    stats = {"total_ms": 20000, "music_regions_ms": [4000, 9000]}
+    assert vad.skipped_spans(REGIONS, stats) == [
+        {"start": 3.0, "end": 10.0, "kind": "music"},
+        {"start": 12.0, "end": 20.0, "kind": "silence"},
+    ]
+
+
+def test_speech_chunks_tile_the_recording(monkeypatch):
+    quiet = [(0, 5000), (20000, 30000), (45000, 60000)]
+    monkeypatch.setattr(chunk_planner, "iter_envelope", lambda *args, **kwargs: iter(envelope(60, quiet)))
+    stats = {}
+    plan = list(vad.plan_speech_chunks("recording.mp3", 12000, mode="silence", stats=stats))
+
+    specs = [spec for spec, _ in plan]
+    assert specs[0].start_ms == 0 and specs[-1].end_ms == 60000
+    assert all(a.end_ms == b.start_ms for a, b in zip(specs, specs[1:]))
+    for spec, regions in plan:
+        assert sum(end - start for start, end in regions) <= 12000
+        assert all(spec.start_ms <= start < end <= spec.end_ms for start, end in regions)
+    # Nothing in the silent stretches is sent
+    assert not any(start < 4000 or 21000 < start < 29000 for _, regions in plan for start, _ in regions)
+    assert stats["total_ms"] == 60000 and stats["music_ms"] == 0
@@ -0,0 +1,166 @@
+"""
+Content-addressed cache for Whisper results.
+
+Entries are keyed by (audio content hash, chunk start/end, model, temperature,
+prompt) and hold the raw verbose_json segments, so re-running a recording
+(new context aside) never pays for the same Whisper call twice.
+
+The local tier is a size-capped LRU directory on disk. An optional Firestore
+tier lets cache hits survive container restarts and be shared between
+instances.
+"""
+import hashlib
+import json
+import os
+import threading
+
+CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "/tmp/transcription_cache")
+CACHE_MAX_BYTES = int(float(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "100")) * 1024 * 1024)
+# Set to "1" to back the local cache with the Firestore "transcription_cache" collection
+USE_FIRESTORE_TIER = os.getenv("TRANSCRIPT_CACHE_FIRESTORE", "0") == "1"
+FIRESTORE_COLLECTION = "transcription_cache"
+
+
+def audio_content_hash(path, block_size=1024 * 1024):
+    """SHA-256 of the file contents, read in blocks so large uploads never sit in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(audio_hash, start_ms, end_ms, model, temperature, prompt):
+    """Stable key for one chunk transcription request."""
+    payload = json.dumps(
+        [audio_hash, int(start_ms), int(end_ms), model, float(temperature), prompt],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """Local JSON-file cache, evicting least recently used entries past max_bytes."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """Yields (path, mtime, size) for every cached entry."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                segments = json.load(f)
+            os.utime(path)  # mark as recently used
+            return segments
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key, segments):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(segments, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            # Overwriting an entry only adds the difference in size
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops the oldest entries until the cache is back under 90% of its cap."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+
+class FirestoreCache:
+    """Shared cache tier stored as one small document per key."""
+
+    def __init__(self, db, collection=FIRESTORE_COLLECTION):
+        self.collection = db.collection(collection)
+
+    def get(self, key):
+        doc = self.collection.document(key).get()
+        if doc.exists:
+            return doc.to_dict().get("segments")
+        return None
+
+    def put(self, key, segments):
+        self.collection.document(key).set({"segments": segments})
+
+
+class TieredCache:
+    """Checks the local tier first, then the shared tier (promoting hits locally)."""
+
+    def __init__(self, local, remote=None):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key):
+        segments = self.local.get(key)
+        if segments is None and self.remote is not None:
+            try:
+                segments = self.remote.get(key)
+            except Exception as e:
+                print(f"Shared cache read failed: {e}")
+                segments = None
+            if segments is not None:
+                self.local.put(key, segments)
+        return segments
+
+    def put(self, key, segments):
+        self.local.put(key, segments)
+        if self.remote is not None:
+            try:
+                self.remote.put(key, segments)
+            except Exception as e:
+                print(f"Shared cache write failed: {e}")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache(db=None):
+    """Process-wide cache instance (the local tier is shared by every job)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            remote = FirestoreCache(db) if (USE_FIRESTORE_TIER and db is not None) else None
+            _default_cache = TieredCache(DiskCache(), remote)
+        return _default_cache
@@ -0,0 +1,374 @@
+"""
+Parallel, resumable browser uploads that can be transcribed while they arrive.
+
+The browser no longer PUTs the whole recording in one request (one dropped
+connection on church Wi-Fi meant starting a 400 MB upload over). Instead:
+
+1. It PUTs a small manifest (size, part size, part count) to
+   {upload}.parts/manifest.json.
+2. It cuts the file into UPLOAD_PART_MB parts and PUTs them, lowest first,
+   several at a time, each to its own signed URL. A failed part is retried
+   on its own with backoff; nothing else is sent again. Only the first
+   UPLOAD_SIGN_BATCH_PARTS part URLs are signed up front; for a longer
+   file the app signs the rest once the manifest says how many there are
+   and leaves them in {upload}.parts/part_urls.json for the browser.
+3. Once every part is in, the parts are composed server-side into {upload}
+   (Storage compose, no data passes through us) and the part objects are
+   deleted.
+
+Every upload gets its own name, uploads/{upload_id}/{filename} (see
+object_name), so a second recording with the same filename never meets the
+first one's object or parts. Jobs from before upload ids read
+uploads/{filename}.
+
+Transcription can start as soon as the first part is in. The worker then
+reads the upload through a local HTTP proxy that serves byte ranges of the
+parts and waits for a part that has not arrived yet, so ffmpeg (probe,
+planner, chunk cuts, diarization) sees one ordinary seekable file and the
+pipeline does not change. mp3 and wav stream front to back; an m4a whose
+index sits at the end of the file only starts once its last part is in.
+A part that does not arrive within UPLOAD_STALL_MINUTES fails the job
+(ffmpeg alone would take the cut-off file for a short recording); its
+finished chunks are kept for a resume once the upload is complete.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+import ingest
+
+PART_SIZE = int(float(os.getenv("UPLOAD_PART_MB", "16")) * 1024 * 1024)
+# Larger uploads are refused; no more part URLs are signed than this needs
+MAX_UPLOAD_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "1024")) * 1024 * 1024)
+PARALLEL_PARTS = int(os.getenv("UPLOAD_PARALLEL_PARTS", "4"))
+# Part URLs signed with the upload (128 MB in the default 16 MB parts)
+SIGN_BATCH_PARTS = int(os.getenv("UPLOAD_SIGN_BATCH_PARTS", "8"))
+# The part URLs have to outlast a slow upload
+URL_EXPIRATION = timedelta(hours=int(os.getenv("UPLOAD_URL_HOURS", "3")))
+# A job waiting for a part gives up after this long without one arriving
+STALL_SECONDS = int(os.getenv("UPLOAD_STALL_MINUTES", "30")) * 60
+POLL_SECONDS = 3
+# How often a waiting job reports that it is waiting
+WAIT_REPORT_SECONDS = 30
+# Storage composes at most this many objects at once
+COMPOSE_LIMIT = 32
+# Bytes fetched from a part per Storage request while proxying
+READ_BYTES = 1024 * 1024
+
+MANIFEST_NAME = "manifest.json"
+PART_URLS_NAME = "part_urls.json"
+
+
+def object_name(filename, upload_id=None):
+    """Storage name of an upload (uploads/{filename} for jobs made before upload ids)."""
+    return f"uploads/{upload_id}/{filename}" if upload_id else f"uploads/{filename}"
+
+
+def parts_prefix(name):
+    return f"{name}.parts/"
+
+
+def part_name(name, number):
+    return f"{parts_prefix(name)}{number:05d}"
+
+
+def _sign(bucket, name, method, content_type=None):
+    return bucket.blob(name).generate_signed_url(
+        version="v4",
+        expiration=URL_EXPIRATION,
+        method=method,
+        content_type=content_type,
+    )
+
+
+def create_upload(bucket, filename, content_type):
+    """
+    Starts an upload under a new upload id: signed URLs for the manifest,
+    for the part URLs still to come (see sign_more_parts) and for the first
+    SIGN_BATCH_PARTS parts.
+    """
+    max_parts = -(-MAX_UPLOAD_BYTES // PART_SIZE)
+    upload_id = uuid.uuid4().hex
+    name = object_name(filename, upload_id)
+    return {
+        "upload_id": upload_id,
+        "part_size": PART_SIZE,
+        "parallel": PARALLEL_PARTS,
+        "content_type": content_type,
+        "max_parts": max_parts,
+        "manifest_url": _sign(bucket, parts_prefix(name) + MANIFEST_NAME, "PUT", "application/json"),
+        "part_urls_url": _sign(bucket, parts_prefix(name) + PART_URLS_NAME, "GET"),
+        "part_urls": [
+            _sign(bucket, part_name(name, number), "PUT", content_type)
+            for number in range(min(SIGN_BATCH_PARTS, max_parts))
+        ],
+    }
+
+
+def sign_more_parts(bucket, filename, upload, part_urls):
+    """
+    Signs the part URLs the browser's manifest needs beyond `part_urls` (the
+    ones it has, extended in place) and stores them all for the browser in
+    {upload}.parts/part_urls.json. Does nothing until the manifest is in.
+    """
+    name = object_name(filename, upload["upload_id"])
+    manifest = load_manifest(bucket, name)
+    if manifest is None:
+        return
+    parts = min(manifest["parts"], upload["max_parts"])
+    if parts <= len(part_urls):
+        return
+    part_urls += [
+        _sign(bucket, part_name(name, number), "PUT", upload["content_type"])
+        for number in range(len(part_urls), parts)
+    ]
+    bucket.blob(parts_prefix(name) + PART_URLS_NAME).upload_from_string(
+        json.dumps({"part_urls": part_urls}), content_type="application/json"
+    )
+    print(f"🔏 Signed {parts} part URLs for {name}")
+
+
+def load_manifest(bucket, name):
+    """The browser's manifest for an upload in parts, or None."""
+    blob = bucket.get_blob(parts_prefix(name) + MANIFEST_NAME)
+    if blob is None:
+        return None
+    return json.loads(blob.download_as_bytes())
+
+
+def uploaded_parts(bucket, name, manifest):
+    """Numbers of the parts that are completely in Storage."""
+    done = set()
+    for blob in bucket.list_blobs(prefix=parts_prefix(name)):
+        name = blob.name.rsplit("/", 1)[-1]
+        if name.isdigit() and blob.size == expected_part_size(manifest, int(name)):
+            done.add(int(name))
+    return done
+
+
+def expected_part_size(manifest, number):
+    return max(0, min(manifest["part_size"], manifest["size"] - number * manifest["part_size"]))
+
+
+def compose_parts(bucket, name, manifest):
+    """
+    Assembles the upload `name` from its parts (composites of at most
+    COMPOSE_LIMIT objects, nested for longer uploads) and deletes the parts.
+    Safe to call twice: only the first call creates the upload. The parts
+    are only deleted once the upload is in Storage at its full size.
+    """
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+
+    sources = [bucket.blob(part_name(name, number)) for number in range(manifest["parts"])]
+    target = bucket.blob(name)
+    target.content_type = manifest.get("content_type")
+    try:
+        level = 0
+        while len(sources) > COMPOSE_LIMIT:
+            grouped = []
+            for start in range(0, len(sources), COMPOSE_LIMIT):
+                blob = bucket.blob(f"{parts_prefix(name)}compose_{level}_{start // COMPOSE_LIMIT:05d}")
+                blob.compose(sources[start:start + COMPOSE_LIMIT])
+                grouped.append(blob)
+            sources = grouped
+            level += 1
+        target.compose(sources, if_generation_match=0)
+        print(f"📦 Composed {manifest['parts']} parts into {target.name}")
+    except (PreconditionFailed, NotFound):
+        # Another instance may have got there first (and removed the parts);
+        # anything else keeps the parts and fails loudly
+        existing = bucket.get_blob(name)
+        if existing is None or existing.size != manifest["size"]:
+            raise RuntimeError(f"Could not compose {name}: it exists with a different size or its parts are gone")
+    bucket.delete_blobs(list(bucket.list_blobs(prefix=parts_prefix(name))), on_error=lambda blob: None)
+
+
+class _PartsHandler(BaseHTTPRequestHandler):
+    """Serves byte ranges of the logical file the parts make up."""
+
+    proxy = None
+
+    def do_HEAD(self):
+        self._send_headers(200, 0, self.proxy.size)
+
+    def do_GET(self):
+        size = self.proxy.size
+        start, end = 0, size
+        header = self.headers.get("Range", "")
+        if header.startswith("bytes="):
+            first, _, last = header[len("bytes="):].split(",")[0].partition("-")
+            start = int(first or 0)
+            end = min(size, int(last) + 1) if last else size
+        if start >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+        try:
+            self.proxy.wait_for_part(start // self.proxy.part_size)
+        except TimeoutError as e:
+            self.proxy.fail(e)
+            self.send_error(504, str(e))
+            return
+        self._send_headers(206 if header else 200, start, end)
+        try:
+            for data in self.proxy.read(start, end):
+                self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg closes the connection whenever it seeks
+            pass
+        except TimeoutError as e:
+            # ffmpeg may take the short body for the end of the file
+            self.proxy.fail(e)
+            print(f"⚠️ Upload stalled: {e}")
+
+    def _send_headers(self, status, start, end):
+        self.send_response(status)
+        self.send_header("Content-Type", self.proxy.content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{self.proxy.size}")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PartsProxy:
+    """A localhost HTTP server that reads an upload from its parts, waiting for parts still on their way."""
+
+    def __init__(self, bucket, name, manifest, on_wait=None, stall_seconds=STALL_SECONDS):
+        self.bucket = bucket
+        self.name = name
+        self.manifest = manifest
+        self.size = manifest["size"]
+        self.part_size = manifest["part_size"]
+        self.content_type = manifest.get("content_type") or "application/octet-stream"
+        self.on_wait = on_wait
+        self.stall_seconds = stall_seconds
+        # The first part that never arrived (a TimeoutError), or None
+        self.error = None
+        self._ready = set()
+        self._lock = threading.Lock()
+        self._last_report = 0
+
+        handler = type("PartsHandler", (_PartsHandler,), {"proxy": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}/{quote(name.rsplit('/', 1)[-1])}"
+
+    def wait_for_part(self, number):
+        """Blocks until part `number` is in Storage; TimeoutError if the upload stalls."""
+        if number in self._ready:
+            return
+        blob_name = part_name(self.name, number)
+        expected = expected_part_size(self.manifest, number)
+        deadline = time.time() + self.stall_seconds
+        while True:
+            blob = self.bucket.get_blob(blob_name)
+            if blob is not None and blob.size == expected:
+                with self._lock:
+                    self._ready.add(number)
+                return
+            if time.time() > deadline:
+                raise TimeoutError(f"part {number + 1} of {self.manifest['parts']} never arrived")
+            if self.on_wait and time.time() - self._last_report > WAIT_REPORT_SECONDS:
+                self._last_report = time.time()
+                self.on_wait(number, self.manifest["parts"])
+            time.sleep(POLL_SECONDS)
+
+    def fail(self, error):
+        """Records a read that gave up waiting for a part."""
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def read(self, start, end):
+        """Yields the bytes [start, end) of the upload, part by part."""
+        position = start
+        while position < end:
+            number = position // self.part_size
+            self.wait_for_part(number)
+            part_start = number * self.part_size
+            stop = min(end, part_start + self.part_size, position + READ_BYTES)
+            yield self.bucket.blob(part_name(self.name, number)).download_as_bytes(
+                start=position - part_start, end=stop - part_start - 1
+            )
+            position = stop
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class UploadStalled(Exception):
+    """A part of the upload never arrived while the job was reading it."""
+
+
+class PartsSource(ingest.AudioSource):
+    """An AudioSource for an upload still arriving in parts; closing it composes the parts if they are all in."""
+
+    def __init__(self, proxy, content_hash, scratch_max_bytes=ingest.SCRATCH_MAX_BYTES):
+        super().__init__(proxy.url, content_hash, proxy.size, scratch_max_bytes=scratch_max_bytes)
+        self.proxy = proxy
+
+    @property
+    def error(self):
+        if self.proxy.error is None:
+            return None
+        return UploadStalled(f"The upload stalled: {self.proxy.error}. Finish the upload, then resume the job.")
+
+    def close(self):
+        self.proxy.close()
+        bucket, name, manifest = self.proxy.bucket, self.proxy.name, self.proxy.manifest
+        try:
+            if len(uploaded_parts(bucket, name, manifest)) == manifest["parts"]:
+                compose_parts(bucket, name, manifest)
+        except Exception as e:
+            print(f"⚠️ Could not compose the uploaded parts of {name}: {e}")
+
+
+def open_upload(bucket, filename, local_path, on_wait=None, upload_id=None):
+    """
+    AudioSource for the upload: the object itself, or its parts while they
+    are still arriving (see ingest.open_source for the former).
+    `on_wait(part, parts)` is called while a needed part has not arrived.
+    """
+    name = object_name(filename, upload_id)
+    blob = bucket.blob(name)
+    if not blob.exists():
+        manifest = load_manifest(bucket, name)
+        if manifest is not None:
+            if len(uploaded_parts(bucket, name, manifest)) < manifest["parts"]:
+                print(f"📡 {name} is still uploading; reading it part by part")
+                # The upload has no checksum yet; the browser's upload id stands in for it
+                content_hash = f"upload:{manifest.get('upload_id')}:{manifest['size']}"
+                return PartsSource(PartsProxy(bucket, name, manifest, on_wait=on_wait), content_hash)
+            compose_parts(bucket, name, manifest)
+    return ingest.open_source(blob, local_path)
+
+
+def can_start(bucket, filename, upload_id=None):
+    """True once the upload, or at least its first part, is in Storage."""
+    name = object_name(filename, upload_id)
+    if bucket.blob(name).exists():
+        return True
+    manifest = load_manifest(bucket, name)
+    return manifest is not None and 0 in uploaded_parts(bucket, name, manifest)
+
+
+def upload_size(bucket, filename, upload_id=None):
+    """Size in bytes of the upload (or of the file being uploaded in parts), or None."""
+    name = object_name(filename, upload_id)
+    blob = bucket.get_blob(name)
+    if blob is not None:
+        return blob.size
+    manifest = load_manifest(bucket, name)
+    return manifest["size"] if manifest else None
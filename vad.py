@@ -0,0 +1,245 @@
+"""
+Voice-activity pre-filter: only speech is sent for transcription.
+
+Runs on the same cheap RMS envelope as the chunk planner (mono 8 kHz, one
+value per 50ms window, streamed out of ffmpeg):
+
+1. Windows louder than VAD_SILENCE_DBFS are voiced. Voiced stretches
+   separated by less than MIN_GAP_MS are joined into regions, padded by
+   PAD_MS, and blips shorter than MIN_SPEECH_MS are dropped.
+2. In "speech" mode, long regions that never dip between words are treated
+   as music (worship songs, instrumental breaks) and dropped too. Speech
+   falls well below its median level many times a second; sustained music
+   hardly ever does.
+3. The remaining regions are packed into dense chunks of up to the chunk
+   length, so a chunk holds speech only. Each chunk keeps its regions as an
+   offset map, which turns chunk-relative Whisper times back into times in
+   the original recording.
+
+VAD_MODE: "off" (send everything, the default), "silence" (drop silence
+only) or "speech" (drop silence and music). The music heuristic can mistake
+loud, continuous speech for music, so dropping it is opt-in. Whatever was
+dropped is listed on the job (skipped_spans) and shown with the transcript.
+"""
+import bisect
+import os
+from collections import namedtuple
+from array import array
+
+import chunk_planner
+from chunk_planner import ChunkSpec
+
+VAD_MODE = os.getenv("VAD_MODE", "off").strip().lower()
+VAD_SILENCE_DBFS = float(os.getenv("VAD_SILENCE_DBFS", "-45"))
+# Pauses shorter than this stay inside a region (breaths, gaps between sentences)
+MIN_GAP_MS = 1500
+PAD_MS = 250
+MIN_SPEECH_MS = 300
+# Music detection: only regions at least this long, dipping below 25% of
+# their median level in fewer than this fraction of windows
+MUSIC_MIN_MS = 30 * 1000
+MUSIC_MAX_DIP_FRACTION = 0.03
+# Skipped stretches shorter than this (pauses between sentences) are not listed on the job
+SKIPPED_MIN_MS = 3000
+
+# Region kinds
+SPEECH, MUSIC = "speech", "music"
+
+Region = namedtuple("Region", ["start_ms", "end_ms", "kind"])
+
+
+def _threshold_rms(dbfs=VAD_SILENCE_DBFS):
+    return 32768 * 10 ** (dbfs / 20)
+
+
+def classify(envelope, start_ms, end_ms, window_ms=chunk_planner.ENVELOPE_WINDOW_MS):
+    """SPEECH or MUSIC for a voiced region, from how often it dips between words."""
+    if end_ms - start_ms < MUSIC_MIN_MS:
+        return SPEECH
+    values = sorted(envelope[start_ms // window_ms:end_ms // window_ms])
+    if not values:
+        return SPEECH
+    median = values[len(values) // 2]
+    dips = bisect.bisect_left(values, median * 0.25)
+    return MUSIC if dips / len(values) < MUSIC_MAX_DIP_FRACTION else SPEECH
+
+
+def iter_regions(source_path, envelope=None, mode=None, window_ms=chunk_planner.ENVELOPE_WINDOW_MS):
+    """
+    Streams the envelope and yields voiced Regions as soon as each one ends.
+
+    Every envelope value is also appended to `envelope` (an array("d")) so
+    callers can look back at the audio, e.g. to split long regions at pauses.
+    """
+    mode = mode or VAD_MODE
+    envelope = envelope if envelope is not None else array("d")
+    threshold = _threshold_rms()
+    gap_windows = MIN_GAP_MS // window_ms
+
+    first_voiced = last_voiced = None
+    for rms in chunk_planner.iter_envelope(source_path, window_ms=window_ms):
+        envelope.append(rms)
+        position = len(envelope) - 1
+        if rms > threshold:
+            if first_voiced is None:
+                first_voiced = position
+            last_voiced = position
+        elif last_voiced is not None and position - last_voiced >= gap_windows:
+            region = _close_region(envelope, first_voiced, last_voiced, window_ms, mode)
+            if region is not None:
+                yield region
+            first_voiced = last_voiced = None
+
+    if last_voiced is not None:
+        region = _close_region(envelope, first_voiced, last_voiced, window_ms, mode)
+        if region is not None:
+            yield region
+
+
+def _close_region(envelope, first, last, window_ms, mode):
+    start_ms = max(0, first * window_ms - PAD_MS)
+    end_ms = min(len(envelope) * window_ms, (last + 1) * window_ms + PAD_MS)
+    if end_ms - start_ms < MIN_SPEECH_MS + 2 * PAD_MS:
+        return None
+    kind = classify(envelope, start_ms, end_ms, window_ms) if mode == "speech" else SPEECH
+    return Region(start_ms, end_ms, kind)
+
+
+def _split_long(region, envelope, chunk_ms, window_ms):
+    """Splits a region longer than chunk_ms at pauses near each limit."""
+    start_ms = region.start_ms
+    search_ms = min(chunk_planner.SEARCH_WINDOW_MS, chunk_ms // 2)
+    while region.end_ms - start_ms > chunk_ms:
+        hard_cut_ms = start_ms + chunk_ms
+        cut_ms, _ = chunk_planner.find_cut(envelope, hard_cut_ms - search_ms, hard_cut_ms, window_ms)
+        cut_ms = max(start_ms + window_ms, min(cut_ms, hard_cut_ms))
+        yield Region(start_ms, cut_ms, region.kind)
+        start_ms = cut_ms
+    yield Region(start_ms, region.end_ms, region.kind)
+
+
+def plan_speech_chunks(source_path, chunk_ms, mode=None, stats=None, window_ms=chunk_planner.ENVELOPE_WINDOW_MS):
+    """
+    Yields (ChunkSpec, [(start_ms, end_ms), ...]) for dense speech-only chunks.
+
+    Specs still tile the recording end to end (cut in the middle of the
+    dropped gaps) so the plan can be stored and resumed like any other; the
+    regions list says which parts of the spec are actually transcribed.
+    `stats`, if given, is a dict updated with total/speech/music milliseconds
+    and the dropped music regions (flat [start, end, ...] list).
+    """
+    envelope = array("d")
+    stats = stats if stats is not None else {}
+    stats.update(mode=mode or VAD_MODE, total_ms=0, speech_ms=0, music_ms=0, music_regions_ms=[])
+
+    index = 0
+    chunk_start_ms = 0
+    pending, packed_ms = [], 0
+    for region in iter_regions(source_path, envelope, mode, window_ms):
+        if region.kind == MUSIC:
+            stats["music_ms"] += region.end_ms - region.start_ms
+            stats["music_regions_ms"] += [region.start_ms, region.end_ms]
+            continue
+        for piece in _split_long(region, envelope, chunk_ms, window_ms):
+            length = piece.end_ms - piece.start_ms
+            if pending and packed_ms + length > chunk_ms:
+                cut_ms = (pending[-1][1] + piece.start_ms) // 2
+                yield ChunkSpec(index, chunk_start_ms, cut_ms), pending
+                index += 1
+                chunk_start_ms, pending, packed_ms = cut_ms, [], 0
+            pending.append((piece.start_ms, piece.end_ms))
+            packed_ms += length
+            stats["speech_ms"] += length
+
+    stats["total_ms"] = len(envelope) * window_ms
+    if pending:
+        yield ChunkSpec(index, chunk_start_ms, max(pending[-1][1], stats["total_ms"])), pending
+
+
+class OffsetMap:
+    """Maps times in a packed chunk back to times in the original recording."""
+
+    def __init__(self, regions):
+        self.regions = list(regions)
+        self.offsets = []  # where each region starts inside the packed chunk
+        offset = 0
+        for start_ms, end_ms in self.regions:
+            self.offsets.append(offset)
+            offset += end_ms - start_ms
+        self.packed_ms = offset
+
+    def to_source_ms(self, chunk_ms, at_end=False):
+        """
+        Recording time of a chunk time. A time exactly on a region boundary
+        belongs to the next region, or to the previous one when `at_end`
+        (so a segment ending there does not jump across the dropped gap).
+        """
+        if at_end:
+            i = bisect.bisect_left(self.offsets, chunk_ms) - 1
+        else:
+            i = bisect.bisect_right(self.offsets, chunk_ms) - 1
+        i = min(max(i, 0), len(self.regions) - 1)
+        start_ms, end_ms = self.regions[i]
+        return min(end_ms, start_ms + (chunk_ms - self.offsets[i]))
+
+    def to_global(self, segments):
+        """Returns copies of Whisper segments with start/end in recording seconds."""
+        mapped = []
+        for segment in segments:
+            start = self.to_source_ms(segment["start"] * 1000) / 1000
+            end = segment.get("end")
+            end = self.to_source_ms(end * 1000, at_end=True) / 1000 if end is not None else start
+            mapped.append(dict(segment, start=start, end=max(start, end)))
+        return mapped
+
+
+def regions_key(regions):
+    """Compact description of a chunk's regions, for cache keys."""
+    return ",".join(f"{start_ms}-{end_ms}" for start_ms, end_ms in regions)
+
+
+def skipped_spans(regions, stats, min_ms=SKIPPED_MIN_MS):
+    """
+    The stretches of the recording left out of the transcript, as
+    [{"start", "end", "kind"}] in seconds; kind is "music" or "silence".
+    """
+    flat = stats.get("music_regions_ms") or []
+    music = list(zip(flat[::2], flat[1::2]))
+    total_ms = stats.get("total_ms") or 0
+    spans, position = [], 0
+    for start_ms, end_ms in sorted(regions) + [(total_ms, total_ms)]:
+        if start_ms - position >= min_ms:
+            kind = MUSIC if any(m_start < start_ms and m_end > position for m_start, m_end in music) else "silence"
+            spans.append({"start": position / 1000, "end": start_ms / 1000, "kind": kind})
+        position = max(position, end_ms)
+    return spans
+
+
+def save_regions(doc_ref, regions, stats):
+    """Stores the speech regions (flat [start, end, ...] list), what was skipped and the VAD totals on the job."""
+    flat = []
+    for start_ms, end_ms in regions:
+        flat += [start_ms, end_ms]
+    doc_ref.update({
+        "speech_regions_ms": flat,
+        "skipped_spans": skipped_spans(regions, stats),
+        "vad_stats": {key: value for key, value in stats.items() if key != "music_regions_ms"},
+    })
+
+
+def load_regions(snapshot, plan):
+    """Rebuilds {chunk index: regions} for a stored plan, or None if the job was planned without VAD."""
+    data = snapshot.to_dict() or {}
+    flat = data.get("speech_regions_ms")
+    if flat is None or plan is None:
+        return None
+    starts = [spec.start_ms for spec in plan]
+    by_chunk = {}
+    for i in range(0, len(flat) - 1, 2):
+        index = max(0, bisect.bisect_right(starts, flat[i]) - 1)
+        by_chunk.setdefault(plan[index].index, []).append((flat[i], flat[i + 1]))
+    return by_chunk
+
+
+def load_stats(snapshot):
+    return (snapshot.to_dict() or {}).get("vad_stats")
@@ -0,0 +1,201 @@
+"""
+Transcription worker service.
+
+Runs the transcription pipeline outside the Streamlit process so jobs survive
+UI instances scaling down and do not compete with the UI for CPU:
+
+    python -m worker --jobs 2
+
+The worker claims `queued` jobs from the `transcripts` collection with a
+lease, renews the lease while each job runs and releases it when the job is
+finished; a job whose lease another worker took over is stopped. Which job
+it claims is up to the scheduler (see scheduler.py).
+It also keeps the queued jobs' positions and estimated start times up to
+date. Pass --local-queue PATH (or set JOB_QUEUE=sqlite:PATH for both the
+UI and the worker) to use the SQLite stand-in instead.
+
+On Cloud Run the worker is deployed as its own service (see deploy.sh); when
+PORT is set it answers health checks on that port and serves Prometheus
+metrics on /metrics.
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import job_queue
+import metrics
+import resources
+import scheduler
+from pipeline import background_worker
+
+WORKER_JOBS = int(os.getenv("WORKER_JOBS", "2"))
+POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "5"))
+
+
+def run_job(job, db, cancel=None):
+    """Runs a claimed job through the pipeline; setting `cancel` stops it."""
+    data = job.data
+    background_worker(
+        job.job_id,
+        data["filename"],
+        data.get("context_provided", ""),
+        data.get("temperature", 0.0),
+        db,
+        upload_id=data.get("upload_id"),
+        cancel=cancel,
+    )
+
+
+class Worker:
+    """Claims jobs from a queue and runs up to `max_jobs` of them concurrently."""
+
+    def __init__(self, queue, db, max_jobs=WORKER_JOBS, poll_seconds=POLL_SECONDS, worker_id=None):
+        self.queue = queue
+        self.db = db
+        self.max_jobs = max_jobs
+        self.poll_seconds = poll_seconds
+        self.worker_id = worker_id or job_queue.default_worker_id()
+        self._stopping = threading.Event()
+        self._active = {}
+
+    def stop(self):
+        """Stops claiming new jobs; running jobs are left to finish."""
+        self._stopping.set()
+
+    def _keep_lease(self, job_id, done, cancel):
+        interval = max(1, self.queue.lease_seconds / 3)
+        while not done.wait(interval):
+            try:
+                if not self.queue.renew(job_id, self.worker_id):
+                    print(f"⚠️ Lease on {job_id} was taken over by another worker")
+                    # Two workers must not write the same job
+                    cancel.set()
+                    return
+            except Exception as e:
+                print(f"Lease renewal failed for {job_id}: {e}")
+
+    def _run(self, job):
+        done, cancel = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(job.job_id, done, cancel), daemon=True)
+        heartbeat.start()
+        try:
+            run_job(job, self.db, cancel)
+        finally:
+            done.set()
+            try:
+                self.queue.release(job.job_id, self.worker_id)
+            except Exception as e:
+                print(f"Failed to release {job.job_id}: {e}")
+
+    def _publish_positions(self):
+        try:
+            scheduler.publish_positions(self.db, self.queue.positions())
+        except Exception as e:
+            print(f"Could not refresh queue positions: {e}")
+
+    def run(self):
+        print(f"👷 Worker {self.worker_id} started (max {self.max_jobs} jobs)")
+        next_publish = 0
+        while not self._stopping.is_set():
+            if time.monotonic() >= next_publish:
+                next_publish = time.monotonic() + scheduler.PUBLISH_SECONDS
+                self._publish_positions()
+
+            # Forget finished jobs
+            for job_id, thread in list(self._active.items()):
+                if not thread.is_alive():
+                    del self._active[job_id]
+
+            job = None
+            if len(self._active) < self.max_jobs:
+                try:
+                    job = self.queue.claim(self.worker_id)
+                except Exception as e:
+                    print(f"Claim failed: {e}")
+
+            if job is None:
+                self._stopping.wait(self.poll_seconds)
+                continue
+
+            print(f"Claimed job {job.job_id}")
+            thread = threading.Thread(target=self._run, args=(job,), name=f"job-{job.job_id}")
+            self._active[job.job_id] = thread
+            thread.start()
+
+        for thread in list(self._active.values()):
+            thread.join()
+        print(f"Worker {self.worker_id} stopped")
+
+
+_inline_worker = None
+_inline_worker_lock = threading.Lock()
+
+
+def start_inline_worker(db, max_jobs=WORKER_JOBS):
+    """
+    Runs a worker loop in a daemon thread of the current process (once per process).
+    Used by app.py when INLINE_WORKER=1, for local development without a worker service.
+    """
+    global _inline_worker
+    with _inline_worker_lock:
+        if _inline_worker is None:
+            _inline_worker = Worker(job_queue.get_queue(db), db, max_jobs=max_jobs)
+            threading.Thread(target=_inline_worker.run, name="inline-worker", daemon=True).start()
+        return _inline_worker
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") == "/metrics":
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_health_checks(port):
+    """Cloud Run services must listen on $PORT even if they only process background work."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _HealthHandler)
+    threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Taglish Transcriber worker service")
+    parser.add_argument("--jobs", type=int, default=WORKER_JOBS, help="jobs to run concurrently")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    parser.add_argument("--local-queue", metavar="PATH", help="use a SQLite queue file instead of Firestore")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = resources.initialize_firebase()
+    if args.local_queue:
+        queue = job_queue.LocalJobQueue(args.local_queue)
+    else:
+        queue = job_queue.get_queue(db)
+
+    worker = Worker(queue, db, max_jobs=args.jobs, poll_seconds=args.poll_seconds)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+
+    if os.getenv("PORT"):
+        serve_health_checks(int(os.environ["PORT"]))
+
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()